@@ -0,0 +1,285 @@
+"""
+Controle de admissão das rotas de reconhecimento ao vivo.
+
+Sem limite, quando os frames chegam mais rápido do que o servidor processa, as
+requisições se acumulam até o timeout do cliente (60 s) e os resultados já chegam
+velhos. Aqui o trabalho passa por uma fila limitada, consumida por ADMISSION_WORKERS
+threads, com duas regras:
+
+- profundidade: cada origem (câmera, ou o cliente quando a câmera não é informada)
+  tem sua própria fila de até ADMISSION_MAX_PER_SOURCE frames, e o total é limitado
+  a ADMISSION_MAX_DEPTH. Com ADMISSION_POLICY=drop-oldest (padrão), um frame que
+  excede o limite da origem substitui o frame pendente mais antigo dela; com o total
+  cheio, o descartado é o mais antigo da maior fila (a câmera mais carregada cede
+  lugar). Com ADMISSION_POLICY=reject, o frame novo é recusado com 429 + Retry-After;
+- idade: um frame que esperaria (estimativa na chegada) ou esperou (na saída da fila)
+  mais que ADMISSION_MAX_AGE_MS é recusado com 503 + Retry-After (0 desativa).
+
+As filas das origens são atendidas em round-robin ponderado suave (o mesmo do nginx):
+a cada frame, cada origem com frames pendentes ganha crédito igual ao seu peso, a de
+maior crédito é atendida e perde a soma dos pesos. Pesos por câmera em
+ADMISSION_WEIGHTS ("entrada=2,patio=1"; padrão 1). Uma câmera que envia mais rápido
+só aumenta a própria fila: as outras continuam recebendo sua fração dos workers.
+
+Classes de prioridade: os frames ao vivo (LIVE) são sempre atendidos primeiro; os
+frames de vídeos enviados (BULK, /process-video) usam a capacidade que sobra, em no
+máximo ADMISSION_BULK_MAX_SHARE dos workers ao mesmo tempo (padrão 0.5, mínimo 1
+e no máximo todos menos 1), para que um frame ao vivo encontre um worker livre mesmo
+durante um vídeo. Exceção: com ADMISSION_WORKERS=1 o único worker também atende
+BULK (senão os vídeos nunca andariam), e um frame ao vivo pode esperar o frame de
+vídeo em andamento.
+Frames BULK não têm limite de profundidade nem de idade: quem envia controla quantos
+mantém na fila. QUEUE_WAIT e QUEUE_DEPTH são separados por classe.
+
+Frames recusados e descartados são contados em FRAMES_DROPPED por motivo
+(queue_full, overloaded, expired, superseded); por câmera, CAMERA_FRAMES conta os
+frames por resultado e CAMERA_LATENCY mede fila + processamento. O nome da câmera
+vem do cliente, então só as câmeras de ADMISSION_WEIGHTS ou ADMISSION_CAMERAS
+("entrada,patio") viram rótulo; as demais (e frames sem câmera) são contadas como
+UNKNOWN_CAMERA, o que limita a cardinalidade das séries. A profundidade real da
+fila é anunciada no header X-Queue-Depth.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+import metrics
+
+ADMISSION_WORKERS = int(os.getenv("ADMISSION_WORKERS", "2"))
+ADMISSION_MAX_DEPTH = int(os.getenv("ADMISSION_MAX_DEPTH", "16"))
+ADMISSION_MAX_AGE_MS = float(os.getenv("ADMISSION_MAX_AGE_MS", "3000"))
+ADMISSION_MAX_PER_SOURCE = int(os.getenv("ADMISSION_MAX_PER_SOURCE", "4"))
+ADMISSION_POLICY = os.getenv("ADMISSION_POLICY", "drop-oldest").lower()  # reject | drop-oldest
+ADMISSION_WEIGHTS = os.getenv("ADMISSION_WEIGHTS", "")  # "camera=peso,..."
+ADMISSION_BULK_MAX_SHARE = float(os.getenv("ADMISSION_BULK_MAX_SHARE", "0.5"))
+ADMISSION_CAMERAS = os.getenv("ADMISSION_CAMERAS", "")  # câmeras com rótulo próprio nas métricas
+
+# Classes de prioridade
+LIVE = "live"
+BULK = "bulk"
+
+# Rótulo das métricas por câmera para frames sem câmera informada
+UNKNOWN_CAMERA = "desconhecida"
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, weight = item.split("=", 1)
+            weights[name.strip()] = max(0.01, float(weight))
+    return weights
+
+
+def parse_names(spec: str) -> set:
+    return {name.strip() for name in spec.split(",") if name.strip()}
+
+
+class Rejected(Exception):
+    """Frame recusado ou descartado pelo controle de admissão."""
+
+    def __init__(self, reason: str, status_code: int, retry_after: int = 0):
+        super().__init__(reason)
+        self.reason = reason            # queue_full | overloaded | expired | superseded
+        self.status_code = status_code
+        self.retry_after = retry_after  # segundos
+
+
+class _Job:
+    __slots__ = ("fn", "args", "source", "camera", "priority", "enqueued_at", "future")
+
+    def __init__(self, fn: Callable, args: tuple, source: str, camera: str, priority: str = LIVE):
+        self.fn = fn
+        self.args = args
+        self.source = source
+        self.camera = camera
+        self.priority = priority
+        self.enqueued_at = time.perf_counter()
+        self.future = Future()
+
+
+class AdmissionQueue:
+    def __init__(self, workers: int = ADMISSION_WORKERS, max_depth: int = ADMISSION_MAX_DEPTH,
+                 max_age_s: float = ADMISSION_MAX_AGE_MS / 1000, policy: str = ADMISSION_POLICY,
+                 max_per_source: int = ADMISSION_MAX_PER_SOURCE, weights: Dict[str, float] = None,
+                 bulk_max_share: float = ADMISSION_BULK_MAX_SHARE, cameras: set = None):
+        """`cameras`: câmeras com rótulo próprio nas métricas, além das de `weights`."""
+        self.workers = max(1, workers)
+        self.max_depth = max(1, max_depth)
+        self.max_per_source = max(1, max_per_source)
+        self.max_age_s = max_age_s
+        self.policy = policy
+        self.weights = parse_weights(ADMISSION_WEIGHTS) if weights is None else weights
+        self.cameras = set(self.weights) | (parse_names(ADMISSION_CAMERAS) if cameras is None else set(cameras))
+        # Ao menos 1 worker fica livre para LIVE; com um único worker não há como reservar
+        self.bulk_slots = max(1, min(int(self.workers * bulk_max_share), self.workers - 1))
+        if self.workers == 1:
+            print("[admission] ADMISSION_WORKERS=1: frames de vídeo (BULK) dividem o único worker "
+                  "com os frames ao vivo.")
+        self._cond = threading.Condition()
+        self._queues: "Dict[str, deque[_Job]]" = {}  # origem -> frames pendentes
+        self._credit: Dict[str, float] = {}          # crédito do round-robin ponderado
+        self._pending = 0      # frames LIVE pendentes
+        self._running = 0
+        self._bulk: "deque[_Job]" = deque()
+        self._running_bulk = 0
+        self._service_s = 0.0  # média móvel do tempo de processamento de um frame
+        self._threads = []
+
+    def depth(self) -> int:
+        """Frames aguardando + em processamento (todas as classes)."""
+        return self._pending + len(self._bulk) + self._running
+
+    def live_depth(self) -> int:
+        """Frames LIVE aguardando + em processamento (o que um frame ao vivo enfrenta)."""
+        return self._pending + self._running - self._running_bulk
+
+    def _update_depth(self) -> None:
+        metrics.QUEUE_DEPTH.labels(LIVE).set(self.live_depth())
+        metrics.QUEUE_DEPTH.labels(BULK).set(len(self._bulk) + self._running_bulk)
+
+    def depth_by_source(self) -> Dict[str, int]:
+        with self._cond:
+            return {source: len(queue) for source, queue in self._queues.items()}
+
+    def _weight(self, source: str) -> float:
+        return self.weights.get(source, 1.0)
+
+    def _frames_ahead(self, source: str) -> float:
+        """Frames atendidos antes de um novo frame da origem, pela fração de cada fila no round-robin."""
+        own = len(self._queues.get(source, ())) + 1
+        share = own / self._weight(source)
+        return sum(min(len(queue), share * self._weight(other))
+                   for other, queue in self._queues.items() if other != source) + own - 1
+
+    def _expected_wait_s(self, ahead: float) -> float:
+        return ahead * self._service_s / max(1, self.workers - self._running_bulk)
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self._expected_wait_s(self._pending + 1)))
+
+    def _start(self) -> None:
+        # Threads criadas no primeiro frame (importar o módulo não inicia nada)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"admission-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def camera_label(self, camera: Optional[str]) -> str:
+        """Rótulo da câmera nas métricas: só câmeras configuradas, as demais viram UNKNOWN_CAMERA."""
+        return camera if camera in self.cameras else UNKNOWN_CAMERA
+
+    def _reject(self, reason: str, status_code: int, camera: str) -> Rejected:
+        metrics.FRAMES_DROPPED.labels(reason).inc()
+        metrics.CAMERA_FRAMES.labels(camera, reason).inc()
+        return Rejected(reason, status_code, self._retry_after())
+
+    def _evict_oldest(self, source: str) -> _Job:
+        queue = self._queues[source]
+        job = queue.popleft()
+        if not queue:
+            del self._queues[source]
+            self._credit.pop(source, None)
+        self._pending -= 1
+        return job
+
+    def submit(self, fn: Callable, *args, source: str = "", camera: Optional[str] = None,
+               priority: str = LIVE) -> Future:
+        """
+        Enfileira `fn(fila_ms, *args)` e devolve o Future do resultado (fila_ms = espera
+        na fila). A fila é a da câmera, se informada, senão a da origem (cliente).
+        Levanta Rejected se um frame LIVE não for admitido; frames BULK sempre entram.
+        """
+        source = camera or source
+        job = _Job(fn, args, source, self.camera_label(camera), priority)
+        dropped = None
+        with self._cond:
+            if not self._threads:
+                self._start()
+            if priority == BULK:
+                self._bulk.append(job)
+                self._update_depth()
+                self._cond.notify()
+                return job.future
+            if self.max_age_s and self._expected_wait_s(self._frames_ahead(source)) > self.max_age_s:
+                raise self._reject("overloaded", 503, job.camera)
+            own = len(self._queues.get(source, ()))
+            if own >= self.max_per_source or self._pending >= self.max_depth:
+                if self.policy != "drop-oldest":
+                    raise self._reject("queue_full", 429, job.camera)
+                victim = source if own >= self.max_per_source else \
+                    max(self._queues, key=lambda s: len(self._queues[s]))
+                dropped = self._evict_oldest(victim)
+            self._queues.setdefault(source, deque()).append(job)
+            self._pending += 1
+            self._update_depth()
+            self._cond.notify()
+        if dropped is not None:
+            metrics.FRAMES_DROPPED.labels("superseded").inc()
+            metrics.CAMERA_FRAMES.labels(dropped.camera, "superseded").inc()
+            dropped.future.set_exception(Rejected("superseded", 200))
+        return job.future
+
+    async def run(self, fn: Callable, *args, source: str = "", camera: Optional[str] = None,
+                  priority: str = LIVE):
+        """submit() aguardado sem bloquear o event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args, source=source, camera=camera, priority=priority))
+
+    def _has_work(self) -> bool:
+        return self._pending > 0 or (bool(self._bulk) and self._running_bulk < self.bulk_slots)
+
+    def _next_job(self) -> _Job:
+        """LIVE primeiro, em round-robin ponderado suave entre as origens; senão BULK."""
+        if not self._pending:
+            self._running_bulk += 1
+            return self._bulk.popleft()
+        total = 0.0
+        for source in self._queues:
+            weight = self._weight(source)
+            self._credit[source] = self._credit.get(source, 0.0) + weight
+            total += weight
+        chosen = max(self._queues, key=lambda s: self._credit[s])
+        self._credit[chosen] -= total
+        return self._evict_oldest(chosen)
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._has_work():
+                    self._cond.wait()
+                job = self._next_job()
+                self._running += 1
+            waited = time.perf_counter() - job.enqueued_at
+            started = time.perf_counter()
+            try:
+                # Cliente desconectado: o Future foi cancelado enquanto aguardava
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                metrics.QUEUE_WAIT.labels(job.priority).observe(waited)
+                if job.priority == LIVE and self.max_age_s and waited > self.max_age_s:
+                    job.future.set_exception(self._reject("expired", 503, job.camera))
+                    continue
+                try:
+                    job.future.set_result(job.fn(round(waited * 1000, 3), *job.args))
+                    result = "ok"
+                except BaseException as e:
+                    result = "error"
+                    job.future.set_exception(e)
+                if job.priority == LIVE:
+                    metrics.CAMERA_FRAMES.labels(job.camera, result).inc()
+                    metrics.CAMERA_LATENCY.labels(job.camera).observe(time.perf_counter() - job.enqueued_at)
+                with self._cond:
+                    elapsed = time.perf_counter() - started
+                    self._service_s = elapsed if not self._service_s else 0.8 * self._service_s + 0.2 * elapsed
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    if job.priority == BULK:
+                        self._running_bulk -= 1
+                        self._cond.notify()  # libera a vaga BULK para outro worker
+                    self._update_depth()
@@ -0,0 +1,424 @@
+"""
+Benchmark offline do pipeline de reconhecimento.
+
+Mede separadamente detecção (MediaPipe), embedding (Facenet512), busca na galeria
+e persistência (armazenamento de fotos e Mongo), com galerias sintéticas de
+1k, 10k e 100k identidades. O resultado é gravado em JSON para comparação entre commits.
+
+Exemplos (a partir da pasta backend):
+    python benchmark.py --mock-embedding --output bench.json
+    python benchmark.py --sizes 1000 10000 --faces-dir ../dataset/faces --video ../dataset/A01-ENTRADA.avi
+    python benchmark.py --mock-embedding --compare bench.json --fail-on-regression
+    python benchmark.py --stages video --videos ../dataset/A01-ENTRADA.avi ../dataset/A02-ENTRADA.avi
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+from gallery import FaceGallery
+
+EMBEDDING_DIM = 512
+STAGES = ("detection", "embedding", "match", "persistence", "video")
+
+
+# ----------------------------
+# Estatísticas
+# ----------------------------
+def summarize(samples_s: list, total_s: float = None) -> dict:
+    """Resumo de latências (amostras em segundos) em ms, com vazão em itens/s."""
+    if not samples_s:
+        return {"n": 0}
+    arr = np.asarray(samples_s, dtype=np.float64) * 1000
+    total_s = total_s if total_s is not None else float(arr.sum() / 1000)
+    return {
+        "n": int(arr.size),
+        "mean_ms": round(float(arr.mean()), 4),
+        "p50_ms": round(float(np.percentile(arr, 50)), 4),
+        "p95_ms": round(float(np.percentile(arr, 95)), 4),
+        "p99_ms": round(float(np.percentile(arr, 99)), 4),
+        "max_ms": round(float(arr.max()), 4),
+        "throughput_per_s": round(arr.size / total_s, 2) if total_s > 0 else None,
+    }
+
+
+def timed_loop(fn, items) -> dict:
+    samples = []
+    start = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples, time.perf_counter() - start)
+
+
+# ----------------------------
+# Dados de entrada
+# ----------------------------
+def load_frames(video: str, frames_dir: str, count: int, rng: np.random.Generator) -> list:
+    """Frames RGB para a detecção: de um vídeo, de uma pasta ou sintéticos (ruído 1344x760)."""
+    frames = []
+    if video:
+        import cv2
+        cap = cv2.VideoCapture(video)
+        while len(frames) < count:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        cap.release()
+    elif frames_dir:
+        for name in sorted(os.listdir(frames_dir))[:count]:
+            frames.append(np.array(Image.open(os.path.join(frames_dir, name)).convert("RGB")))
+    while len(frames) < count:
+        frames.append(rng.integers(0, 256, size=(760, 1344, 3), dtype=np.uint8))
+    return frames
+
+
+def load_faces(faces_dir: str, count: int, rng: np.random.Generator) -> list:
+    """Recortes de faces (PIL): de uma pasta (ex.: faces_images/<uuid>/*.png) ou sintéticos 160x160."""
+    faces = []
+    if faces_dir:
+        for root, _dirs, files in os.walk(faces_dir):
+            for name in sorted(files):
+                if name.lower().endswith((".png", ".jpg", ".jpeg")):
+                    faces.append(Image.open(os.path.join(root, name)).convert("RGB"))
+                if len(faces) >= count:
+                    return faces
+    while len(faces) < count:
+        faces.append(Image.fromarray(rng.integers(0, 256, size=(160, 160, 3), dtype=np.uint8)))
+    return faces
+
+
+def mock_embed(image: Image.Image) -> np.ndarray:
+    """Embedding determinístico derivado do conteúdo da imagem (sem modelo)."""
+    seed = int.from_bytes(hashlib.blake2b(image.tobytes(), digest_size=8).digest(), "little")
+    return np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+
+
+def synthetic_gallery(size: int, photos_per_identity: int, rng: np.random.Generator) -> FaceGallery:
+    """Galeria com `size` identidades e `photos_per_identity` fotos (vetores aleatórios) cada."""
+    gallery = FaceGallery(dim=EMBEDDING_DIM)
+    rows = size * photos_per_identity
+    uuids = [f"id-{i // photos_per_identity:07d}" for i in range(rows)]
+    keys = [f"{u}/{i}.png" for i, u in enumerate(uuids)]
+    chunk = 50_000
+    for start in range(0, rows, chunk):
+        end = min(rows, start + chunk)
+        vectors = rng.standard_normal((end - start, EMBEDDING_DIM)).astype(np.float32)
+        gallery.add_many(uuids[start:end], keys[start:end], vectors)
+    return gallery
+
+
+# ----------------------------
+# Estágios
+# ----------------------------
+def _detect_fixed_resize(frame: np.ndarray) -> list:
+    """Comportamento antigo do servidor: resize fixo para 1344x760 (distorce e amplia)."""
+    import cv2
+    from detection import DetectedFace, detect_faces_mediapipe
+    h, w, _ = frame.shape
+    resized = cv2.resize(frame, (1344, 760))
+    sx, sy = w / 1344, h / 760
+    return [DetectedFace((int(x0 * sx), int(y0 * sy), int(x1 * sx), int(y1 * sy)), 1.0)
+            for x0, y0, x1, y1 in detect_faces_mediapipe(resized, min_conf=0.5, model_selection=1)]
+
+
+def bench_detection(args, rng) -> dict:
+    """
+    Compara o resize fixo antigo com a detecção por orçamento de pixels (com e sem
+    blocos). Sem anotações, o recall de cada modo é medido contra a união das faces
+    encontradas por todos os modos (IoU >= 0.5).
+    """
+    from detection import _iou, detect_faces, merge_detections
+    frames = load_frames(args.video, args.frames_dir, args.frames, rng)
+    modes = {
+        "fixed_1344x760": _detect_fixed_resize,
+        "budget": lambda frame: detect_faces(frame, max_pixels=args.detection_max_pixels, tiles=False),
+        "budget_tiles": lambda frame: detect_faces(frame, max_pixels=args.detection_max_pixels, tiles=True),
+    }
+    results, found = {}, {}
+    for name, detect in modes.items():
+        detect(frames[0])  # aquecimento
+        found[name] = []
+        result = timed_loop(lambda frame: found[name].append(detect(frame)), frames)
+        result["faces_per_frame_mean"] = round(float(np.mean([len(f) for f in found[name]])), 3)
+        results[name] = result
+
+    reference = [merge_detections([face.box + (face.score, face.keypoints) for name in modes for face in found[name][i]])
+                 for i in range(len(frames))]
+    total = sum(len(ref) for ref in reference)
+    for name in modes:
+        hits = sum(1 for i, ref in enumerate(reference) for r in ref
+                   if any(_iou(r[:4], face.box) >= 0.5 for face in found[name][i]))
+        results[name]["recall_vs_union"] = round(hits / total, 4) if total else None
+    results["reference_faces"] = total
+    results["frame_shape"] = list(frames[0].shape)
+    results["max_pixels"] = args.detection_max_pixels
+    return results
+
+
+def bench_embedding(args, rng) -> dict:
+    faces = load_faces(args.faces_dir, args.faces, rng)
+    if args.mock_embedding:
+        embed = mock_embed
+    else:
+        from embedding import embed_face as embed
+    embed(faces[0])  # aquecimento (tracing do grafo do TensorFlow)
+    result = timed_loop(embed, faces)
+    result["mock"] = bool(args.mock_embedding)
+    return result
+
+
+def bench_match(args, rng) -> dict:
+    results = {}
+    for size in args.sizes:
+        t0 = time.perf_counter()
+        gallery = synthetic_gallery(size, args.photos_per_identity, rng)
+        build_s = time.perf_counter() - t0
+
+        # Metade das consultas são variações de fotos da galeria (match), metade desconhecidas
+        queries = []
+        for i in range(args.queries):
+            if i % 2 == 0:
+                row = gallery._vectors[int(rng.integers(0, len(gallery)))]
+                queries.append(row + rng.normal(0, 0.01, EMBEDDING_DIM).astype(np.float32))
+            else:
+                queries.append(rng.standard_normal(EMBEDDING_DIM).astype(np.float32))
+        gallery.match(queries[0], args.threshold)  # aquecimento
+        hits = []
+        stats = timed_loop(lambda q: hits.append(gallery.match(q, args.threshold)[0] is not None), queries)
+
+        add_stats = timed_loop(
+            lambda v: gallery.add("bench-new", "bench-new/x.png", v),
+            [rng.standard_normal(EMBEDDING_DIM).astype(np.float32) for _ in range(args.queries)],
+        )
+        stats.update({
+            "identities": size,
+            "rows": size * args.photos_per_identity,
+            "build_s": round(build_s, 4),
+            "hit_rate": round(sum(hits) / len(hits), 4) if hits else None,
+            "gallery_mb": round(gallery._buffer.nbytes / 2**20, 2),
+            "add": add_stats,
+        })
+        results[str(size)] = stats
+        print(f"[match] {size} identidades: p50={stats['p50_ms']} ms p99={stats['p99_ms']} ms "
+              f"({stats['throughput_per_s']} consultas/s)")
+    return results
+
+
+def bench_persistence(args, rng) -> dict:
+    from storage import LocalPhotoStorage
+    faces = load_faces(args.faces_dir, args.faces, rng)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench-storage-") as tmp:
+        storage = LocalPhotoStorage(tmp)
+        results["image_write"] = timed_loop(
+            lambda item: storage.save(f"bench/{item[0]}.png", item[1]), list(enumerate(faces)))
+
+    if not args.mongo_uri:
+        results["mongo_write"] = {"skipped": "use --mongo-uri para medir o Mongo"}
+        return results
+
+    from pymongo import MongoClient
+    client = MongoClient(args.mongo_uri)
+    db_name = f"benchmark-{os.getpid()}"
+    db = client[db_name]
+    try:
+        now = datetime.now()
+        docs = [{
+            "data": now.strftime("%Y-%m-%d"),
+            "hora": now.strftime("%H:%M:%S"),
+            "inicio": now.strftime("%Y-%m-%d %H:%M:%S.%f"),
+            "fim": now.strftime("%Y-%m-%d %H:%M:%S.%f"),
+            "tempo_processamento": 0,
+            "pessoa": f"id-{i:07d}",
+            "foto_captura": f"id-{i:07d}/{i}.png",
+            "tags": [],
+        } for i in range(args.faces)]
+        results["mongo_write"] = timed_loop(lambda d: db["presencas"].insert_one(dict(d)), docs)
+        db["pessoas"].insert_many([{"uuid": f"id-{i:07d}", "image_paths": [], "tags": []}
+                                   for i in range(args.faces)])
+        results["mongo_read"] = timed_loop(lambda i: db["pessoas"].find_one({"uuid": f"id-{i:07d}"}),
+                                           range(args.faces))
+    finally:
+        client.drop_database(db_name)
+        client.close()
+    return results
+
+
+def bench_video(args, rng) -> dict:
+    """
+    Speedup do processamento de vídeo em segmentos paralelos (video_segments.py) em
+    função do número de processos: decodificação, detecção e embedding (sem embedding
+    com --mock-embedding) de 1 frame a cada --video-step. O carregamento dos modelos
+    nos processos fica fora da medição.
+    """
+    import cv2
+    import embedding
+    from video_segments import SegmentRunner, process_segment
+
+    videos = args.videos or ([args.video] if args.video else [])
+    if not videos:
+        return {"erro": "informe --videos (ex.: os clipes de 1 minuto *-ENTRADA.avi)"}
+    backend = None if args.mock_embedding else embedding.EMBEDDING_BACKEND
+    results = {"cpu_count": os.cpu_count(), "embedding": backend}
+    for video in videos:
+        cap = cv2.VideoCapture(video)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        cap.release()
+        by_workers = {}
+        for workers in args.segment_workers:
+            runner = SegmentRunner(workers=workers, segment_s=args.segment_s, min_duration_s=0,
+                                   backend=backend, nice=0)
+            warm = [runner._pool().submit(process_segment, video, 0, args.video_step, args.video_step)
+                    for _ in range(2 * workers)]
+            for future in warm:
+                future.result()
+            start = time.perf_counter()
+            frames = faces = 0
+            for _idx, frame_faces in runner.iter_frames(video, 0, frame_count, fps, args.video_step):
+                frames += 1
+                faces += len(frame_faces)
+            elapsed = time.perf_counter() - start
+            runner.shutdown()
+            by_workers[str(workers)] = {"wall_s": round(elapsed, 3), "frames": frames, "faces": faces,
+                                        "frames_per_s": round(frames / elapsed, 2) if elapsed else None}
+            print(f"[INFO] {os.path.basename(video)}: {workers} processo(s) -> {elapsed:.1f}s ({frames} frames)")
+        base = by_workers[str(args.segment_workers[0])]["wall_s"]
+        for row in by_workers.values():
+            row["speedup"] = round(base / row["wall_s"], 2) if row["wall_s"] else None
+        results[os.path.basename(video)] = {
+            "frame_count": frame_count,
+            "duration_s": round(frame_count / fps, 1),
+            "workers": by_workers,
+        }
+    return results
+
+
+# ----------------------------
+# Comparação entre execuções
+# ----------------------------
+def _flatten(prefix: str, value, out: dict) -> dict:
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}.{k}" if prefix else k, v, out)
+    elif isinstance(value, (int, float)) and prefix.endswith(("p50_ms", "p95_ms", "p99_ms")):
+        out[prefix] = value
+    return out
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list:
+    """Imprime as variações de latência e retorna as métricas que pioraram além da tolerância."""
+    old = _flatten("", baseline.get("results", {}), {})
+    new = _flatten("", current.get("results", {}), {})
+    regressions = []
+    print(f"\n{'métrica':<45} {'base':>10} {'atual':>10} {'var.':>8}")
+    for key in sorted(old.keys() & new.keys()):
+        if old[key] <= 0:
+            continue
+        change = new[key] / old[key] - 1
+        flag = ""
+        if change > tolerance:
+            flag = "  <-- regressão"
+            regressions.append(key)
+        print(f"{key:<45} {old[key]:>10.3f} {new[key]:>10.3f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline do pipeline de reconhecimento.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=[s for s in STAGES if s != "video"],
+                        help="Estágios a medir (default: todos menos video)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000],
+                        help="Tamanhos das galerias sintéticas (identidades)")
+    parser.add_argument("--photos-per-identity", type=int, default=1,
+                        help="Fotos (linhas) por identidade na galeria sintética (default: 1)")
+    parser.add_argument("--queries", type=int, default=500, help="Consultas por galeria (default: 500)")
+    parser.add_argument("--threshold", type=float, default=0.30, help="Limiar de cosseno (default: 0.30)")
+    parser.add_argument("--mock-embedding", action="store_true",
+                        help="Substitui o Facenet512 por um embedding sintético (sem TensorFlow)")
+    parser.add_argument("--frames", type=int, default=50, help="Frames para a detecção (default: 50)")
+    parser.add_argument("--video", help="Vídeo de onde tirar os frames da detecção")
+    parser.add_argument("--frames-dir", help="Pasta de imagens para a detecção")
+    parser.add_argument("--detection-max-pixels", type=int, default=1344 * 760,
+                        help="Orçamento de pixels da detecção (default: 1344*760)")
+    parser.add_argument("--faces", type=int, default=100, help="Recortes para embedding/persistência (default: 100)")
+    parser.add_argument("--faces-dir", help="Pasta com recortes de faces (ex.: faces_images)")
+    parser.add_argument("--videos", nargs="+", help="Vídeos para o speedup em segmentos (estágio video)")
+    parser.add_argument("--segment-workers", nargs="+", type=int,
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}),
+                        help="Quantidades de processos comparadas no estágio video (default: 1 2 4 nº de CPUs)")
+    parser.add_argument("--segment-s", type=float, default=10.0, help="Duração dos segmentos em s (default: 10)")
+    parser.add_argument("--video-step", type=int, default=2, help="Amostragem: 1 frame a cada N (default: 2)")
+    parser.add_argument("--mongo-uri", help="Mongo para medir a persistência (usa um banco temporário)")
+    parser.add_argument("--seed", type=int, default=42, help="Semente dos dados sintéticos (default: 42)")
+    parser.add_argument("--output", default="benchmark_results.json", help="Arquivo JSON de saída")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparação")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Piora relativa tolerada na comparação (default: 0.10)")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Sai com código 1 se houver regressão na comparação")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    runners = {
+        "detection": bench_detection,
+        "embedding": bench_embedding,
+        "match": bench_match,
+        "persistence": bench_persistence,
+        "video": bench_video,
+    }
+    results = {}
+    for name in STAGES:
+        if name in args.stages:
+            print(f"[INFO] Medindo {name}...")
+            results[name] = runners[name](args, rng)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"[OK] Resultados gravados em {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        if regressions:
+            print(f"[WARN] {len(regressions)} métrica(s) pioraram mais de {args.tolerance:.0%}")
+            if args.fail_on_regression:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+"""
+Consolidação offline de identidades: junta pessoas duplicadas pela galeria.
+
+Uma face sem correspondência na galeria sempre cria um UUID novo (process_face), então
+a mesma pessoa acaba em várias entradas de `pessoas` (perfil, iluminação, óculos).
+Cada duplicata divide as presenças da pessoa e aumenta a galeria que toda busca
+percorre. Aqui, fora do caminho dos requests:
+
+1. a partir de uma cópia da galeria, calcula o centróide (média normalizada dos
+   embeddings) de cada pessoa e os pares de pessoas com distância de cosseno entre
+   centróides até CONSOLIDATION_PROPOSE_DISTANCE (padrão = MATCH_THRESHOLD), em
+   blocos de linhas para não materializar a matriz P x P;
+2. agrupa os pares em ordem crescente de distância com ligação completa: dois grupos
+   só se juntam se todos os membros estiverem dentro do limite entre si, o que evita
+   cadeias A~B~C em que A e C já são pessoas diferentes;
+3. cada grupo vira uma proposta: o alvo é a pessoa com mais fotos e as outras são as
+   origens. Propostas com distância máxima até CONSOLIDATION_AUTO_DISTANCE e sem
+   conflito de tags (duas pessoas com tags e nenhuma em comum) podem ser aplicadas
+   automaticamente; as demais ficam no relatório para revisão.
+
+Aplicar uma proposta (merge) move os vetores das origens para o alvo na galeria,
+junta fotos e tags no documento do alvo (com `merged_from`), move as pastas de fotos,
+aponta as presenças (`pessoa` e `foto_captura`) para o alvo, remove os documentos das
+origens e por fim atualiza o log de embeddings. Cada passo pode ser repetido, então
+um merge interrompido é concluído aplicando a proposta de novo; se o processo morrer
+antes do log, o próximo startup recalcula os embeddings das fotos movidas. O alvo herda
+também o `merged_from` da origem, então uma cadeia A -> B -> C continua levando A a C.
+As presenças são reescritas uma a uma (sem update com pipeline), o que funciona em
+qualquer versão do MongoDB.
+
+Reconhecimentos em andamento: a origem sai da galeria antes de qualquer outro passo,
+e o process_face reserva a foto nova com o $push em image_paths antes de gravá-la;
+se a pessoa não existe mais, `reassign` segue `merged_from` até o alvo. O que um
+request que casou com a origem ainda gravar durante o merge (foto na pasta da
+origem, presença, vetor na galeria) é varrido de novo depois de
+CONSOLIDATION_SETTLE_S. Workers sem galeria compartilhada continuam com os vetores
+da origem até casarem com ela: nesse momento `reassign` os move para o alvo.
+
+Uma execução (análise ou aplicação) por vez em todos os workers: quem começa toma o
+documento de trava da coleção `consolidacoes` com um find_one_and_update atômico, e uma
+trava mais velha que CONSOLIDATION_STALE_S é considerada abandonada (processo morto).
+
+O relatório de cada execução fica na coleção `consolidacoes`: parâmetros, propostas
+(aplicadas ou não) e quanto a galeria encolheu em pessoas (identidades distintas que
+uma busca pode devolver). Os vetores não diminuem: toda foto continua na galeria, agora
+sob um único UUID.
+"""
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from storage import to_key
+
+CONSOLIDATION_PROPOSE_DISTANCE = float(os.getenv("CONSOLIDATION_PROPOSE_DISTANCE",
+                                                 os.getenv("MATCH_THRESHOLD", "0.30")))
+CONSOLIDATION_AUTO_DISTANCE = float(os.getenv("CONSOLIDATION_AUTO_DISTANCE", "0.20"))
+CONSOLIDATION_INTERVAL = float(os.getenv("CONSOLIDATION_INTERVAL", "0"))  # 0 = só sob demanda
+CONSOLIDATION_AUTO_APPLY = os.getenv("CONSOLIDATION_AUTO_APPLY", "0") == "1"
+# Trava mais velha que isso é considerada abandonada (processo morto)
+CONSOLIDATION_STALE_S = float(os.getenv("CONSOLIDATION_STALE_S", "3600"))
+# Espera pelos reconhecimentos que casaram com uma origem antes do merge, antes da varredura final
+CONSOLIDATION_SETTLE_S = float(os.getenv("CONSOLIDATION_SETTLE_S", "5"))
+
+RUNNING, DONE, FAILED = "running", "done", "failed"
+
+# Linhas de centróides por bloco no cálculo dos pares
+_BLOCK_ROWS = 1024
+# Presenças reescritas por bulk_write ao mover uma pessoa
+_PRESENCE_BATCH = 1000
+# _id do documento de trava na coleção de relatórios
+_LOCK_ID = "lock"
+
+
+def person_centroids(uuids: List[str], vectors: np.ndarray) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """(pessoas, centróides normalizados, nº de vetores por pessoa)."""
+    people, inverse, counts = np.unique(np.asarray(uuids, dtype=object), return_inverse=True, return_counts=True)
+    order = np.argsort(inverse, kind="stable")
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    vecs = vectors.astype(np.float32, copy=False)
+    vecs = vecs / np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+    sums = np.add.reduceat(vecs[order], starts, axis=0) if len(order) else np.empty((0, vectors.shape[1]), np.float32)
+    centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return list(people), centroids.astype(np.float32), counts
+
+
+def candidate_pairs(centroids: np.ndarray, max_distance: float) -> List[Tuple[float, int, int]]:
+    """Pares (distância, i, j), i < j, de centróides a até `max_distance`, em ordem crescente."""
+    pairs = []
+    min_similarity = 1.0 - max_distance
+    for start in range(0, len(centroids), _BLOCK_ROWS):
+        similarity = centroids[start:start + _BLOCK_ROWS] @ centroids.T
+        rows, cols = np.nonzero(similarity >= min_similarity)
+        keep = cols > rows + start
+        for r, c in zip(rows[keep], cols[keep]):
+            pairs.append((float(1.0 - similarity[r, c]), int(r + start), int(c)))
+    pairs.sort()
+    return pairs
+
+
+def cluster_pairs(pairs: List[Tuple[float, int, int]], centroids: np.ndarray,
+                  max_distance: float) -> List[Tuple[List[int], float]]:
+    """Agrupamento por ligação completa: [(membros, maior distância entre membros)]."""
+    cluster_of: Dict[int, int] = {}
+    members: Dict[int, List[int]] = {}
+    spread: Dict[int, float] = {}
+    for distance, i, j in pairs:
+        a, b = cluster_of.get(i, i), cluster_of.get(j, j)
+        if a == b:
+            continue
+        left, right = members.get(a, [a]), members.get(b, [b])
+        linkage = float(1.0 - np.min(centroids[left] @ centroids[right].T))
+        if linkage > max_distance:
+            continue
+        members[a] = left + right
+        spread[a] = max(spread.get(a, 0.0), spread.get(b, 0.0), linkage, distance)
+        members.pop(b, None)
+        spread.pop(b, None)
+        for m in right:
+            cluster_of[m] = a
+        cluster_of.setdefault(a, a)
+    return [(m, spread[c]) for c, m in members.items()]
+
+
+class Busy(Exception):
+    """Outra consolidação (em qualquer worker) está em andamento."""
+
+
+def tags_conflict(tag_sets: List[set]) -> bool:
+    """Duas pessoas com tags e nenhuma tag em comum provavelmente são pessoas diferentes."""
+    tagged = [t for t in tag_sets if t]
+    return any(not (x & y) for n, x in enumerate(tagged) for y in tagged[n + 1:])
+
+
+class Consolidator:
+    def __init__(self, reports, pessoas, presencas, gallery, storage, embedding_log=None,
+                 images_dir: str = "faces_images", load_gallery: Callable[[], object] = None,
+                 on_merge: Callable[[str, List[str]], None] = None,
+                 propose_distance: float = CONSOLIDATION_PROPOSE_DISTANCE,
+                 auto_distance: float = CONSOLIDATION_AUTO_DISTANCE,
+                 stale_s: float = CONSOLIDATION_STALE_S, settle_s: float = CONSOLIDATION_SETTLE_S):
+        """
+        `reports`/`pessoas`/`presencas`: coleções do Mongo. `load_gallery` garante a
+        galeria carregada antes da análise; `on_merge(alvo, origens)` invalida os
+        caches do servidor depois de cada merge.
+        """
+        self.reports = reports
+        self.pessoas = pessoas
+        self.presencas = presencas
+        self.gallery = gallery
+        self.storage = storage
+        self.embedding_log = embedding_log
+        self.images_dir = images_dir
+        self.load_gallery = load_gallery
+        self.on_merge = on_merge
+        self.propose_distance = propose_distance
+        self.auto_distance = min(auto_distance, propose_distance)
+        self.stale_s = stale_s
+        self.settle_s = settle_s
+
+    def ensure_indexes(self) -> None:
+        self.reports.create_index([("created_at", -1)])
+
+    # ----------------------------
+    # Análise
+    # ----------------------------
+    def propose(self) -> Tuple[dict, List[dict]]:
+        """(tamanho atual da galeria, propostas ordenadas pela distância)."""
+        if self.load_gallery is not None:
+            self.load_gallery()
+        uuids, _keys, vectors = self.gallery.snapshot()
+        people, centroids, counts = person_centroids(uuids, vectors)
+        del vectors
+        pairs = candidate_pairs(centroids, self.propose_distance)
+        clusters = cluster_pairs(pairs, centroids, self.propose_distance)
+
+        involved = [people[m] for members, _ in clusters for m in members]
+        tags = {p["uuid"]: set(p.get("tags") or [])
+                for p in self.pessoas.find({"uuid": {"$in": involved}}, {"uuid": 1, "tags": 1})}
+        proposals = []
+        for members, distance in sorted(clusters, key=lambda c: c[1]):
+            members = sorted(members, key=lambda m: (-counts[m], people[m]))
+            uuids_in = [people[m] for m in members]
+            conflict = tags_conflict([tags.get(u, set()) for u in uuids_in])
+            proposals.append({
+                "target": uuids_in[0],
+                "sources": uuids_in[1:],
+                "distance": round(distance, 4),
+                "photos": {u: int(counts[m]) for u, m in zip(uuids_in, members)},
+                "tags_conflict": conflict,
+                "auto": distance <= self.auto_distance and not conflict,
+                "applied": False,
+            })
+        size = {"persons": len(people), "vectors": int(counts.sum())}
+        return size, proposals
+
+    # ----------------------------
+    # Relatórios
+    # ----------------------------
+    def get(self, report_id: str) -> Optional[dict]:
+        if report_id == _LOCK_ID:
+            return None
+        return self.reports.find_one({"_id": report_id})
+
+    def list(self, page: int = 1, limit: int = 10) -> Tuple[int, list]:
+        reports = {"_id": {"$ne": _LOCK_ID}}
+        total = self.reports.count_documents(reports)
+        cursor = (self.reports.find(reports, {"proposals": 0}).sort("created_at", -1)
+                  .skip((page - 1) * limit).limit(limit))
+        return total, list(cursor)
+
+    @staticmethod
+    def public(report: dict) -> dict:
+        """Representação do relatório nas respostas da API."""
+        result = {k: v for k, v in report.items() if k not in ("_id", "created_at", "finished_at", "proposals")}
+        result["report_id"] = report["_id"]
+        result.update({k: report[k].isoformat() for k in ("created_at", "finished_at") if report.get(k)})
+        if "proposals" in report:
+            result["proposals"] = [
+                {**p, **({"applied_at": p["applied_at"].isoformat()} if p.get("applied_at") else {})}
+                for p in report["proposals"]
+            ]
+        return result
+
+    def _claim(self, owner: str) -> bool:
+        """Toma a trava de execução para `owner`; False se outra execução viva a detém."""
+        stale = datetime.now() - timedelta(seconds=self.stale_s)
+        try:
+            # Sem trava livre o upsert tenta inserir outro documento com o mesmo _id e falha
+            self.reports.find_one_and_update(
+                {"_id": _LOCK_ID, "$or": [{"owner": None}, {"claimed_at": {"$lt": stale}}]},
+                {"$set": {"owner": owner, "claimed_at": datetime.now()}},
+                upsert=True, return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def _release(self, owner: str) -> None:
+        self.reports.update_one({"_id": _LOCK_ID, "owner": owner}, {"$set": {"owner": None}})
+
+    def start(self, apply: bool = False) -> Optional[dict]:
+        """Cria o relatório e roda a análise em uma thread. None se já houver uma em andamento."""
+        report_id = str(uuid.uuid4())
+        if not self._claim(report_id):
+            return None
+        report = {
+            "_id": report_id,
+            "status": RUNNING,
+            "apply": apply,
+            "created_at": datetime.now(),
+            "params": {"propose_distance": self.propose_distance, "auto_distance": self.auto_distance},
+        }
+        try:
+            self.reports.insert_one(report)
+        except Exception:
+            self._release(report_id)
+            raise
+        threading.Thread(target=self.run, args=(report_id, apply),
+                         name="consolidation", daemon=True).start()
+        return report
+
+    def run(self, report_id: str, apply: bool = False) -> dict:
+        """Analisa a galeria e, com `apply`, aplica as propostas automáticas. Libera a trava do relatório."""
+        try:
+            before, proposals = self.propose()
+            self.reports.update_one({"_id": report_id}, {"$set": {
+                "before": before, "proposals": proposals,
+                "proposals_total": len(proposals), "proposals_auto": sum(p["auto"] for p in proposals),
+            }})
+            if apply:
+                self._apply(report_id, proposals, [n for n, p in enumerate(proposals) if p["auto"]])
+            self._finish(report_id, before, proposals)
+        except Exception as e:
+            print(f"[consolidacao] Falha no relatório {report_id}: {e}")
+            self.reports.update_one({"_id": report_id}, {"$set": {
+                "status": FAILED, "error": str(e), "finished_at": datetime.now()}})
+        finally:
+            self._release(report_id)
+        return self.get(report_id)
+
+    def apply(self, report_id: str, indexes: Optional[List[int]] = None) -> Optional[dict]:
+        """
+        Aplica propostas de um relatório já concluído (todas as pendentes se `indexes` for
+        None). Levanta Busy se outra consolidação estiver em andamento.
+        """
+        report = self.get(report_id)
+        if report is None or report["status"] != DONE:
+            return report
+        proposals = report.get("proposals", [])
+        if indexes is None:
+            indexes = [n for n, p in enumerate(proposals) if not p["applied"]]
+        owner = f"apply:{report_id}:{uuid.uuid4().hex[:8]}"
+        if not self._claim(owner):
+            raise Busy()
+        try:
+            self._apply(report_id, proposals, [n for n in indexes if 0 <= n < len(proposals)])
+            self._finish(report_id, report["before"], proposals)
+        finally:
+            self._release(owner)
+        return self.get(report_id)
+
+    def _apply(self, report_id: str, proposals: List[dict], indexes: List[int]) -> None:
+        merged_pairs = []
+        for n in indexes:
+            proposal = proposals[n]
+            if proposal["applied"]:
+                continue
+            merged = self.merge(proposal["target"], proposal["sources"])
+            proposal["applied"] = True
+            proposal["merged"] = merged
+            proposal["applied_at"] = datetime.now()
+            self.reports.update_one({"_id": report_id}, {"$set": {f"proposals.{n}": proposal}})
+            merged_pairs += [(proposal["target"], source) for source in merged]
+        if merged_pairs:
+            time.sleep(self.settle_s)
+            for target, source in merged_pairs:
+                self._sweep(target, source)
+
+    def _finish(self, report_id: str, before: dict, proposals: List[dict]) -> None:
+        """Grava quanto a galeria encolheu (pessoas removidas pelos merges aplicados ou propostos)."""
+        applied = sum(len(p.get("merged", [])) for p in proposals if p["applied"])
+        proposed = sum(len(p["sources"]) for p in proposals)
+        persons = max(1, before["persons"])
+        self.reports.update_one({"_id": report_id}, {"$set": {
+            "status": DONE,
+            "finished_at": datetime.now(),
+            "after": {"persons": before["persons"] - applied, "vectors": before["vectors"]},
+            "shrink": {
+                "persons_merged": applied,
+                "ratio": round(applied / persons, 4),
+                "persons_proposed": proposed,
+                "ratio_if_all_applied": round(proposed / persons, 4),
+            },
+        }})
+
+    # ----------------------------
+    # Merge
+    # ----------------------------
+    def _moved_key(self, stored_path: str, source: str, target: str) -> str:
+        key = to_key(stored_path, self.images_dir)
+        prefix = source + "/"
+        return target + "/" + key[len(prefix):] if key.startswith(prefix) else key
+
+    def merge(self, target: str, sources: List[str]) -> List[str]:
+        """Junta as `sources` na pessoa `target`. Retorna as origens efetivamente mescladas."""
+        if self.pessoas.find_one({"uuid": target}, {"_id": 1}) is None:
+            return []
+        merged = []
+        for source in sources:
+            if source == target:
+                continue
+            doc = self.pessoas.find_one({"uuid": source}, {"image_paths": 1, "tags": 1, "merged_from": 1})
+            if doc is None:
+                continue
+            self._merge_one(target, source, doc)
+            merged.append(source)
+        if merged and self.on_merge is not None:
+            self.on_merge(target, merged)
+        return merged
+
+    def _move_vectors(self, target: str, source: str) -> Tuple[List[str], np.ndarray]:
+        """Passa os vetores da origem para o alvo na galeria. (novas chaves, vetores)."""
+        _uuids, src_keys, src_vectors = self.gallery.snapshot(person_uuids={source})
+        new_keys = [self._moved_key(k, source, target) for k in src_keys]
+        if new_keys:
+            self.gallery.add_many([target] * len(new_keys), new_keys, src_vectors)
+        self.gallery.remove_person(source)
+        return new_keys, src_vectors
+
+    def _add_to_target(self, target: str, source: str, doc: dict) -> int:
+        photos = [self._moved_key(p, source, target) for p in doc.get("image_paths", [])]
+        self.pessoas.update_one({"uuid": target}, {"$addToSet": {
+            "image_paths": {"$each": photos},
+            "tags": {"$each": doc.get("tags") or []},
+            # Herda as origens já mescladas na origem: reassign acha o alvo final da cadeia
+            "merged_from": {"$each": [source] + (doc.get("merged_from") or [])},
+        }})
+        return len(photos)
+
+    def _move_presences(self, target: str, source: str) -> None:
+        self.storage.move_prefix(source, target)
+        find, replacement = source + "/", target + "/"
+        batch = []
+        for presence in self.presencas.find({"pessoa": source}, {"foto_captura": 1}):
+            fields = {"pessoa": target}
+            if isinstance(presence.get("foto_captura"), str):
+                fields["foto_captura"] = presence["foto_captura"].replace(find, replacement, 1)
+            # Filtro pela origem: repetir o passo não reescreve uma presença já movida
+            batch.append(UpdateOne({"_id": presence["_id"], "pessoa": source}, {"$set": fields}))
+            if len(batch) >= _PRESENCE_BATCH:
+                self.presencas.bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            self.presencas.bulk_write(batch, ordered=False)
+
+    def _log_vectors(self, target: str, source: str, new_keys: List[str], vectors: np.ndarray) -> None:
+        if self.embedding_log is not None:
+            if new_keys:
+                self.embedding_log.append_many([target] * len(new_keys), new_keys, vectors)
+            self.embedding_log.delete_person(source)
+
+    def _merge_one(self, target: str, source: str, doc: dict) -> None:
+        # 1. Galeria primeiro: as novas faces da origem passam a casar com o alvo
+        new_keys, vectors = self._move_vectors(target, source)
+
+        # 2. Documento do alvo recebe fotos, tags e o histórico do merge
+        photos = self._add_to_target(target, source, doc)
+
+        # 3. Fotos e presenças; fotos reservadas ($push) depois da leitura de `doc`
+        # vêm no documento removido
+        self._move_presences(target, source)
+        removed = self.pessoas.find_one_and_delete({"uuid": source})
+        if removed is not None:
+            self._add_to_target(target, source, removed)
+
+        # 4. Log de embeddings por último: sem ele o startup recalcula as fotos movidas
+        self._log_vectors(target, source, new_keys, vectors)
+        print(f"[consolidacao] {source} -> {target}: {photos} fotos, {len(new_keys)} vetores.")
+
+    def _sweep(self, target: str, source: str) -> None:
+        """
+        Varredura final de uma origem já mesclada: vetores, fotos e presenças gravados
+        por reconhecimentos que casaram com ela antes de sair da galeria.
+        """
+        new_keys, vectors = self._move_vectors(target, source)
+        if new_keys:
+            self.pessoas.update_one({"uuid": target}, {"$addToSet": {"image_paths": {"$each": new_keys}}})
+        self._move_presences(target, source)
+        self._log_vectors(target, source, new_keys, vectors)
+        if self.on_merge is not None:
+            self.on_merge(target, [source])
+
+    def reassign(self, source: str) -> Optional[str]:
+        """
+        Pessoa que sumiu depois de um match: se foi mesclada, devolve o alvo e passa os
+        vetores dela para ele nesta galeria (workers sem galeria compartilhada ainda os
+        têm); se foi excluída, só a remove da galeria e devolve None.
+        """
+        doc = self.pessoas.find_one({"merged_from": source}, {"uuid": 1})
+        if doc is None:
+            self.gallery.remove_person(source)
+            return None
+        self._move_vectors(doc["uuid"], source)
+        return doc["uuid"]
+
+    def run_forever(self, interval_s: float, apply: bool = False) -> None:
+        while True:
+            time.sleep(interval_s)
+            if self.start(apply=apply) is None:
+                print("[consolidacao] Execução periódica ignorada: outra em andamento.")
@@ -0,0 +1,175 @@
+"""
+Detecção de faces com MediaPipe FaceDetection.
+Separado do servidor para poder ser usado pelos scripts de benchmark sem subir a API.
+O MediaPipe só é importado no primeiro uso.
+
+detect_faces() roda o detector em uma cópia reduzida do frame (mantendo a proporção,
+limitada a DETECTION_MAX_PIXELS e sem nunca ampliar) e devolve os boxes nas coordenadas
+do frame original, para que os recortes saiam da resolução cheia. Com DETECTION_TILES=1,
+frames maiores que o orçamento também são varridos em blocos sobrepostos na resolução
+original, o que encontra faces pequenas/distantes que somem na redução.
+"""
+import math
+import os
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+
+# Orçamento de pixels da detecção (padrão: o antigo 1344x760)
+DETECTION_MAX_PIXELS = int(os.getenv("DETECTION_MAX_PIXELS", str(1344 * 760)))
+DETECTION_TILES = os.getenv("DETECTION_TILES", "0") == "1"
+DETECTION_TILE_OVERLAP = float(os.getenv("DETECTION_TILE_OVERLAP", "0.2"))
+
+# ----------------------------
+# MediaPipe Face Detection (substitui dlib)
+# ----------------------------
+_mp_face = None
+
+
+def _face_detection_module():
+    global _mp_face
+    if _mp_face is None:
+        import mediapipe as mp
+        _mp_face = mp.solutions.face_detection
+    return _mp_face
+
+# Crie uma função utilitária para converter o bounding box relativo do MediaPipe
+# em coordenadas absolutas (x_min, y_min, x_max, y_max)
+def _mp_bbox_to_abs(image_width: int, image_height: int, relative_bbox) -> tuple[int, int, int, int]:
+    x_min = int(relative_bbox.xmin * image_width)
+    y_min = int(relative_bbox.ymin * image_height)
+    w     = int(relative_bbox.width * image_width)
+    h     = int(relative_bbox.height * image_height)
+    x_max = x_min + w
+    y_max = y_min + h
+
+    # clamp para dentro da imagem
+    x_min = max(0, x_min)
+    y_min = max(0, y_min)
+    x_max = min(image_width - 1, x_max)
+    y_max = min(image_height - 1, y_max)
+    return x_min, y_min, x_max, y_max
+
+
+class DetectedFace(NamedTuple):
+    box: Tuple[int, int, int, int]  # (x_min, y_min, x_max, y_max) no frame original, com margem
+    score: float
+    # Keypoints do MediaPipe (olho dir., olho esq., nariz, boca, orelha dir., orelha esq.) em pixels
+    keypoints: Tuple[Tuple[float, float], ...] = ()
+
+
+def _detect_raw(image_np_rgb: np.ndarray, min_conf: float, model_selection: int) -> list:
+    """Detecções do MediaPipe como (x_min, y_min, x_max, y_max, score, keypoints) sem margem."""
+    # Cria e fecha o detector a cada chamada (thread-safe no FastAPI)
+    with _face_detection_module().FaceDetection(model_selection=model_selection,
+                               min_detection_confidence=min_conf) as face_det:
+        results = face_det.process(image_np_rgb)
+
+    raw = []
+    if results and results.detections:
+        h, w, _ = image_np_rgb.shape
+        for det in results.detections:
+            rel_bbox = det.location_data.relative_bounding_box
+            keypoints = tuple((kp.x * w, kp.y * h) for kp in det.location_data.relative_keypoints)
+            raw.append(_mp_bbox_to_abs(w, h, rel_bbox) + (float(det.score[0]), keypoints))
+    return raw
+
+
+def _add_margin(box, width: int, height: int, ratio: float = 0.10) -> Tuple[int, int, int, int]:
+    # Margem ao redor da face (10% do maior lado)
+    x_min, y_min, x_max, y_max = box
+    margin = int(ratio * max(x_max - x_min, y_max - y_min))
+    return (max(0, x_min - margin), max(0, y_min - margin),
+            min(width - 1, x_max + margin), min(height - 1, y_max + margin))
+
+
+def detect_faces_mediapipe(image_np_rgb: np.ndarray,
+                           min_conf: float = 0.8,
+                           model_selection: int = 1):
+    """
+    Executa a detecção de faces com MediaPipe FaceDetection.
+    - image_np_rgb deve estar em RGB
+    - model_selection: 0 (faces próximas) | 1 (distantes)
+    Retorna lista de boxes absolutos (x_min, y_min, x_max, y_max).
+    """
+    h, w, _ = image_np_rgb.shape
+    return [_add_margin(raw[:4], w, h) for raw in _detect_raw(image_np_rgb, min_conf, model_selection)]
+
+
+def _iou(a, b) -> float:
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def merge_detections(raw: list, iou_threshold: float = 0.3) -> list:
+    """Supressão de não-máximos: mantém a detecção de maior score entre as sobrepostas."""
+    kept = []
+    for det in sorted(raw, key=lambda d: d[4], reverse=True):
+        if all(_iou(det, other) < iou_threshold for other in kept):
+            kept.append(det)
+    return kept
+
+
+def _detect_scaled(image_np_rgb: np.ndarray, max_pixels: int, min_conf: float, model_selection: int,
+                   offset: Tuple[int, int] = (0, 0)) -> list:
+    """Detecta em uma cópia reduzida para caber em max_pixels e reprojeta para a imagem de entrada."""
+    import cv2
+    h, w, _ = image_np_rgb.shape
+    scale = min(1.0, math.sqrt(max_pixels / float(w * h)))
+    small = image_np_rgb
+    if scale < 1.0:
+        small = cv2.resize(image_np_rgb, (max(1, int(w * scale)), max(1, int(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+    sx, sy = w / small.shape[1], h / small.shape[0]
+    ox, oy = offset
+    return [(int(x0 * sx) + ox, int(y0 * sy) + oy, int(x1 * sx) + ox, int(y1 * sy) + oy, score,
+             tuple((x * sx + ox, y * sy + oy) for x, y in keypoints))
+            for x0, y0, x1, y1, score, keypoints in _detect_raw(small, min_conf, model_selection)]
+
+
+def _tiles(width: int, height: int, max_pixels: int, overlap: float) -> List[Tuple[int, int, int, int]]:
+    """Blocos sobrepostos de ~max_pixels cobrindo o frame (x0, y0, x1, y1)."""
+    side = int(math.sqrt(max_pixels * (width / height)))  # largura do bloco na proporção do frame
+    tile_w = min(width, side)
+    tile_h = min(height, max(1, max_pixels // max(1, tile_w)))
+    step_x = max(1, int(tile_w * (1 - overlap)))
+    step_y = max(1, int(tile_h * (1 - overlap)))
+    xs = list(range(0, max(1, width - tile_w) + 1, step_x))
+    ys = list(range(0, max(1, height - tile_h) + 1, step_y))
+    if xs[-1] + tile_w < width:
+        xs.append(width - tile_w)
+    if ys[-1] + tile_h < height:
+        ys.append(height - tile_h)
+    return [(x, y, x + tile_w, y + tile_h) for y in ys for x in xs]
+
+
+def detect_faces(image_np_rgb: np.ndarray,
+                 max_pixels: int = None,
+                 tiles: bool = None,
+                 min_conf: float = 0.5,
+                 model_selection: int = 1,
+                 tile_overlap: float = None) -> List[DetectedFace]:
+    """
+    Detecção com orçamento de resolução (ver docstring do módulo).
+    Retorna DetectedFace com boxes (com margem de 10%) nas coordenadas de image_np_rgb.
+    """
+    max_pixels = max_pixels or DETECTION_MAX_PIXELS
+    tiles = DETECTION_TILES if tiles is None else tiles
+    tile_overlap = DETECTION_TILE_OVERLAP if tile_overlap is None else tile_overlap
+    h, w, _ = image_np_rgb.shape
+
+    raw = _detect_scaled(image_np_rgb, max_pixels, min_conf, model_selection)
+    if tiles and w * h > max_pixels:
+        for x0, y0, x1, y1 in _tiles(w, h, max_pixels, tile_overlap):
+            raw.extend(_detect_scaled(image_np_rgb[y0:y1, x0:x1], max_pixels, min_conf, model_selection,
+                                      offset=(x0, y0)))
+        raw = merge_detections(raw)
+    return [DetectedFace(_add_margin(det[:4], w, h), det[4], det[5]) for det in raw]
+
+
+def warmup() -> None:
+    """Importa o MediaPipe e carrega o modelo de detecção com um frame fictício."""
+    detect_faces_mediapipe(np.zeros((760, 1344, 3), dtype=np.uint8), min_conf=0.5, model_selection=1)
@@ -0,0 +1,150 @@
+"""
+Cálculo de embeddings Facenet512.
+Separado do servidor para poder ser usado pelos scripts de benchmark sem subir a API.
+
+Backends (variável de ambiente EMBEDDING_BACKEND):
+- "deepface" (padrão): DeepFace.represent com TensorFlow, detector opencv e alinhamento;
+- "onnx": o mesmo modelo exportado para ONNX (ver onnx_tools.py), executado no ONNX Runtime (CPU);
+- "onnx-int8": variante com quantização dinâmica int8 dos pesos.
+
+Os backends ONNX recebem os recortes do MediaPipe diretamente (sem redetecção pelo
+opencv) e usam o mesmo pré-processamento do DeepFace: BGR em [0, 1], redimensionado
+para 160x160 mantendo a proporção, com preenchimento.
+
+O DeepFace (e o TensorFlow) só é importado no primeiro uso, para que importar o
+servidor (uvicorn --reload, restart de workers) não pague esse custo.
+"""
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+MODEL_NAME = "Facenet512"
+EMBEDDING_DIM = 512
+INPUT_SIZE = (160, 160)
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "deepface").lower()
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", os.path.join("models", "facenet512.onnx"))
+ONNX_INT8_MODEL_PATH = os.getenv("ONNX_INT8_MODEL_PATH", os.path.join("models", "facenet512.int8.onnx"))
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 = padrão do ONNX Runtime
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def to_bgr_array(img) -> np.ndarray:
+    """Converte imagem PIL, caminho de arquivo ou array BGR em array BGR uint8."""
+    if isinstance(img, Image.Image):
+        return np.ascontiguousarray(np.array(img.convert("RGB"))[:, :, ::-1])
+    if isinstance(img, str):
+        import cv2
+        arr = cv2.imread(img)
+        if arr is None:
+            raise ValueError(f"Não foi possível ler a imagem: {img}")
+        return arr
+    return img
+
+
+def preprocess_face(img_bgr: np.ndarray) -> np.ndarray:
+    """
+    Pré-processamento do Facenet512 equivalente ao do DeepFace: redimensiona mantendo
+    a proporção, preenche até 160x160 e escala para [0, 1]. Retorna (160, 160, 3) float32.
+    """
+    import cv2
+    target_h, target_w = INPUT_SIZE
+    factor = min(target_h / img_bgr.shape[0], target_w / img_bgr.shape[1])
+    dsize = (max(1, int(img_bgr.shape[1] * factor)), max(1, int(img_bgr.shape[0] * factor)))
+    resized = cv2.resize(img_bgr, dsize)
+    diff_h = target_h - resized.shape[0]
+    diff_w = target_w - resized.shape[1]
+    padded = np.pad(resized, ((diff_h // 2, diff_h - diff_h // 2), (diff_w // 2, diff_w - diff_w // 2), (0, 0)),
+                    "constant")
+    if padded.shape[:2] != INPUT_SIZE:
+        padded = cv2.resize(padded, (target_w, target_h))
+    return padded.astype(np.float32) / 255.0
+
+
+class DeepFaceEmbedder:
+    """Facenet512 via DeepFace.represent (TensorFlow)."""
+
+    name = "deepface"
+
+    def __init__(self):
+        from deepface import DeepFace
+        self._deepface = DeepFace
+        self.model = DeepFace.build_model(MODEL_NAME)
+        print("DeepFace model loaded.")
+
+    def embed(self, img) -> np.ndarray:
+        """
+        Usa as mesmas opções do antigo DeepFace.verify (detector opencv, alinhamento).
+        """
+        result = self._deepface.represent(
+            img_path=to_bgr_array(img),
+            model_name=MODEL_NAME,
+            enforce_detection=False
+        )
+        return np.asarray(result[0]["embedding"], dtype=np.float32)
+
+    def forward(self, batch: np.ndarray) -> np.ndarray:
+        """Executa só o modelo Keras em um lote já pré-processado (N, 160, 160, 3)."""
+        return np.asarray(self.model.model(batch, training=False), dtype=np.float32)
+
+
+class OnnxEmbedder:
+    """Facenet512 exportado para ONNX, executado no ONNX Runtime (CPU)."""
+
+    def __init__(self, path: str, name: str = "onnx", threads: int = ONNX_THREADS):
+        import onnxruntime as ort
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Modelo ONNX não encontrado: {path} (gere com: python onnx_tools.py export)")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.name = name
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        print(f"Modelo ONNX carregado: {path}")
+
+    def forward(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch.astype(np.float32)})[0]
+
+    def embed(self, img) -> np.ndarray:
+        batch = preprocess_face(to_bgr_array(img))[None, ...]
+        return self.forward(batch)[0].astype(np.float32)
+
+
+def create_embedder(backend: str = None):
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    if backend == "deepface":
+        return DeepFaceEmbedder()
+    if backend == "onnx":
+        return OnnxEmbedder(ONNX_MODEL_PATH, name="onnx")
+    if backend == "onnx-int8":
+        return OnnxEmbedder(ONNX_INT8_MODEL_PATH, name="onnx-int8")
+    raise ValueError(f"EMBEDDING_BACKEND inválido: {backend}")
+
+
+def load_model():
+    """Carrega (uma única vez) o backend de embedding configurado."""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = create_embedder()
+    return _embedder
+
+
+def embed_face(img) -> np.ndarray:
+    """
+    Calcula o embedding Facenet512 de uma face.
+    `img` pode ser uma imagem PIL, o caminho de um arquivo ou um array BGR.
+    """
+    return load_model().embed(img)
+
+
+def warmup() -> None:
+    """Executa uma inferência com uma imagem fictícia (tracing do grafo antes do 1º request)."""
+    embed_face(Image.new("RGB", INPUT_SIZE, (128, 128, 128)))
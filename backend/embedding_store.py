@@ -0,0 +1,216 @@
+"""
+Log em disco dos embeddings da galeria, só de acréscimo.
+
+Evita recalcular o embedding de todas as fotos a cada restart: cada foto cadastrada
+grava uma linha float32 de tamanho fixo, e o startup só mapeia o arquivo (np.memmap).
+
+Arquivos em EMBEDDINGS_DIR:
+- meta.json          : dimensão, backend de embedding e geração atual;
+- vectors.<g>.f32    : linhas float32 normalizadas (dim * 4 bytes cada, sem cabeçalho);
+- ids.<g>.tsv        : "uuid<TAB>chave" da linha correspondente;
+- deleted.txt        : UUIDs de pessoas removidas (as linhas continuam até a compactação);
+- log.lock           : trava entre processos (vários workers gravam no mesmo log).
+
+O vetor é gravado antes da linha de ids, que funciona como confirmação: ao abrir, o
+excedente de um acréscimo interrompido é truncado. A compactação grava uma nova geração
+sem as linhas removidas/duplicadas e a publica trocando o meta.json.
+"""
+import json
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from shared_gallery import FileLock
+
+
+class EmbeddingLog:
+    def __init__(self, directory: str = "embeddings", dim: int = 512, backend: str = "deepface"):
+        self.directory = directory
+        self.dim = dim
+        self.backend = backend
+        self.generation = 0
+        self._row_bytes = dim * 4
+        self._lock: Optional[FileLock] = None
+
+    # ---------- arquivos ----------
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _vectors_path(self, generation: int = None) -> str:
+        return self._path(f"vectors.{self.generation if generation is None else generation}.f32")
+
+    def _ids_path(self, generation: int = None) -> str:
+        return self._path(f"ids.{self.generation if generation is None else generation}.tsv")
+
+    def _write_meta(self) -> None:
+        tmp = self._path("meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "backend": self.backend, "generation": self.generation}, f)
+        os.replace(tmp, self._path("meta.json"))
+
+    def _read_meta(self) -> dict:
+        # Outro processo pode ter compactado o log: a geração vale a do meta.json
+        with open(self._path("meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def open(self) -> "EmbeddingLog":
+        """
+        Cria o log ou reabre o existente. Se ele foi gerado com outra dimensão/backend
+        de embedding, é descartado (os vetores não são comparáveis).
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = FileLock(self._path("log.lock"))
+        with self._lock:
+            meta = self._read_meta() if os.path.exists(self._path("meta.json")) else None
+            if meta and meta.get("dim") == self.dim and meta.get("backend") == self.backend:
+                self.generation = int(meta["generation"])
+            else:
+                if meta:
+                    print(f"[embeddings] Log gerado com {meta.get('backend')}/{meta.get('dim')}; recriando.")
+                self._reset(meta)
+            self._repair()
+        return self
+
+    def _reset(self, meta: Optional[dict]) -> None:
+        self._remove_generation(int(meta["generation"]) if meta else 0)
+        self.generation = int(meta["generation"]) + 1 if meta else 0
+        for path in (self._vectors_path(), self._ids_path(), self._path("deleted.txt")):
+            open(path, "wb").close()
+        self._write_meta()
+
+    def reset(self) -> None:
+        """Descarta todo o conteúdo do log (ex.: reindexação completa)."""
+        with self._lock:
+            self._reset(self._read_meta())
+
+    def _remove_generation(self, generation: int) -> None:
+        for path in (self._vectors_path(generation), self._ids_path(generation)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _repair(self) -> None:
+        """
+        Trunca vetores/ids para o mesmo número de linhas completas e apaga arquivos de
+        outras gerações (compactação interrompida antes ou depois da troca do meta.json).
+        """
+        current = {os.path.basename(self._vectors_path()), os.path.basename(self._ids_path())}
+        for name in os.listdir(self.directory):
+            if name.startswith(("vectors.", "ids.")) and name.endswith((".f32", ".tsv")) and name not in current:
+                os.remove(self._path(name))
+        vectors_path, ids_path = self._vectors_path(), self._ids_path()
+        for path in (vectors_path, ids_path):
+            if not os.path.exists(path):
+                open(path, "wb").close()
+        with open(ids_path, "rb") as f:
+            data = f.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        rows = min(os.path.getsize(vectors_path) // self._row_bytes, complete.count(b"\n"))
+        if complete.count(b"\n") != rows or len(complete) != len(data):
+            lines = complete.split(b"\n")[:rows]
+            with open(ids_path, "wb") as f:
+                f.write(b"".join(line + b"\n" for line in lines))
+        if os.path.getsize(vectors_path) != rows * self._row_bytes:
+            with open(vectors_path, "r+b") as f:
+                f.truncate(rows * self._row_bytes)
+
+    def _sync_generation(self) -> None:
+        self.generation = int(self._read_meta()["generation"])
+
+    # ---------- escrita ----------
+    def append(self, person_uuid: str, key: str, embedding) -> None:
+        self.append_many([person_uuid], [key], [embedding])
+
+    def append_many(self, person_uuids: List[str], keys: List[str], embeddings) -> None:
+        if not person_uuids:
+            return
+        vecs = np.asarray(embeddings, dtype=np.float32).reshape(len(person_uuids), self.dim)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        vecs = np.ascontiguousarray(vecs / np.where(norms > 0, norms, 1.0), dtype=np.float32)
+        with self._lock:
+            self._sync_generation()
+            with open(self._vectors_path(), "ab") as f:
+                f.write(vecs.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._ids_path(), "ab") as f:
+                f.write("".join(f"{u}\t{k}\n" for u, k in zip(person_uuids, keys)).encode("utf-8"))
+
+    def delete_person(self, person_uuid: str) -> None:
+        with self._lock:
+            with open(self._path("deleted.txt"), "ab") as f:
+                f.write(f"{person_uuid}\n".encode("utf-8"))
+
+    # ---------- leitura ----------
+    def _read_all(self) -> Tuple[List[str], List[str], np.ndarray, set]:
+        self._sync_generation()
+        with open(self._ids_path(), "rb") as f:
+            lines = f.read().decode("utf-8").splitlines()
+        rows = min(len(lines), os.path.getsize(self._vectors_path()) // self._row_bytes)
+        pairs = [line.split("\t", 1) for line in lines[:rows]]
+        uuids = [pair[0] for pair in pairs]
+        keys = [pair[1] for pair in pairs]
+        if rows:
+            vectors = np.memmap(self._vectors_path(), dtype=np.float32, mode="r", shape=(rows, self.dim))
+        else:
+            vectors = np.empty((0, self.dim), dtype=np.float32)
+        with open(self._path("deleted.txt"), "rb") as f:
+            deleted = set(f.read().decode("utf-8").split())
+        return uuids, keys, vectors, deleted
+
+    @staticmethod
+    def _live_rows(uuids: List[str], keys: List[str], deleted: set) -> List[int]:
+        """Linhas válidas: pessoa não removida e, para chaves repetidas, só a última."""
+        last = {key: i for i, key in enumerate(keys)}
+        if len(last) == len(keys) and not deleted:
+            return list(range(len(keys)))
+        return [i for i, key in enumerate(keys) if last[key] == i and uuids[i] not in deleted]
+
+    def load(self) -> Tuple[List[str], List[str], np.ndarray]:
+        """
+        Retorna (uuids, chaves, vetores) das linhas válidas. Sem linhas mortas, os vetores
+        são o próprio mapeamento do arquivo (sem cópia); quem os guarda deve copiá-los.
+        """
+        with self._lock:
+            uuids, keys, vectors, deleted = self._read_all()
+            live = self._live_rows(uuids, keys, deleted)
+            if len(live) == len(uuids):
+                return uuids, keys, vectors
+            live_vectors = np.ascontiguousarray(vectors[live]) if live else np.empty((0, self.dim), np.float32)
+            del vectors
+        return [uuids[i] for i in live], [keys[i] for i in live], live_vectors
+
+    def stats(self) -> dict:
+        with self._lock:
+            uuids, keys, vectors, deleted = self._read_all()
+            live = len(self._live_rows(uuids, keys, deleted))
+            del vectors
+        return {"rows": len(uuids), "live": live, "dead": len(uuids) - live, "generation": self.generation}
+
+    # ---------- compactação ----------
+    def compact(self, min_dead_ratio: float = 0.0) -> int:
+        """
+        Regrava o log só com as linhas válidas, se a fração de linhas mortas for
+        >= min_dead_ratio. Retorna quantas linhas foram descartadas.
+        """
+        with self._lock:
+            uuids, keys, vectors, deleted = self._read_all()
+            live = self._live_rows(uuids, keys, deleted)
+            dead = len(uuids) - len(live)
+            if not uuids or dead == 0 or dead / len(uuids) < min_dead_ratio:
+                del vectors
+                return 0
+            old, new = self.generation, self.generation + 1
+            with open(self._vectors_path(new), "wb") as f:
+                for start in range(0, len(live), 4096):
+                    f.write(np.ascontiguousarray(vectors[live[start:start + 4096]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            del vectors
+            with open(self._ids_path(new), "wb") as f:
+                f.write("".join(f"{uuids[i]}\t{keys[i]}\n" for i in live).encode("utf-8"))
+            self.generation = new
+            self._write_meta()
+            open(self._path("deleted.txt"), "wb").close()
+            self._remove_generation(old)
+        return dead
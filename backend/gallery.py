@@ -0,0 +1,106 @@
+"""
+Galeria em memória dos embeddings das faces cadastradas.
+
+Cada foto salva de uma pessoa vira uma linha (embedding Facenet512 normalizado).
+A busca é uma multiplicação matriz-vetor (similaridade de cosseno), substituindo
+o antigo laço de DeepFace.verify contra todas as fotos a cada requisição.
+"""
+import threading
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+
+
+def normalize(embedding) -> np.ndarray:
+    vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec = vec / norm
+    return vec
+
+
+class FaceGallery:
+    """
+    Galeria thread-safe: uma linha por foto, associada ao UUID da pessoa.
+    A distância usada é a de cosseno (1 - similaridade), como no DeepFace.verify.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self._lock = threading.RLock()
+        # Buffer com capacidade extra (crescimento amortizado); as linhas válidas são [:len(self)]
+        self._buffer = np.empty((0, dim), dtype=np.float32)
+        self._uuids: List[str] = []
+        self._keys: List[str] = []
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._uuids)
+
+    @property
+    def _vectors(self) -> np.ndarray:
+        return self._buffer[:len(self._uuids)]
+
+    def _reserve(self, extra: int) -> None:
+        needed = len(self._uuids) + extra
+        if needed > self._buffer.shape[0]:
+            capacity = max(needed, 2 * self._buffer.shape[0], 1024)
+            buffer = np.empty((capacity, self.dim), dtype=np.float32)
+            buffer[:len(self._uuids)] = self._vectors
+            self._buffer = buffer
+
+    def add(self, person_uuid: str, key: str, embedding) -> None:
+        vec = normalize(embedding)
+        with self._lock:
+            self._reserve(1)
+            self._buffer[len(self._uuids)] = vec
+            self._uuids.append(person_uuid)
+            self._keys.append(key)
+
+    def add_many(self, person_uuids: List[str], keys: List[str], embeddings) -> None:
+        if not person_uuids:
+            return
+        vecs = np.asarray(embeddings, dtype=np.float32).reshape(len(person_uuids), self.dim)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        vecs = vecs / np.where(norms > 0, norms, 1.0)
+        with self._lock:
+            self._reserve(len(person_uuids))
+            self._buffer[len(self._uuids):len(self._uuids) + len(person_uuids)] = vecs
+            self._uuids.extend(person_uuids)
+            self._keys.extend(keys)
+
+    def remove_person(self, person_uuid: str) -> int:
+        """Remove todas as linhas de uma pessoa. Retorna quantas foram removidas."""
+        with self._lock:
+            keep = [i for i, u in enumerate(self._uuids) if u != person_uuid]
+            removed = len(self._uuids) - len(keep)
+            if removed:
+                self._buffer = self._vectors[keep]
+                self._uuids = [self._uuids[i] for i in keep]
+                self._keys = [self._keys[i] for i in keep]
+            return removed
+
+    def snapshot(self, person_uuids: Optional[Set[str]] = None) -> Tuple[List[str], List[str], np.ndarray]:
+        """Cópia de (uuids, chaves, vetores), opcionalmente só das pessoas dadas (ex.: consolidação)."""
+        with self._lock:
+            if person_uuids is None:
+                return list(self._uuids), list(self._keys), self._vectors.copy()
+            rows = [i for i, u in enumerate(self._uuids) if u in person_uuids]
+            return [self._uuids[i] for i in rows], [self._keys[i] for i in rows], self._vectors[rows]
+
+    def match(self, embedding, threshold: float) -> Tuple[Optional[str], Optional[float]]:
+        """
+        Retorna (uuid, distância) da foto mais próxima se a distância de cosseno
+        for <= threshold; caso contrário (None, distância mínima ou None).
+        """
+        vec = normalize(embedding)
+        with self._lock:
+            if not self._uuids:
+                return None, None
+            distances = 1.0 - self._vectors @ vec
+            best = int(np.argmin(distances))
+            best_distance = float(distances[best])
+            best_uuid = self._uuids[best]
+        if best_distance <= threshold:
+            return best_uuid, best_distance
+        return None, best_distance
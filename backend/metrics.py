@@ -0,0 +1,213 @@
+"""
+Métricas Prometheus do pipeline de reconhecimento.
+
+Uso:
+    with stage("detection"):
+        boxes = detect_faces_mediapipe(...)
+
+    tempos = {}
+    with stage("image_write", tempos, "persistencia"):  # também acumula em tempos (ms)
+        storage.save(...)
+
+O endpoint /metrics do servidor devolve `render()`. Com vários workers (gunicorn),
+defina PROMETHEUS_MULTIPROC_DIR para agregar as métricas de todos os processos.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+
+# Estágios medidos (rótulo "stage" do histograma)
+STAGES = (
+    "base64_decode",   # decodificação do base64
+    "image_decode",    # PIL open/convert/resize
+    "detection",       # MediaPipe FaceDetection
+    "quality",         # filtro de qualidade (tamanho, nitidez, score, pose)
+    "embedding",       # Facenet512
+    "match",           # busca na galeria
+    "image_write",     # gravação da foto no armazenamento
+    "mongo_read",      # leituras no Mongo
+    "mongo_write",     # escritas no Mongo
+)
+
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_LATENCY = Histogram(
+    "face_stage_latency_seconds",
+    "Latência de cada estágio do pipeline de reconhecimento",
+    ["stage"],
+    buckets=_LATENCY_BUCKETS,
+)
+REQUEST_LATENCY = Histogram(
+    "face_request_latency_seconds",
+    "Latência total das requisições de reconhecimento",
+    ["endpoint"],
+    buckets=_LATENCY_BUCKETS + (30.0, 60.0),
+)
+FACES_PER_FRAME = Histogram(
+    "face_faces_per_frame",
+    "Quantidade de faces detectadas por frame",
+    buckets=(0, 1, 2, 3, 4, 5, 8, 12, 20),
+)
+IDENTITIES = Counter(
+    "face_identities_total",
+    "Faces processadas por resultado (matched = pessoa existente, new = pessoa nova)",
+    ["result"],
+)
+ERRORS = Counter(
+    "face_errors_total",
+    "Erros nas requisições de reconhecimento",
+    ["endpoint"],
+)
+IN_FLIGHT = Gauge(
+    "face_requests_in_flight",
+    "Requisições de reconhecimento em andamento",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+STREAM_CONNECTIONS = Gauge(
+    "face_stream_connections",
+    "Conexões WebSocket de câmeras abertas",
+    multiprocess_mode="livesum",
+)
+FACE_QUALITY = Counter(
+    "face_quality_total",
+    "Faces avaliadas pelo filtro de qualidade (ok ou o primeiro motivo de reprovação)",
+    ["result"],
+)
+RECOGNITION_CACHE = Counter(
+    "face_recognition_cache_total",
+    "Consultas ao cache de reconhecimento (hit = resultado reaproveitado sem o modelo)",
+    ["result"],
+)
+PERSON_CACHE = Counter(
+    "face_person_cache_total",
+    "Consultas ao cache de resumos de pessoas",
+    ["result"],
+)
+STORAGE_UPLOAD_FAILURES = Counter(
+    "face_storage_upload_failures_total",
+    "Gravações assíncronas de fotos que falharam (a chave já está no Mongo sem o objeto)",
+)
+FRAMES_DROPPED = Counter(
+    "face_frames_dropped_total",
+    "Frames descartados sem processamento, por motivo",
+    ["reason"],
+)
+QUEUE_DEPTH = Gauge(
+    "face_admission_queue_depth",
+    "Frames aguardando ou em processamento na fila de admissão, por classe (live/bulk)",
+    ["priority"],
+    multiprocess_mode="livesum",
+)
+QUEUE_WAIT = Histogram(
+    "face_admission_queue_wait_seconds",
+    "Espera dos frames na fila de admissão até o início do processamento, por classe (live/bulk)",
+    ["priority"],
+    buckets=_LATENCY_BUCKETS,
+)
+
+CAMERA_FRAMES = Counter(
+    "face_camera_frames_total",
+    "Frames por câmera e resultado (ok, error ou o motivo do descarte)",
+    ["camera", "result"],
+)
+CAMERA_LATENCY = Histogram(
+    "face_camera_frame_latency_seconds",
+    "Latência dos frames por câmera (fila de admissão + processamento)",
+    ["camera"],
+    buckets=_LATENCY_BUCKETS + (30.0, 60.0),
+)
+
+
+class LoadTracker:
+    """
+    Carga recente deste processo, anunciada aos clientes nos headers das respostas
+    (X-Queue-Depth e X-Recent-Latency-Ms) para que eles ajustem a taxa de envio.
+    Com `depth_source` (ex.: AdmissionQueue.depth), X-Queue-Depth é a profundidade
+    da fila de admissão; sem ele, as requisições em andamento.
+    """
+
+    def __init__(self, window: int = 50):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.in_flight = 0
+        self.depth_source = None
+
+    def start(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def finish(self, elapsed_s: float) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._latencies.append(elapsed_s * 1000)
+
+    def recent_latency_ms(self) -> float:
+        """p90 das últimas requisições (ms), 0 se ainda não houver amostras."""
+        with self._lock:
+            values = sorted(self._latencies)
+        if not values:
+            return 0.0
+        return round(values[min(len(values) - 1, int(0.9 * len(values)))], 1)
+
+    def headers(self) -> dict:
+        return {
+            "X-Queue-Depth": str(self.depth_source() if self.depth_source else self.in_flight),
+            "X-Recent-Latency-Ms": str(self.recent_latency_ms()),
+        }
+
+
+LOAD = LoadTracker()
+
+
+@contextmanager
+def stage(name: str, timings: dict = None, key: str = None):
+    """
+    Mede a duração de um estágio no histograma STAGE_LATENCY.
+    Se `timings` for informado, acumula a duração (ms) em timings[key or name].
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(name).observe(elapsed)
+        if timings is not None:
+            key = key or name
+            timings[key] = round(timings.get(key, 0.0) + elapsed * 1000, 3)
+
+
+@contextmanager
+def track_request(endpoint: str):
+    """Conta a requisição como em andamento, mede a latência total e os erros."""
+    IN_FLIGHT.labels(endpoint).inc()
+    LOAD.start()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.labels(endpoint).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        REQUEST_LATENCY.labels(endpoint).observe(elapsed)
+        IN_FLIGHT.labels(endpoint).dec()
+        LOAD.finish(elapsed)
+
+
+# Media type da resposta de /metrics (acompanha o formato gerado por render())
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+def render() -> bytes:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
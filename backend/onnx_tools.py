@@ -0,0 +1,213 @@
+"""
+Ferramentas do backend ONNX de embeddings (ver embedding.py).
+
+    python onnx_tools.py export [--int8]
+        Exporta o Facenet512 do DeepFace para models/facenet512.onnx e, com --int8,
+        gera também models/facenet512.int8.onnx (quantização dinâmica dos pesos).
+        Requer tf2onnx e onnx (podem exigir um protobuf mais novo que o do TF 2.10;
+        nesse caso exporte em um ambiente separado e copie os .onnx).
+
+    python onnx_tools.py parity --faces-dir faces_images [--limit 200]
+        Teste de paridade em duas etapas, para cada variante ONNX (fp32 e int8):
+        - modelo: Keras x ONNX nas mesmas entradas pré-processadas (valida a exportação);
+        - ponta a ponta: DeepFace.represent (redetecção e alinhamento, backend "deepface")
+          x OnnxEmbedder.embed (recorte direto, backends "onnx"), nos mesmos recortes
+          reais. Falha se a concordância das decisões de match (distância de cosseno
+          <= MATCH_THRESHOLD) entre todos os pares ficar abaixo de --min-agreement; o
+          relatório traz o limiar do ONNX que mais concorda com o do DeepFace.
+        Sai com código 1 se alguma etapa falhar ou se nenhuma variante for comparada.
+
+    python onnx_tools.py throughput --faces-dir faces_images [--batch 1 8]
+        Compara a vazão (faces/s) do DeepFace.represent atual com o ONNX fp32/int8.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import embedding
+from embedding import INPUT_SIZE, ONNX_INT8_MODEL_PATH, ONNX_MODEL_PATH, OnnxEmbedder, preprocess_face, to_bgr_array
+
+MATCH_THRESHOLD = float(os.getenv("MATCH_THRESHOLD", "0.30"))
+
+
+def export(output: str, int8_output: str = None, opset: int = 13) -> None:
+    import tensorflow as tf
+    import tf2onnx
+
+    keras_model = embedding.DeepFaceEmbedder().model.model
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    spec = (tf.TensorSpec((None, INPUT_SIZE[0], INPUT_SIZE[1], 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=opset, output_path=output)
+    print(f"[OK] Modelo exportado para {output}")
+
+    if int8_output:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(output, int8_output, weight_type=QuantType.QInt8)
+        print(f"[OK] Modelo int8 (quantização dinâmica) gravado em {int8_output}")
+
+
+def load_images(faces_dir: str, limit: int) -> list:
+    """Até `limit` recortes de faces (arrays BGR) de uma pasta, em ordem estável."""
+    images = []
+    for root, _dirs, files in os.walk(faces_dir):
+        for name in sorted(files):
+            if name.lower().endswith((".png", ".jpg", ".jpeg")):
+                images.append(to_bgr_array(os.path.join(root, name)))
+                if len(images) >= limit:
+                    return images
+    if not images:
+        raise SystemExit(f"Nenhuma imagem encontrada em {faces_dir}")
+    return images
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _forward_batched(model, inputs: np.ndarray, batch_size: int = 32) -> np.ndarray:
+    return np.concatenate([model.forward(inputs[i:i + batch_size]) for i in range(0, len(inputs), batch_size)])
+
+
+def _compare(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    """Distâncias por face e concordância das decisões de match entre dois conjuntos de embeddings."""
+    reference, candidate = _normalize(reference), _normalize(candidate)
+    self_distance = 1.0 - np.sum(reference * candidate, axis=1)
+    ref_pairs = 1.0 - reference @ reference.T
+    pairs = 1.0 - candidate @ candidate.T
+    upper = np.triu_indices(len(reference), k=1)
+    ref_match = (ref_pairs <= MATCH_THRESHOLD)[upper]
+
+    def agreement(threshold: float) -> float:
+        return float(np.mean((pairs[upper] <= threshold) == ref_match)) if len(reference) > 1 else 1.0
+
+    # Limiar do candidato que reproduz melhor as decisões da referência em MATCH_THRESHOLD
+    best_threshold = max(np.round(np.arange(0.05, 0.805, 0.01), 2),
+                         key=lambda t: (agreement(t), -abs(t - MATCH_THRESHOLD)))
+    return {
+        "max_cosine_distance": float(self_distance.max()),
+        "mean_cosine_distance": float(self_distance.mean()),
+        "max_pair_distance_delta": float(np.abs(pairs - ref_pairs)[upper].max()) if len(reference) > 1 else 0.0,
+        "match_decision_agreement": agreement(MATCH_THRESHOLD),
+        "best_threshold": float(best_threshold),
+        "best_threshold_agreement": agreement(best_threshold),
+    }
+
+
+def parity(args) -> int:
+    images = load_images(args.faces_dir, args.limit)
+    inputs = np.stack([preprocess_face(img) for img in images])
+    deepface = embedding.DeepFaceEmbedder()
+    # Modelo: Keras nas entradas pré-processadas; ponta a ponta: o caminho do backend "deepface"
+    reference_model = _forward_batched(deepface, inputs)
+    reference_e2e = np.stack([deepface.embed(img) for img in images])
+
+    report = {"faces": int(len(images)), "match_threshold": MATCH_THRESHOLD, "variants": {}}
+    failed = False
+    variants = (("onnx", args.onnx, args.tolerance), ("onnx-int8", args.onnx_int8, args.int8_tolerance))
+    for name, path, tolerance in variants:
+        if not os.path.exists(path):
+            print(f"[WARN] {name}: {path} não existe; ignorado")
+            continue
+        onnx_model = OnnxEmbedder(path, name=name)
+        model = _compare(reference_model, _forward_batched(onnx_model, inputs))
+        model["tolerance"] = tolerance
+        model["ok"] = model["max_cosine_distance"] <= tolerance
+        e2e = _compare(reference_e2e, np.stack([onnx_model.embed(img) for img in images]))
+        e2e["min_agreement"] = args.min_agreement
+        e2e["ok"] = e2e["match_decision_agreement"] >= args.min_agreement
+        failed |= not (model["ok"] and e2e["ok"])
+        report["variants"][name] = {"model": model, "end_to_end": e2e}
+        print(f"[{'OK' if model['ok'] else 'FALHA'}] {name} (modelo): distância máx. "
+              f"{model['max_cosine_distance']:.2e} (tolerância {tolerance:.0e})")
+        print(f"[{'OK' if e2e['ok'] else 'FALHA'}] {name} (ponta a ponta x DeepFace.represent): "
+              f"distância média {e2e['mean_cosine_distance']:.3f}, máx. {e2e['max_cosine_distance']:.3f} | "
+              f"concordância de match: {e2e['match_decision_agreement']:.2%} (mínimo {args.min_agreement:.0%}) | "
+              f"limiar equivalente: {e2e['best_threshold']:.2f} ({e2e['best_threshold_agreement']:.2%})")
+
+    if not report["variants"]:
+        # Sem nenhum modelo comparado a paridade não foi verificada: não pode passar
+        print("[FALHA] nenhuma variante ONNX encontrada; gere os modelos com: python onnx_tools.py export --int8")
+        failed = True
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if failed else 0
+
+
+def _throughput(fn, items, repeats: int = 1) -> float:
+    fn(items[0])  # aquecimento
+    start = time.perf_counter()
+    count = 0
+    for _ in range(repeats):
+        for item in items:
+            fn(item)
+            count += 1
+    return round(count / (time.perf_counter() - start), 2)
+
+
+def throughput(args) -> int:
+    images = load_images(args.faces_dir, args.limit)
+    inputs = np.stack([preprocess_face(img) for img in images])
+
+    report = {"faces": int(len(inputs)), "faces_per_s": {}}
+    deepface = embedding.DeepFaceEmbedder()
+    report["faces_per_s"]["deepface.represent"] = _throughput(deepface.embed, images)
+    backends = [("keras", deepface)]
+    for name, path in (("onnx", args.onnx), ("onnx-int8", args.onnx_int8)):
+        if os.path.exists(path):
+            backends.append((name, OnnxEmbedder(path, name=name)))
+    for name, model in backends:
+        for batch_size in args.batch:
+            batches = [inputs[i:i + batch_size] for i in range(0, len(inputs), batch_size)]
+            per_s = _throughput(model.forward, batches) * batch_size
+            report["faces_per_s"][f"{name}.batch{batch_size}"] = round(per_s, 2)
+
+    for key, value in report["faces_per_s"].items():
+        print(f"{key:<28} {value:>10.2f} faces/s")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exportação, paridade e vazão do backend ONNX.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="Exporta o Facenet512 para ONNX")
+    p_export.add_argument("--output", default=ONNX_MODEL_PATH)
+    p_export.add_argument("--int8", action="store_true", help="Gera também a variante int8")
+    p_export.add_argument("--int8-output", default=ONNX_INT8_MODEL_PATH)
+    p_export.add_argument("--opset", type=int, default=13)
+
+    for name in ("parity", "throughput"):
+        p = sub.add_parser(name)
+        p.add_argument("--faces-dir", default="faces_images", help="Pasta com recortes de faces")
+        p.add_argument("--limit", type=int, default=200, help="Máximo de imagens (default: 200)")
+        p.add_argument("--onnx", default=ONNX_MODEL_PATH)
+        p.add_argument("--onnx-int8", default=ONNX_INT8_MODEL_PATH)
+        p.add_argument("--output", help="Grava o relatório em JSON")
+        if name == "parity":
+            p.add_argument("--tolerance", type=float, default=1e-4,
+                           help="Distância de cosseno máxima Keras x ONNX fp32 (default: 1e-4)")
+            p.add_argument("--int8-tolerance", type=float, default=2e-2,
+                           help="Distância de cosseno máxima Keras x ONNX int8 (default: 2e-2)")
+            p.add_argument("--min-agreement", type=float, default=0.99,
+                           help="Concordância mínima das decisões de match ponta a ponta, "
+                                "DeepFace.represent x ONNX (default: 0.99)")
+        else:
+            p.add_argument("--batch", nargs="+", type=int, default=[1, 8], help="Tamanhos de lote (default: 1 8)")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export(args.output, args.int8_output if args.int8 else None, args.opset)
+        return
+    sys.exit(parity(args) if args.command == "parity" else throughput(args))
+
+
+if __name__ == "__main__":
+    main()
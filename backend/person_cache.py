@@ -0,0 +1,96 @@
+"""
+Cache em memória dos resumos de pessoas (uuid, tags, foto principal, nº de fotos).
+
+As rotas de leitura (/pessoas/{uuid}, /photo, /photos/count) e o process_face faziam
+um find_one por chamada, e cada PeopleCard do frontend chama duas delas por render.
+O cache é um LRU limitado por tamanho, com TTL para limitar a defasagem entre workers;
+as escritas do próprio processo invalidam (ou atualizam) a entrada na hora.
+
+Com vários workers, o listener de change stream do Mongo (requer replica set) invalida
+as entradas alteradas por qualquer processo.
+
+A foto principal é guardada como chave/caminho salvo no Mongo; a URL é gerada na
+leitura (URLs pré-assinadas do S3 expiram).
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import metrics
+
+
+class PersonCache:
+    def __init__(self, loader: Callable[[str], Optional[dict]], max_entries: int = 10000, ttl_s: float = 30.0):
+        """`loader(uuid)` lê o resumo no Mongo: {_id, uuid, tags, primary_photo, photo_count} ou None."""
+        self.loader = loader
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # uuid -> (expira_em, resumo)
+        self._uuid_by_oid = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, person_uuid: str) -> Optional[dict]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(person_uuid)
+            if entry is not None and entry[0] >= now:
+                self._entries.move_to_end(person_uuid)
+                metrics.PERSON_CACHE.labels("hit").inc()
+                return entry[1]
+        metrics.PERSON_CACHE.labels("miss").inc()
+        summary = self.loader(person_uuid)
+        if summary is not None:
+            self.put(summary)
+        return summary
+
+    def put(self, summary: dict) -> None:
+        with self._lock:
+            self._entries[summary["uuid"]] = (time.monotonic() + self.ttl_s, summary)
+            self._entries.move_to_end(summary["uuid"])
+            if summary.get("_id") is not None:
+                self._uuid_by_oid[summary["_id"]] = summary["uuid"]
+            while len(self._entries) > self.max_entries:
+                _uuid, (_exp, evicted) = self._entries.popitem(last=False)
+                self._uuid_by_oid.pop(evicted.get("_id"), None)
+
+    def photo_added(self, person_uuid: str, stored_path: str) -> None:
+        """Atualiza a entrada após um $push em image_paths (sem reler o Mongo)."""
+        with self._lock:
+            entry = self._entries.get(person_uuid)
+            if entry is None:
+                return
+            expires_at, summary = entry
+            summary = dict(summary, photo_count=summary["photo_count"] + 1,
+                           primary_photo=summary["primary_photo"] or stored_path)
+            self._entries[person_uuid] = (expires_at, summary)
+
+    def invalidate(self, person_uuid: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(person_uuid, None)
+            if entry is not None:
+                self._uuid_by_oid.pop(entry[1].get("_id"), None)
+
+    def invalidate_oid(self, oid) -> None:
+        """Invalida pelo _id do documento (eventos de delete do change stream só trazem o _id)."""
+        with self._lock:
+            person_uuid = self._uuid_by_oid.pop(oid, None)
+            if person_uuid is not None:
+                self._entries.pop(person_uuid, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._uuid_by_oid.clear()
+
+    def watch(self, collection) -> None:
+        """
+        Consome o change stream da coleção pessoas invalidando as entradas alteradas.
+        Bloqueia; rode em uma thread. Requer MongoDB em replica set.
+        """
+        with collection.watch() as stream:
+            for change in stream:
+                self.invalidate_oid(change["documentKey"]["_id"])
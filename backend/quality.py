@@ -0,0 +1,97 @@
+"""
+Filtro de qualidade das faces, executado antes do embedding.
+
+Recortes muito pequenos, borrados, com score de detecção baixo ou de perfil geram
+embeddings ruins: não casam com ninguém e viram pessoas novas (lixo na galeria).
+O filtro é barato (alguns ms) e usa:
+- tamanho: menor lado do recorte em pixels;
+- nitidez: variância do Laplaciano do recorte em tons de cinza, redimensionado para
+  160x160 (a entrada do Facenet512) para não depender da resolução;
+- score de detecção do MediaPipe;
+- pose pelos keypoints do MediaPipe: "yaw" é o deslocamento do nariz em relação ao
+  ponto médio dos olhos, ao longo da linha dos olhos, dividido pela distância entre os
+  olhos (0 = frontal, ~0.5 = bem virado); "roll" é a inclinação da linha dos olhos (graus).
+
+QUALITY_GATE define o que fazer com faces reprovadas:
+- "off" (padrão): desativa o filtro (todas as faces aceitas pelo detector seguem);
+- "skip": não calcula o embedding nem registra nada;
+- "track": reconhece pessoas já cadastradas (registra a presença, sem foto), mas nunca
+  cria uma pessoa nova nem adiciona a foto à galeria.
+
+O filtro é opcional porque reprova faces que antes eram reconhecidas; o score mínimo
+padrão é o mesmo limiar do detector (min_conf de detect_faces), então só tamanho,
+nitidez e pose reprovam por padrão quando ele é ligado.
+"""
+import math
+import os
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+QUALITY_GATE = os.getenv("QUALITY_GATE", "off").lower()
+QUALITY_MIN_SIZE = int(os.getenv("QUALITY_MIN_SIZE", "40"))
+QUALITY_MIN_BLUR = float(os.getenv("QUALITY_MIN_BLUR", "30"))
+QUALITY_MIN_SCORE = float(os.getenv("QUALITY_MIN_SCORE", "0.5"))
+QUALITY_MAX_YAW = float(os.getenv("QUALITY_MAX_YAW", "0.5"))
+QUALITY_MAX_ROLL = float(os.getenv("QUALITY_MAX_ROLL", "35"))
+
+# Ordem dos keypoints do MediaPipe FaceDetection
+RIGHT_EYE, LEFT_EYE, NOSE_TIP = 0, 1, 2
+
+
+class FaceQuality(NamedTuple):
+    ok: bool
+    reasons: List[str]      # "tamanho", "nitidez", "score", "pose"
+    size: int
+    blur: float
+    score: Optional[float]
+    yaw: Optional[float]
+    roll: Optional[float]
+
+    def as_dict(self) -> dict:
+        return {k: (round(v, 3) if isinstance(v, float) else v) for k, v in self._asdict().items()}
+
+
+def blur_score(image_rgb: np.ndarray) -> float:
+    """Variância do Laplaciano (maior = mais nítido)."""
+    import cv2
+    gray = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY)
+    gray = cv2.resize(gray, (160, 160), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def pose_from_keypoints(keypoints: Sequence[Tuple[float, float]]) -> Tuple[Optional[float], Optional[float]]:
+    """(yaw, roll) aproximados a partir dos keypoints (coordenadas absolutas)."""
+    if not keypoints or len(keypoints) <= NOSE_TIP:
+        return None, None
+    right_eye = np.asarray(keypoints[RIGHT_EYE], dtype=np.float64)
+    left_eye = np.asarray(keypoints[LEFT_EYE], dtype=np.float64)
+    nose = np.asarray(keypoints[NOSE_TIP], dtype=np.float64)
+    eye_line = left_eye - right_eye
+    eye_dist = float(np.linalg.norm(eye_line))
+    if eye_dist == 0:
+        return None, None
+    yaw = float(np.dot(nose - (right_eye + left_eye) / 2, eye_line / eye_dist) / eye_dist)
+    roll = math.degrees(math.atan2(eye_line[1], eye_line[0]))
+    return yaw, roll
+
+
+def assess_face(image: Image.Image, score: float = None,
+                keypoints: Sequence[Tuple[float, float]] = None) -> FaceQuality:
+    """Avalia um recorte de face (PIL). score/keypoints vêm da detecção, quando houver."""
+    image_rgb = np.asarray(image.convert("RGB"))
+    size = int(min(image_rgb.shape[:2]))
+    blur = blur_score(image_rgb) if size > 0 else 0.0
+    yaw, roll = pose_from_keypoints(keypoints)
+
+    reasons = []
+    if size < QUALITY_MIN_SIZE:
+        reasons.append("tamanho")
+    if blur < QUALITY_MIN_BLUR:
+        reasons.append("nitidez")
+    if score is not None and score < QUALITY_MIN_SCORE:
+        reasons.append("score")
+    if (yaw is not None and abs(yaw) > QUALITY_MAX_YAW) or (roll is not None and abs(roll) > QUALITY_MAX_ROLL):
+        reasons.append("pose")
+    return FaceQuality(not reasons, reasons, size, blur, score, yaw, roll)
@@ -0,0 +1,92 @@
+"""
+Cache LRU com TTL curto dos resultados de reconhecimento.
+
+Retentativas do cliente (desktop_senderV2 --retries) e câmeras paradas reenviam
+recortes praticamente iguais; com o cache, o resultado anterior é devolvido sem
+embedding, busca na galeria nem gravação da foto.
+
+A chave é uma impressão digital do recorte decodificado: dHash de 64 bits (gradientes
+horizontais da imagem em cinza reduzida para 9x8), que tolera ruído de recompressão
+JPEG, mais o tamanho do recorte arredondado para múltiplos de 16 px e o escopo de
+origem (a câmera ou, sem câmera, o cliente). Sem entrada exata, vale a entrada de mesmo
+escopo/tamanho cujo dHash difere em até `max_distance` bits: recortes de origens
+diferentes nunca compartilham resultado.
+
+As entradas são cópias: o chamador pode alterar o resultado devolvido (ex.: incluir o
+box do recorte) sem afetar o cache.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+# (escopo de origem e tamanho do recorte, dHash)
+Fingerprint = Tuple[str, int]
+
+
+def fingerprint(image: Image.Image, scope: str = None) -> Fingerprint:
+    gray = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    dhash = int("".join("1" if b else "0" for b in bits), 2)
+    w, h = image.size
+    return f"{scope or ''}:{w // 16}x{h // 16}", dhash
+
+
+class RecognitionCache:
+    def __init__(self, max_entries: int = 1024, ttl_s: float = 5.0, max_distance: int = 4):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Fingerprint, tuple]" = OrderedDict()  # chave -> (expira_em, resultado)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _nearest(self, key: Fingerprint) -> Optional[Fingerprint]:
+        if key in self._entries:
+            return key
+        prefix, dhash = key
+        best, best_distance = None, self.max_distance + 1
+        for candidate in self._entries:
+            if candidate[0] == prefix:
+                distance = bin(candidate[1] ^ dhash).count("1")
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+        return best
+
+    def get(self, key: Fingerprint) -> Optional[dict]:
+        now = time.monotonic()
+        with self._lock:
+            found = self._nearest(key)
+            if found is None:
+                return None
+            expires_at, result = self._entries[found]
+            if expires_at < now:
+                del self._entries[found]
+                return None
+            self._entries.move_to_end(found)
+            return dict(result)
+
+    def put(self, key: Fingerprint, result: dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_s, dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_person(self, person_uuid: str) -> int:
+        """Remove as entradas que apontam para a pessoa (ex.: pessoa excluída ou tags alteradas)."""
+        with self._lock:
+            keys = [k for k, (_exp, result) in self._entries.items() if result.get("uuid") == person_uuid]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
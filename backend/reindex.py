@@ -0,0 +1,217 @@
+"""
+Reindexação offline da galeria: calcula os embeddings das fotos cadastradas em
+paralelo (pool de processos) e grava no log de embeddings (ver embedding_store.py),
+de onde o servidor carrega a galeria no startup sem precisar embedar nada.
+
+A execução pode ser interrompida (Ctrl+C) e retomada: as fotos já presentes no log
+são puladas, e o checkpoint guarda o progresso e as fotos que falharam.
+
+Exemplos (a partir da pasta backend, com o servidor parado ou reiniciando-o depois):
+    python reindex.py                                 # fotos do Mongo (coleção pessoas)
+    python reindex.py --source dir --images-dir faces_images --workers 4 --batch 32
+    python reindex.py --backend onnx --force          # refaz tudo com outro backend
+    python reindex.py --retry-failed
+"""
+import argparse
+import json
+import os
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+import embedding
+from embedding import EMBEDDING_DIM
+from embedding_store import EmbeddingLog
+from storage import create_storage, to_key
+
+# (uuid da pessoa, chave da foto)
+Photo = Tuple[str, str]
+
+_embedder = None
+_storage = None
+
+
+# ----------------------------
+# Fontes de fotos
+# ----------------------------
+def photos_from_mongo(mongo_uri: str, db_name: str, images_dir: str) -> Iterator[Photo]:
+    from pymongo import MongoClient
+    client = MongoClient(mongo_uri)
+    try:
+        for pessoa in client[db_name]["pessoas"].find({}, {"uuid": 1, "image_paths": 1}):
+            for stored_image_path in pessoa.get("image_paths", []):
+                yield pessoa["uuid"], to_key(stored_image_path, images_dir)
+    finally:
+        client.close()
+
+
+def photos_from_dir(images_dir: str) -> Iterator[Photo]:
+    """Percorre faces_images/<uuid>/*.png (apenas armazenamento local)."""
+    for person_uuid in sorted(os.listdir(images_dir)):
+        person_dir = os.path.join(images_dir, person_uuid)
+        if not os.path.isdir(person_dir):
+            continue
+        for name in sorted(os.listdir(person_dir)):
+            if name.lower().endswith((".png", ".jpg", ".jpeg")):
+                yield person_uuid, f"{person_uuid}/{name}"
+
+
+# ----------------------------
+# Workers
+# ----------------------------
+def _init_worker(backend: str, images_dir: str) -> None:
+    global _embedder, _storage
+    # Ctrl+C é tratado só pelo processo principal, que grava o checkpoint
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _embedder = embedding.create_embedder(backend)
+    _storage = create_storage(images_dir)
+
+
+def _embed_batch(photos: List[Photo]):
+    """Retorna (fotos ok, vetores (N, dim), {chave: erro})."""
+    done, vectors, failed = [], [], {}
+    if isinstance(_embedder, embedding.OnnxEmbedder):
+        # Sem redetecção no ONNX: o lote inteiro vai em uma única inferência
+        inputs = []
+        for person_uuid, key in photos:
+            try:
+                inputs.append(embedding.preprocess_face(embedding.to_bgr_array(_storage.local_path(key))))
+                done.append((person_uuid, key))
+            except Exception as e:
+                failed[key] = str(e)
+        if inputs:
+            vectors = list(_embedder.forward(np.stack(inputs)))
+    else:
+        for person_uuid, key in photos:
+            try:
+                vectors.append(_embedder.embed(_storage.local_path(key)))
+                done.append((person_uuid, key))
+            except Exception as e:
+                failed[key] = str(e)
+    return done, np.asarray(vectors, dtype=np.float32).reshape(len(done), EMBEDDING_DIM), failed
+
+
+# ----------------------------
+# Checkpoint
+# ----------------------------
+def load_checkpoint(path: str, backend: str) -> dict:
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("backend") == backend:
+            return checkpoint
+    return {"backend": backend, "done": 0, "failed": {}}
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    checkpoint["updated_at"] = datetime.now().isoformat(timespec="seconds")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _format_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:d}h{seconds % 3600 // 60:02d}m{seconds % 60:02d}s"
+
+
+# ----------------------------
+# Execução
+# ----------------------------
+def run(args) -> int:
+    log = EmbeddingLog(args.embeddings_dir, EMBEDDING_DIM, args.backend).open()
+    checkpoint_path = args.checkpoint or os.path.join(args.embeddings_dir, "reindex.checkpoint.json")
+    if args.force:
+        log.reset()
+        checkpoint = {"backend": args.backend, "done": 0, "failed": {}}
+    else:
+        checkpoint = load_checkpoint(checkpoint_path, args.backend)
+    if args.retry_failed:
+        checkpoint["failed"] = {}
+
+    if args.source == "mongo":
+        photos = list(photos_from_mongo(args.mongo_uri, args.db, args.images_dir))
+    else:
+        photos = list(photos_from_dir(args.images_dir))
+    _uuids, indexed_keys, _vectors = log.load()
+    skip = set(indexed_keys) | set(checkpoint["failed"])
+    del _vectors
+    pending = [photo for photo in photos if photo[1] not in skip]
+    print(f"[INFO] {len(photos)} fotos; {len(photos) - len(pending)} já indexadas/ignoradas; "
+          f"{len(pending)} a processar com {args.workers} processos ({args.backend}).")
+    if not pending:
+        return 0
+
+    batches = [pending[i:i + args.batch] for i in range(0, len(pending), args.batch)]
+    started = last_report = time.perf_counter()
+    processed = 0
+    executor = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                   initargs=(args.backend, args.images_dir))
+    in_flight = set()
+    try:
+        while batches or in_flight:
+            # No máximo 2 lotes por processo em andamento (memória limitada)
+            while batches and len(in_flight) < args.workers * 2:
+                in_flight.add(executor.submit(_embed_batch, batches.pop(0)))
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done, vectors, failed = future.result()
+                log.append_many([u for u, _k in done], [k for _u, k in done], vectors)
+                checkpoint["done"] += len(done)
+                checkpoint["failed"].update(failed)
+                processed += len(done) + len(failed)
+                save_checkpoint(checkpoint_path, checkpoint)
+
+            now = time.perf_counter()
+            if now - last_report >= args.report_every or not (batches or in_flight):
+                last_report = now
+                rate = processed / (now - started)
+                eta = (len(pending) - processed) / rate if rate > 0 else 0
+                print(f"[{processed}/{len(pending)}] {processed / len(pending):6.1%} | "
+                      f"{rate:7.2f} fotos/s | ETA {_format_eta(eta)} | falhas: {len(checkpoint['failed'])}")
+    except KeyboardInterrupt:
+        print("\n[INFO] Interrompido; progresso salvo. Rode novamente para continuar.")
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+        save_checkpoint(checkpoint_path, checkpoint)
+        return 130
+    executor.shutdown()
+
+    elapsed = time.perf_counter() - started
+    print(f"[OK] {processed} fotos em {elapsed:.1f}s ({processed / elapsed:.2f} fotos/s); "
+          f"falhas: {len(checkpoint['failed'])} (ver {checkpoint_path}).")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reindexação paralela e retomável da galeria de embeddings.")
+    parser.add_argument("--source", choices=("mongo", "dir"), default="mongo",
+                        help="Fotos da coleção pessoas (default) ou da pasta de imagens")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--db", default="reconhecimento-facial-v3")
+    parser.add_argument("--images-dir", default="faces_images")
+    parser.add_argument("--embeddings-dir", default=os.getenv("EMBEDDINGS_DIR", "embeddings"))
+    parser.add_argument("--backend", default=embedding.EMBEDDING_BACKEND,
+                        help=f"Backend de embedding (default: {embedding.EMBEDDING_BACKEND})")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Processos de embedding (default: metade das CPUs)")
+    parser.add_argument("--batch", type=int, default=32, help="Fotos por lote (default: 32)")
+    parser.add_argument("--checkpoint", help="Arquivo de checkpoint (default: <embeddings-dir>/reindex.checkpoint.json)")
+    parser.add_argument("--force", action="store_true", help="Descarta o log e reindexa tudo")
+    parser.add_argument("--retry-failed", action="store_true", help="Tenta novamente as fotos que falharam")
+    parser.add_argument("--report-every", type=float, default=5.0, help="Intervalo do relatório em s (default: 5)")
+    args = parser.parse_args()
+    args.workers = max(1, args.workers)
+    args.batch = max(1, args.batch)
+    args.backend = args.backend.lower()
+    raise SystemExit(run(args))
+
+
+if __name__ == "__main__":
+    main()
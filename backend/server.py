@@ -1,23 +1,42 @@
-
 import datetime
 from bson import ObjectId
-from fastapi import FastAPI, Body, HTTPException
+from fastapi import FastAPI, Body, HTTPException, Request, WebSocket
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from deepface import DeepFace
 import uuid
 import os
 import base64
 import io
 from PIL import Image
 from pymongo import MongoClient
-import shutil
-from typing import List
+from typing import List, Optional, Tuple
 import asyncio
 from datetime import datetime
 from fastapi import UploadFile, File
+import threading
+import time
+import json
+from fastapi import Response
+from storage import create_storage, to_key
+from gallery import FaceGallery
+from shared_gallery import SharedFaceGallery
+from embedding_store import EmbeddingLog
+import detection
+import embedding
+from detection import detect_faces
+from embedding import EMBEDDING_DIM, embed_face
+import metrics
+import quality
+from recognition_cache import RecognitionCache, fingerprint
+from person_cache import PersonCache
+import admission
+from video_jobs import VideoJobs
+import video_segments
+from video_segments import SegmentRunner
+import consolidation
+from consolidation import Consolidator
 # ----------------------------
 # Global Setup and Model Loading
 # ----------------------------
@@ -34,20 +53,26 @@ os.makedirs(IMAGES_DIR, exist_ok=True)
 TEMP_DIR = "temp"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
-# Load the DeepFace model once at startup (global variable)
-model_facenet512 = DeepFace.build_model("Facenet512")
-print("DeepFace model loaded.")
+# Armazenamento das fotos (local ou S3, ver storage.py / STORAGE_BACKEND)
+storage = create_storage(IMAGES_DIR)
+storage.on_upload_error = lambda key, error: metrics.STORAGE_UPLOAD_FAILURES.inc()
+
+
+def photo_url(stored_path: str) -> str:
+    """Converte um caminho/chave salvo no Mongo na URL pública da foto."""
+    return storage.url(to_key(stored_path, IMAGES_DIR))
+
+
+def photo_local_path(stored_path: str) -> str:
+    """Converte um caminho/chave salvo no Mongo em um arquivo local legível."""
+    return storage.local_path(to_key(stored_path, IMAGES_DIR))
+
+# O modelo DeepFace, o TensorFlow, o MediaPipe e o OpenCV são carregados sob demanda
+# (ver embedding.py / detection.py) e aquecidos no evento de startup (ver warmup abaixo).
 
 quantidade_fotos_relacionadas = 1000
 
-# ----------------------------
-# Inicialização do detector dlib
-# ----------------------------
-#import dlib
-import cv2  # Necessário para conversão para escala de cinza
-import mediapipe as mp
 import numpy as np
-#detector = dlib.get_frontal_face_detector()
 
 # ----------------------------
 # FastAPI App and Middleware
@@ -60,20 +85,40 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=list(metrics.LOAD.headers().keys()),
 )
 
-# Serve the images directory as static files
-app.mount("/static", StaticFiles(directory=IMAGES_DIR), name="static")
+
+@app.middleware("http")
+async def load_headers(request, call_next):
+    """Anuncia a carga atual (requisições em andamento e latência recente) em todas as respostas."""
+    response = await call_next(request)
+    response.headers.update(metrics.LOAD.headers())
+    return response
+
+# Serve the images directory as static files (apenas no armazenamento local)
+if os.getenv("STORAGE_BACKEND", "local").lower() == "local":
+    app.mount("/static", StaticFiles(directory=IMAGES_DIR), name="static")
+
+
+@app.on_event("shutdown")
+def flush_storage():
+    # Garante que uploads pendentes (S3) terminem antes de encerrar o processo
+    storage.flush()
 
 # ----------------------------
 # Pydantic Models
 # ----------------------------
 class ImagePayload(BaseModel):
     image: str  # Base64-encoded image
+    camera: Optional[str] = None  # Câmera/stream de origem (ou header X-Camera-Id)
 
 class TagPayload(BaseModel):
     tag: str
 
+class ConsolidationApplyPayload(BaseModel):
+    proposals: Optional[List[int]] = None  # índices das propostas; None = todas as pendentes
+
 class FaceItem(BaseModel):
     image: str  # Base64 da imagem
     timestamp: int  # Timestamp enviado pelo frontend (em milissegundos)
@@ -81,252 +126,929 @@ class FaceItem(BaseModel):
 class BatchImagePayload(BaseModel):
     images: List[FaceItem]
 
+class CropItem(BaseModel):
+    image: str  # Base64 do recorte da face
+    box: List[int]  # [x_min, y_min, x_max, y_max] no frame original
+    score: Optional[float] = None  # Confiança da detecção no cliente
+
+class CropBatchPayload(BaseModel):
+    faces: List[CropItem]
+    timestamp: Optional[int] = None  # Timestamp do frame no cliente (em milissegundos)
+    camera: Optional[str] = None  # Câmera/stream de origem (ou header X-Camera-Id)
+
 # ----------------------------
-# MediaPipe Face Detection (substitui dlib)
+# Embeddings e galeria de faces
 # ----------------------------
-mp_face = mp.solutions.face_detection
-
-# Crie uma função utilitária para converter o bounding box relativo do MediaPipe
-# em coordenadas absolutas (x_min, y_min, x_max, y_max)
-def _mp_bbox_to_abs(image_width: int, image_height: int, relative_bbox) -> tuple[int, int, int, int]:
-    x_min = int(relative_bbox.xmin * image_width)
-    y_min = int(relative_bbox.ymin * image_height)
-    w     = int(relative_bbox.width * image_width)
-    h     = int(relative_bbox.height * image_height)
-    x_max = x_min + w
-    y_max = y_min + h
-
-    # clamp para dentro da imagem
-    x_min = max(0, x_min)
-    y_min = max(0, y_min)
-    x_max = min(image_width - 1, x_max)
-    y_max = min(image_height - 1, y_max)
-    return x_min, y_min, x_max, y_max
-
-
-def detect_faces_mediapipe(image_np_rgb: np.ndarray,
-                           min_conf: float = 0.8,
-                           model_selection: int = 1):
-    """
-    Executa a detecção de faces com MediaPipe FaceDetection.
-    - image_np_rgb deve estar em RGB
-    - model_selection: 0 (faces próximas) | 1 (distantes)
-    Retorna lista de boxes absolutos (x_min, y_min, x_max, y_max).
-    """
-    # Cria e fecha o detector a cada chamada (thread-safe no FastAPI)
-    with mp_face.FaceDetection(model_selection=model_selection,
-                               min_detection_confidence=min_conf) as face_det:
-        results = face_det.process(image_np_rgb)
-
-    boxes = []
-    if results and results.detections:
-        h, w, _ = image_np_rgb.shape
-        for det in results.detections:
-            rel_bbox = det.location_data.relative_bounding_box
-            x_min, y_min, x_max, y_max = _mp_bbox_to_abs(w, h, rel_bbox)
-            # (Opcional) adicionar uma margem ao redor da face (ex.: 10%)
-            margin = int(0.10 * max(x_max - x_min, y_max - y_min))
-            x_min = max(0, x_min - margin)
-            y_min = max(0, y_min - margin)
-            x_max = min(w - 1, x_max + margin)
-            y_max = min(h - 1, y_max + margin)
-            boxes.append((x_min, y_min, x_max, y_max))
-    return boxes
+# Limiar de distância de cosseno do Facenet512 (o mesmo usado pelo DeepFace.verify)
+MATCH_THRESHOLD = float(os.getenv("MATCH_THRESHOLD", "0.30"))
+
+# Com GALLERY_SHARED=1 a galeria fica em arquivos mapeados em GALLERY_DIR e é
+# compartilhada por todos os workers (gunicorn/uvicorn --workers), em vez de uma cópia
+# por processo. O primeiro worker a subir constrói a galeria; os demais aguardam.
+GALLERY_SHARED = os.getenv("GALLERY_SHARED", "0") == "1"
+GALLERY_DIR = os.getenv("GALLERY_DIR", "gallery")
+GALLERY_SEGMENT_ROWS = int(os.getenv("GALLERY_SEGMENT_ROWS", "65536"))
+GALLERY_BUILD_TIMEOUT = float(os.getenv("GALLERY_BUILD_TIMEOUT", "3600"))
+
+if GALLERY_SHARED:
+    gallery = SharedFaceGallery(GALLERY_DIR, dim=EMBEDDING_DIM, segment_rows=GALLERY_SEGMENT_ROWS)
+else:
+    gallery = FaceGallery(dim=EMBEDDING_DIM)
+_gallery_lock = threading.Lock()
+
+# Log em disco dos embeddings (ver embedding_store.py): no restart a galeria é lida
+# dele em vez de recalcular o embedding de todas as fotos. EMBEDDINGS_LOG=0 desativa.
+EMBEDDINGS_LOG = os.getenv("EMBEDDINGS_LOG", "1") != "0"
+EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", "embeddings")
+EMBEDDINGS_COMPACT_INTERVAL = float(os.getenv("EMBEDDINGS_COMPACT_INTERVAL", "3600"))
+EMBEDDINGS_COMPACT_RATIO = float(os.getenv("EMBEDDINGS_COMPACT_RATIO", "0.2"))
+
+embedding_log = EmbeddingLog(EMBEDDINGS_DIR, EMBEDDING_DIM, embedding.EMBEDDING_BACKEND).open() if EMBEDDINGS_LOG else None
+
+
+def add_to_gallery(person_uuid: str, key: str, face_embedding) -> None:
+    """Adiciona a foto à galeria e ao log de embeddings."""
+    gallery.add(person_uuid, key, face_embedding)
+    if embedding_log:
+        embedding_log.append(person_uuid, key, face_embedding)
+
+
+def _build_gallery() -> None:
+    """
+    Popula a galeria com as fotos cadastradas no Mongo: os embeddings já presentes no
+    log são lidos do disco; só as fotos que faltam nele são embedadas (e gravadas no log).
+    """
+    photos = [(pessoa["uuid"], stored_image_path)
+              for pessoa in pessoas.find({}, {"uuid": 1, "image_paths": 1})
+              for stored_image_path in pessoa.get("image_paths", [])]
+
+    known = set()
+    if embedding_log:
+        started = time.perf_counter()
+        live_keys = {to_key(stored_image_path, IMAGES_DIR) for _uuid, stored_image_path in photos}
+        log_uuids, log_keys, log_vectors = embedding_log.load()
+        # Fotos que não estão mais no Mongo (ex.: removidas com o servidor parado) ficam de fora
+        rows = [i for i, key in enumerate(log_keys) if key in live_keys]
+        if len(rows) == len(log_keys):
+            gallery.add_many(log_uuids, log_keys, log_vectors)
+        else:
+            gallery.add_many([log_uuids[i] for i in rows], [log_keys[i] for i in rows], log_vectors[rows])
+        del log_vectors
+        known = {log_keys[i] for i in rows}
+        print(f"Galeria: {len(rows)} embeddings lidos de {EMBEDDINGS_DIR} em "
+              f"{(time.perf_counter() - started) * 1000:.1f} ms.")
+
+    uuids, keys, embeddings = [], [], []
+
+    def flush():
+        gallery.add_many(uuids, keys, embeddings)
+        if embedding_log:
+            embedding_log.append_many(uuids, keys, embeddings)
+        uuids.clear()
+        keys.clear()
+        embeddings.clear()
+
+    for person_uuid, stored_image_path in photos:
+        key = to_key(stored_image_path, IMAGES_DIR)
+        if key in known:
+            continue
+        try:
+            embeddings.append(embed_face(photo_local_path(stored_image_path)))
+            uuids.append(person_uuid)
+            keys.append(key)
+        except Exception as e:
+            print(f"Erro ao carregar {stored_image_path} na galeria: {e}")
+        if len(uuids) >= 256:
+            flush()
+    flush()
+
+
+def ensure_gallery_loaded():
+    """
+    Carrega a galeria na primeira utilização. Na galeria compartilhada, só o worker
+    que a criou calcula os embeddings; os outros esperam ela ficar pronta.
+    """
+    if gallery.loaded:
+        return gallery
+    with _gallery_lock:
+        if gallery.loaded:
+            return gallery
+        # wait_ready devolve False se o construtor morreu e este worker assumiu a construção
+        build = not GALLERY_SHARED or gallery.attach() or not gallery.wait_ready(timeout=GALLERY_BUILD_TIMEOUT)
+        if build:
+            _build_gallery()
+            if GALLERY_SHARED:
+                gallery.mark_ready()
+        gallery.loaded = True
+        print(f"Galeria carregada: {len(gallery)} fotos.")
+    return gallery
+
+
+# ----------------------------
+# Cache de resumos de pessoas
+# ----------------------------
+# Resumo (uuid, tags, foto principal, nº de fotos) usado pelas rotas de leitura e pelo
+# process_face. PERSON_CACHE_TTL limita a defasagem entre workers; com
+# PERSON_CACHE_CHANGE_STREAM=1 (Mongo em replica set) as alterações feitas por qualquer
+# worker invalidam o cache imediatamente.
+PERSON_CACHE_SIZE = int(os.getenv("PERSON_CACHE_SIZE", "10000"))
+PERSON_CACHE_TTL = float(os.getenv("PERSON_CACHE_TTL", "30"))
+PERSON_CACHE_CHANGE_STREAM = os.getenv("PERSON_CACHE_CHANGE_STREAM", "0") == "1"
+
+
+def load_person_summary(person_uuid: str) -> Optional[dict]:
+    docs = list(pessoas.aggregate([
+        {"$match": {"uuid": person_uuid}},
+        {"$limit": 1},
+        {"$project": {
+            "uuid": 1,
+            "tags": {"$ifNull": ["$tags", []]},
+            "primary_photo": {"$arrayElemAt": [{"$ifNull": ["$image_paths", []]}, 0]},
+            "photo_count": {"$size": {"$ifNull": ["$image_paths", []]}},
+        }},
+    ]))
+    if not docs:
+        return None
+    summary = docs[0]
+    summary.setdefault("primary_photo", None)
+    return summary
+
+
+person_cache = PersonCache(load_person_summary, PERSON_CACHE_SIZE, PERSON_CACHE_TTL)
+
+
+def watch_person_changes() -> None:
+    try:
+        person_cache.watch(pessoas)
+    except Exception as e:
+        # Ex.: Mongo standalone (change streams exigem replica set); o TTL continua valendo
+        print(f"[person-cache] Change stream indisponível: {e}")
+
+
+@app.on_event("startup")
+def start_person_cache_listener():
+    if PERSON_CACHE_CHANGE_STREAM:
+        threading.Thread(target=watch_person_changes, name="person-cache-watch", daemon=True).start()
+
+
+# ----------------------------
+# Cache de resultados de reconhecimento
+# ----------------------------
+# Recortes quase idênticos (retentativas, câmera parada) da mesma origem (câmera ou,
+# sem câmera, o cliente) dentro do TTL devolvem o resultado anterior sem embedding nem
+# gravação da foto; a presença continua sendo registrada (com "cache": true), a não ser
+# com RECOGNITION_CACHE_RECORD_PRESENCE=0. RECOGNITION_CACHE_TTL=0 desativa.
+RECOGNITION_CACHE_TTL = float(os.getenv("RECOGNITION_CACHE_TTL", "5"))
+RECOGNITION_CACHE_SIZE = int(os.getenv("RECOGNITION_CACHE_SIZE", "1024"))
+RECOGNITION_CACHE_PER_CAMERA = os.getenv("RECOGNITION_CACHE_PER_CAMERA", "1") == "1"
+RECOGNITION_CACHE_MAX_DISTANCE = int(os.getenv("RECOGNITION_CACHE_MAX_DISTANCE", "4"))
+RECOGNITION_CACHE_RECORD_PRESENCE = os.getenv("RECOGNITION_CACHE_RECORD_PRESENCE", "1") != "0"
+
+recognition_cache = (RecognitionCache(RECOGNITION_CACHE_SIZE, RECOGNITION_CACHE_TTL, RECOGNITION_CACHE_MAX_DISTANCE)
+                     if RECOGNITION_CACHE_TTL > 0 else None)
 
 
 # ----------------------------
 # Função interna de reconhecimento
 # ----------------------------
-def process_face(image: Image.Image, start_time: datetime = None) -> dict:
+def record_presence(start_time: datetime, tempos: dict, person_uuid: str, photo_path: Optional[str],
+                    tags: list, extra_fields: dict = None, **fields) -> None:
+    """
+    Registra a presença com os tempos de início, fim e o tempo de processamento (ms).
+    "tempos" detalha as etapas em ms; a gravação da própria presença não entra em "persistencia".
+    """
+    finish_time = datetime.now()
+    presence_doc = {
+        "data": start_time.strftime("%Y-%m-%d"),
+        "hora": start_time.strftime("%H:%M:%S"),
+        "inicio": start_time.strftime("%Y-%m-%d %H:%M:%S.%f"),
+        "fim": finish_time.strftime("%Y-%m-%d %H:%M:%S.%f"),
+        "tempo_processamento": int((finish_time - start_time).total_seconds() * 1000),
+        "tempos": tempos,
+        "pessoa": person_uuid,
+        "foto_captura": photo_path,
+        "tags": tags,
+        **fields,
+    }
+    if extra_fields:
+        presence_doc.update(extra_fields)
+    with metrics.stage("mongo_write"):
+        presencas.insert_one(presence_doc)
+
+
+def follow_merged(person_uuid: str) -> Optional[str]:
+    """Pessoa que sumiu depois do match (mesclada ou excluída): devolve o alvo do merge ou None."""
+    person_cache.invalidate(person_uuid)
+    if recognition_cache is not None:
+        recognition_cache.invalidate_person(person_uuid)
+    return consolidator.reassign(person_uuid)
+
+
+def reserve_photo(person_uuid: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Reserva a chave da foto nova em image_paths antes de gravá-la: (pessoa, chave).
+    Se a pessoa foi mesclada pela consolidação depois do match, a foto vai para o alvo;
+    se foi excluída, devolve (None, None).
+    """
+    while person_uuid is not None:
+        key = f"{person_uuid}/{uuid.uuid4()}.png"
+        if pessoas.update_one({"uuid": person_uuid}, {"$push": {"image_paths": key}}).matched_count:
+            return person_uuid, key
+        person_uuid = follow_merged(person_uuid)
+    return None, None
+
+
+def process_face(image: Image.Image, start_time: datetime = None, timings: dict = None,
+                 extra_fields: dict = None, score: float = None, keypoints=None,
+                 face_embedding=None, cache_scope: Optional[str] = None) -> dict:
     """
     Processa uma face (imagem PIL) realizando o reconhecimento e o registro de presença.
-    Registra os campos: inicio, fim e tempo_processamento (ms).
+    Registra os campos: inicio, fim, tempo_processamento (ms) e tempos (ms por etapa).
+    `timings` traz as etapas já medidas pelo chamador (decodificacao, deteccao, fila).
+    `extra_fields` são gravados junto na presença (ex.: bbox do recorte).
+    `score`/`keypoints` da detecção alimentam o filtro de qualidade (ver quality.py).
+    `face_embedding`: embedding já calculado (ex.: processos de segmento de vídeo).
+    `cache_scope`: origem do recorte quando não há câmera (ex.: o cliente), para o cache
+    de reconhecimento; sem câmera nem escopo o cache não é usado.
     Retorna um dicionário com o resultado (uuid, tags, primary_photo).
     """
     if start_time is None:
         start_time = datetime.now()
+    tempos = dict(timings or {})
 
-    # Salva a imagem em um arquivo temporário
-    temp_file = os.path.join(TEMP_DIR, "temp_input.png")
-    image.save(temp_file)
+    cache_key = None
+    scope = ((extra_fields or {}).get("camera") or cache_scope) if RECOGNITION_CACHE_PER_CAMERA else ""
+    if recognition_cache is not None and scope is not None:
+        cache_key = fingerprint(image, scope)
+        cached = recognition_cache.get(cache_key)
+        metrics.RECOGNITION_CACHE.labels("hit" if cached else "miss").inc()
+        if cached:
+            if RECOGNITION_CACHE_RECORD_PRESENCE:
+                # A pessoa continua diante da câmera: a presença é registrada, sem nova foto
+                record_presence(start_time, tempos, cached["uuid"], None, cached.get("tags", []),
+                                extra_fields, cache=True)
+            cached["cache"] = True
+            return cached
 
-    known_people = list(pessoas.find({}))
-    match_found = False
-    matched_uuid = None
-    captured_photo_path = None
+    face_quality = None
+    if quality.QUALITY_GATE != "off":
+        with metrics.stage("quality", tempos, "qualidade"):
+            face_quality = quality.assess_face(image, score, keypoints)
+        metrics.FACE_QUALITY.labels(face_quality.reasons[0] if face_quality.reasons else "ok").inc()
+        if not face_quality.ok and quality.QUALITY_GATE == "skip":
+            return {"uuid": None, "tags": [], "primary_photo": None, "qualidade": face_quality.as_dict()}
+    # No modo "track" uma face reprovada só serve para reconhecer quem já está cadastrado
+    enroll = face_quality is None or face_quality.ok
 
-    for pessoa in known_people:
-        person_uuid = pessoa["uuid"]
-        image_paths = pessoa.get("image_paths", [])
-        for stored_image_path in image_paths:
-            try:
-                result = DeepFace.verify(
-                    img1_path=temp_file,
-                    img2_path=stored_image_path,
-                    enforce_detection=False,
-                    model_name="Facenet512"
-                )
-                if result.get("verified") is True:
-                    match_found = True
-                    matched_uuid = person_uuid
-                    person_folder = os.path.join(IMAGES_DIR, matched_uuid)
-                    new_filename = f"{uuid.uuid4()}.png"
-                    captured_photo_path = os.path.join(person_folder, new_filename)
-                    image.save(captured_photo_path)
-                    pessoas.update_one(
-                        {"uuid": matched_uuid},
-                        {"$push": {"image_paths": captured_photo_path}}
-                    )
-                    break
-            except Exception as e:
-                print(f"Erro ao verificar com {stored_image_path}: {e}")
-        if match_found:
-            break
+    ensure_gallery_loaded()
+
+    if face_embedding is not None:
+        embedding = face_embedding
+    else:
+        with metrics.stage("embedding", tempos):
+            embedding = embed_face(image)
+
+    with metrics.stage("match", tempos):
+        matched_uuid, _distance = gallery.match(embedding, MATCH_THRESHOLD)
 
-    if not match_found:
+    if matched_uuid is None and not enroll:
+        return {"uuid": None, "tags": [], "primary_photo": None, "qualidade": face_quality.as_dict()}
+
+    if matched_uuid is not None and enroll:
+        with metrics.stage("mongo_write", tempos, "persistencia"):
+            matched_uuid, photo_key = reserve_photo(matched_uuid)
+
+    if matched_uuid is not None:
+        # Face reprovada (modo "track"): registra só a presença, sem gravar a foto na pasta
+        # da pessoa (ela não entraria em image_paths e ficaria órfã)
+        captured_photo_path = None
+        if enroll:
+            try:
+                with metrics.stage("image_write", tempos, "persistencia"):
+                    captured_photo_path = storage.save(photo_key, image)
+            except Exception:
+                pessoas.update_one({"uuid": matched_uuid}, {"$pull": {"image_paths": photo_key}})
+                raise
+            person_cache.photo_added(matched_uuid, captured_photo_path)
+        metrics.IDENTITIES.labels("matched").inc()
+    else:
         new_uuid_str = str(uuid.uuid4())
-        person_folder = os.path.join(IMAGES_DIR, new_uuid_str)
-        os.makedirs(person_folder, exist_ok=True)
         new_filename = f"{new_uuid_str}.png"
-        captured_photo_path = os.path.join(person_folder, new_filename)
-        image.save(captured_photo_path)
+        with metrics.stage("image_write", tempos, "persistencia"):
+            captured_photo_path = storage.save(f"{new_uuid_str}/{new_filename}", image)
         new_face_doc = {
             "uuid": new_uuid_str,
             "image_paths": [captured_photo_path],
             "tags": []
         }
-        pessoas.insert_one(new_face_doc)
+        with metrics.stage("mongo_write", tempos, "persistencia"):
+            pessoas.insert_one(new_face_doc)
+        person_cache.put({"_id": new_face_doc["_id"], "uuid": new_uuid_str, "tags": [],
+                          "primary_photo": captured_photo_path, "photo_count": 1})
         matched_uuid = new_uuid_str
+        metrics.IDENTITIES.labels("new").inc()
 
-    if os.path.exists(temp_file):
-        os.remove(temp_file)
+    # A nova foto passa a fazer parte da galeria, como antes no laço de verify
+    if enroll:
+        add_to_gallery(matched_uuid, captured_photo_path, embedding)
 
-    pessoa = pessoas.find_one({"uuid": matched_uuid})
+    with metrics.stage("mongo_read", tempos, "persistencia"):
+        pessoa = person_cache.get(matched_uuid)
+        if not pessoa and not enroll:
+            # Modo "track": nada foi gravado; a pessoa pode ter sido mesclada depois do match
+            matched_uuid = follow_merged(matched_uuid)
+            pessoa = person_cache.get(matched_uuid) if matched_uuid else None
     if not pessoa:
         raise HTTPException(status_code=404, detail="Pessoa não encontrada")
     primary_photo = None
-    if pessoa.get("image_paths"):
-        primary_photo = f"http://localhost:8000/static/{os.path.relpath(pessoa['image_paths'][0], IMAGES_DIR).replace(os.path.sep, '/')}"
-
-    finish_time = datetime.now()
-    processing_time_ms = int((finish_time - start_time).total_seconds() * 1000)
+    if pessoa["primary_photo"]:
+        primary_photo = photo_url(pessoa["primary_photo"])
 
-    # Registra a presença com os tempos de início, fim e o tempo de processamento (ms)
-    presence_doc = {
-        "data": start_time.strftime("%Y-%m-%d"),
-        "hora": start_time.strftime("%H:%M:%S"),
-        "inicio": start_time.strftime("%Y-%m-%d %H:%M:%S.%f"),
-        "fim": finish_time.strftime("%Y-%m-%d %H:%M:%S.%f"),
-        "tempo_processamento": processing_time_ms,
-        "pessoa": matched_uuid,
-        "foto_captura": captured_photo_path,
-        "tags": pessoa.get("tags", [])
-    }
-    presencas.insert_one(presence_doc)
+    quality_fields = {"qualidade": face_quality.as_dict()} if face_quality is not None else {}
+    record_presence(start_time, tempos, matched_uuid, captured_photo_path, pessoa.get("tags", []),
+                    extra_fields, **quality_fields)
 
-    return {
+    result = {
         "uuid": matched_uuid,
         "tags": pessoa.get("tags", []),
         "primary_photo": primary_photo
     }
+    if face_quality is not None:
+        result["qualidade"] = face_quality.as_dict()
+    if cache_key is not None:
+        recognition_cache.put(cache_key, result)
+    return result
 
 
 
 
+# ----------------------------
+# Warmup e health checks
+# ----------------------------
+# Com WARMUP_ON_STARTUP=0 os componentes são carregados apenas no primeiro request
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") != "0"
+
+readiness = {
+    "mongo": False,
+    "modelo": False,
+    "detector": False,
+    "galeria": False,
+    "erro": None,
+}
+
+
+def ensure_indexes() -> None:
+    """Índices das buscas por pessoa (rotas, cache de pessoas e última presença) e dos jobs de vídeo."""
+    pessoas.create_index("uuid")
+    presencas.create_index([("pessoa", 1), ("inicio", -1)])
+    video_jobs.ensure_indexes()
+    consolidator.ensure_indexes()
+
+
+def warmup_components() -> None:
+    """
+    Carrega os componentes pesados fora do caminho dos requests: conexão com o Mongo,
+    modelo Facenet512 (com uma inferência fictícia), MediaPipe e a galeria de embeddings.
+    """
+    steps = (
+        ("mongo", lambda: (client.admin.command("ping"), ensure_indexes())),
+        ("modelo", embedding.warmup),
+        ("detector", detection.warmup),
+        ("galeria", ensure_gallery_loaded),
+    )
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            step()
+            readiness[name] = True
+            print(f"[warmup] {name} pronto em {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            readiness["erro"] = f"{name}: {e}"
+            print(f"[warmup] Falha em {name}: {e}")
+            return
+
+
+@app.on_event("startup")
+def start_warmup():
+    # Em uma thread, para o processo já responder /health/live enquanto aquece
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=warmup_components, name="warmup", daemon=True).start()
+
+
+def compact_embedding_log_periodically() -> None:
+    """Compacta o log de embeddings quando as linhas removidas passam de EMBEDDINGS_COMPACT_RATIO."""
+    while True:
+        time.sleep(EMBEDDINGS_COMPACT_INTERVAL)
+        if not gallery.loaded:
+            continue
+        try:
+            dropped = embedding_log.compact(min_dead_ratio=EMBEDDINGS_COMPACT_RATIO)
+            if dropped:
+                print(f"[embeddings] Compactação descartou {dropped} linhas.")
+        except Exception as e:
+            print(f"[embeddings] Falha na compactação: {e}")
+
+
+@app.on_event("startup")
+def start_compaction():
+    if embedding_log and EMBEDDINGS_COMPACT_INTERVAL > 0:
+        threading.Thread(target=compact_embedding_log_periodically, name="embeddings-compact", daemon=True).start()
+
+
+def is_ready() -> bool:
+    if not WARMUP_ON_STARTUP:
+        # Sem warmup não há o que esperar: os componentes carregam no primeiro request
+        return True
+    return all(readiness[k] for k in ("mongo", "modelo", "detector", "galeria"))
+
+
+@app.get("/health/live")
+async def health_live():
+    """Liveness: o processo está de pé e respondendo."""
+    return JSONResponse({"status": "alive"}, status_code=200)
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """
+    Readiness: 200 somente após o warmup (Mongo, modelo, detector e galeria carregados),
+    para o balanceador só rotear tráfego para workers aquecidos; 503 enquanto isso.
+    """
+    status_code = 200 if is_ready() else 503
+    return JSONResponse({"status": "ready" if status_code == 200 else "warming_up", **readiness},
+                        status_code=status_code)
+
+
+# ----------------------------
+# Controle de admissão (ver admission.py)
+# ----------------------------
+admission_queue = admission.AdmissionQueue()
+metrics.LOAD.depth_source = admission_queue.live_depth
+
+
+def request_source(request: Request) -> str:
+    """Origem dos frames sem câmera informada (fila própria na admissão): o IP do cliente."""
+    return request.client.host if request.client else ""
+
+
+def request_camera(request: Request, camera: Optional[str] = None) -> Optional[str]:
+    """Câmera de origem do frame: campo `camera` do payload ou header X-Camera-Id."""
+    return camera or request.headers.get("X-Camera-Id") or None
+
+
+def camera_fields(camera: Optional[str]) -> Optional[dict]:
+    """Campos gravados na presença para identificar a câmera."""
+    return {"camera": camera} if camera else None
+
+
+def rejection_response(e: admission.Rejected) -> JSONResponse:
+    """Frame substituído por um mais recente da mesma origem: 200 sem faces (não há o que
+    reenviar); recusado: 429/503 com Retry-After."""
+    if e.reason == "superseded":
+        return JSONResponse({"faces": [], "descartado": e.reason}, status_code=200)
+    return JSONResponse({"error": f"frame recusado ({e.reason})", "motivo": e.reason},
+                        status_code=e.status_code, headers={"Retry-After": str(e.retry_after)})
+
+
 # ----------------------------
 # Endpoints
 # --------------------------
 
 
+# ----------------------------
+# Jobs de vídeo (ver video_jobs.py)
+# ----------------------------
+# Frames de um vídeo aguardando na fila BULK ao mesmo tempo (limita a memória dos frames decodificados)
+VIDEO_INFLIGHT = int(os.getenv("VIDEO_INFLIGHT", "4"))
+
+
+def _video_frame_job(fila_ms: float, pil_image: Image.Image) -> list:
+    return recognize_frame(pil_image, {"fila": fila_ms})
+
+
+def _video_faces_job(fila_ms: float, faces: list) -> list:
+    """Reconhece as faces (SegmentFace) de um frame já detectado e embedado em um processo de segmento."""
+    metrics.FACES_PER_FRAME.observe(len(faces))
+    return [process_face(Image.fromarray(face.crop), timings={"fila": fila_ms}, score=face.score,
+                         keypoints=face.keypoints, face_embedding=face.embedding)
+            for face in faces]
+
+
+# Vídeos longos: decodificação, detecção e embedding em processos paralelos (ver video_segments.py)
+segment_runner = (SegmentRunner(backend=embedding.EMBEDDING_BACKEND)
+                  if video_segments.VIDEO_SEGMENT_WORKERS > 0 else None)
+
+video_jobs = VideoJobs(
+    db["video_jobs"], db["video_job_results"],
+    submit=lambda image: admission_queue.submit(_video_frame_job, image, priority=admission.BULK),
+    inflight=VIDEO_INFLIGHT,
+    segments=segment_runner,
+    submit_faces=lambda faces: admission_queue.submit(_video_faces_job, faces, priority=admission.BULK),
+)
+
+
+@app.on_event("startup")
+def start_video_jobs():
+    video_jobs.start()
+
+
+@app.on_event("shutdown")
+def stop_segment_runner():
+    if segment_runner is not None:
+        segment_runner.shutdown()
+
+
+@app.post("/video-jobs")
 @app.post("/process-video")
-async def process_video(video: UploadFile = File(...)):
-    """
-    Recebe um vídeo, extrai 1 frame a cada 2 e processa cada frame como imagem.
-    """
-    import cv2
-    import tempfile
-    import numpy as np
-    from PIL import Image
-
-    # Salva o vídeo temporariamente
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_video:
-        temp_video.write(await video.read())
-        temp_video_path = temp_video.name
-
-    cap = cv2.VideoCapture(temp_video_path)
-    frame_results = []
-    frame_idx = 0
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        if frame_idx % 2 == 0:
-            # Converte frame para PIL Image
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(rgb_frame)
-            # Chama a função de processamento facial já existente
-            result = process_face(pil_image)
-            frame_results.append(result)
-        frame_idx += 1
-
-    cap.release()
-    os.remove(temp_video_path)
-
-    return {"frames": frame_results}
+async def create_video_job(video: UploadFile = File(...)):
+    """
+    Recebe um vídeo e cria um job de processamento em segundo plano (1 frame a cada
+    VIDEO_FRAME_STEP, com prioridade menor que o reconhecimento ao vivo).
+    Responde 202 com o job; acompanhe em GET /video-jobs/{job_id}.
+    """
+    try:
+        job_id, path = video_jobs.new_upload_path(video.filename)
+        with open(path, "wb") as f:
+            while chunk := await video.read(1024 * 1024):
+                f.write(chunk)
+        job = video_jobs.create(job_id, path, video.filename)
+        return JSONResponse(VideoJobs.public(job), status_code=202)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
 
-@app.post("/recognize")
-async def recognize_face(payload: ImagePayload):
+
+@app.get("/video-jobs")
+async def list_video_jobs(page: int = 1, limit: int = 10):
+    """Lista paginada dos jobs de vídeo, do mais recente para o mais antigo."""
+    try:
+        total, jobs = video_jobs.list(page, limit)
+        return JSONResponse({"jobs": [VideoJobs.public(j) for j in jobs], "total": total}, status_code=200)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.get("/video-jobs/{job_id}")
+async def get_video_job(job_id: str):
+    """Status e progresso do job: frames processados, faces encontradas, fps e ETA."""
+    try:
+        job = video_jobs.get(job_id)
+        if not job:
+            return JSONResponse({"error": "Job não encontrado"}, status_code=404)
+        return JSONResponse(VideoJobs.public(job), status_code=200)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.get("/video-jobs/{job_id}/results")
+async def get_video_job_results(job_id: str, page: int = 1, limit: int = 50):
+    """Resultados paginados por frame ({frame, timestamp_ms, result | error}), na ordem do vídeo."""
+    try:
+        if not video_jobs.get(job_id):
+            return JSONResponse({"error": "Job não encontrado"}, status_code=404)
+        total, frames = video_jobs.frame_results(job_id, page, limit)
+        return JSONResponse({"frames": frames, "total": total}, status_code=200)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.post("/video-jobs/{job_id}/cancel")
+async def cancel_video_job(job_id: str):
+    """Cancela o job (na hora, se ainda estiver na fila; no próximo progresso, se em andamento)."""
+    try:
+        job = video_jobs.cancel(job_id)
+        if not job:
+            return JSONResponse({"error": "Job não encontrado"}, status_code=404)
+        return JSONResponse(VideoJobs.public(job), status_code=200)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+# ----------------------------
+# Consolidação de identidades
+# ----------------------------
+# Junta pessoas duplicadas (mesma pessoa com vários UUIDs) pela proximidade dos
+# embeddings, fora do caminho dos requests (ver consolidation.py). Com
+# CONSOLIDATION_INTERVAL > 0 roda periodicamente; com CONSOLIDATION_AUTO_APPLY=1 a
+# execução periódica aplica as propostas automáticas, senão só gera o relatório.
+def invalidate_merged(target: str, sources: List[str]) -> None:
+    for person_uuid in [target] + sources:
+        person_cache.invalidate(person_uuid)
+        if recognition_cache is not None:
+            recognition_cache.invalidate_person(person_uuid)
+
+
+consolidator = Consolidator(
+    db["consolidacoes"], pessoas, presencas, gallery, storage, embedding_log,
+    images_dir=IMAGES_DIR, load_gallery=ensure_gallery_loaded, on_merge=invalidate_merged,
+)
+
+
+@app.on_event("startup")
+def start_consolidation():
+    if consolidation.CONSOLIDATION_INTERVAL > 0:
+        threading.Thread(target=consolidator.run_forever,
+                         args=(consolidation.CONSOLIDATION_INTERVAL, consolidation.CONSOLIDATION_AUTO_APPLY),
+                         name="consolidation-periodic", daemon=True).start()
+
+
+@app.post("/consolidacao")
+async def start_consolidation_run(apply: bool = False):
     """
-    Rota para reconhecimento de face a partir de uma imagem única.
+    Analisa a galeria em segundo plano e gera um relatório com as propostas de merge.
+    Com apply=true aplica as propostas automáticas (distância até
+    CONSOLIDATION_AUTO_DISTANCE e sem conflito de tags). Responde 202 com o relatório.
     """
+    try:
+        report = consolidator.start(apply=apply)
+        if report is None:
+            return JSONResponse({"error": "Já existe uma consolidação em andamento"}, status_code=409)
+        return JSONResponse(Consolidator.public(report), status_code=202)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.get("/consolidacao")
+async def list_consolidations(page: int = 1, limit: int = 10):
+    """Lista paginada dos relatórios (sem as propostas), do mais recente para o mais antigo."""
+    try:
+        total, reports = consolidator.list(page, limit)
+        return JSONResponse({"reports": [Consolidator.public(r) for r in reports], "total": total}, status_code=200)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.get("/consolidacao/{report_id}")
+async def get_consolidation(report_id: str):
+    """Relatório completo: propostas, tamanho da galeria antes/depois e quanto encolheu."""
+    try:
+        report = consolidator.get(report_id)
+        if not report:
+            return JSONResponse({"error": "Relatório não encontrado"}, status_code=404)
+        return JSONResponse(Consolidator.public(report), status_code=200)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.post("/consolidacao/{report_id}/apply")
+async def apply_consolidation(report_id: str, payload: ConsolidationApplyPayload = Body(None)):
+    """Aplica propostas revisadas de um relatório concluído (todas as pendentes, sem corpo)."""
+    try:
+        indexes = payload.proposals if payload is not None else None
+        try:
+            report = await asyncio.get_running_loop().run_in_executor(None, consolidator.apply, report_id, indexes)
+        except consolidation.Busy:
+            return JSONResponse({"error": "Já existe uma consolidação em andamento"}, status_code=409)
+        if not report:
+            return JSONResponse({"error": "Relatório não encontrado"}, status_code=404)
+        if report["status"] != consolidation.DONE:
+            return JSONResponse({"error": f"Relatório em estado {report['status']}"}, status_code=409)
+        return JSONResponse(Consolidator.public(report), status_code=200)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+def _recognize_job(fila_ms: float, base64_image: str, camera: Optional[str], source: str) -> dict:
     # Registra o início do processamento
     start_time = datetime.now()
-    image_data = payload.image.split("base64,")[1]
-    result = process_face(Image.open(io.BytesIO(base64.b64decode(image_data))), start_time=start_time)
+    tempos = {"fila": fila_ms}
+    image = decode_base64_image(base64_image, tempos)
+    return process_face(image, start_time=start_time, timings=tempos, extra_fields=camera_fields(camera),
+                        cache_scope=source)
+
+
+@app.post("/recognize")
+async def recognize_face(payload: ImagePayload, request: Request):
+    """
+    Rota para reconhecimento de face a partir de uma imagem única.
+    """
+    with metrics.track_request("/recognize"):
+        try:
+            camera = request_camera(request, payload.camera)
+            source = request_source(request)
+            result = await admission_queue.run(_recognize_job, payload.image, camera, source,
+                                               source=source, camera=camera)
+        except admission.Rejected as e:
+            return rejection_response(e)
     return JSONResponse(result, status_code=200)
 
 
+def recognize_frame(image: Image.Image, frame_tempos: dict = None, extra_fields: dict = None,
+                    cache_scope: Optional[str] = None) -> list:
+    """
+    Detecta as faces de um frame (PIL RGB) com MediaPipe, recorta cada uma e executa
+    o reconhecimento/registro de presença. Usado pela rota HTTP e pelo WebSocket.
+    `cache_scope`: origem do frame para o cache de reconhecimento (ver process_face).
+    Retorna a lista de resultados (um por face).
+    """
+    frame_tempos = frame_tempos if frame_tempos is not None else {}
+    with metrics.stage("image_decode", frame_tempos, "decodificacao"):
+        # Array RGB na resolução original (MediaPipe lê RGB); a redução para o
+        # orçamento de detecção é feita em detect_faces, mantendo a proporção
+        image_np = np.asarray(image.convert("RGB"))
+
+    # Detecta faces com MediaPipe
+    with metrics.stage("detection", frame_tempos, "deteccao"):
+        faces = detect_faces(image_np, min_conf=0.5, model_selection=1)
+    metrics.FACES_PER_FRAME.observe(len(faces))
+    detected_at = time.perf_counter()
+    fila_frame = frame_tempos.get("fila", 0.0)
+
+    faces_results = []
+    for face in faces:
+        start_time = datetime.now()
+        # "fila": espera do frame (se houver) + espera desde a detecção até esta face (faces anteriores do frame)
+        tempos = dict(frame_tempos, fila=round(fila_frame + (time.perf_counter() - detected_at) * 1000, 3))
+        # Recorta a face do frame em resolução cheia
+        face_image = image.crop(face.box)
+        # Reaproveita seu pipeline de reconhecimento/registro
+        result_face = process_face(face_image, start_time=start_time, timings=tempos, extra_fields=extra_fields,
+                                   score=face.score, keypoints=face.keypoints, cache_scope=cache_scope)
+        faces_results.append(result_face)
+    return faces_results
+
+
+def _detect_and_recognize_job(fila_ms: float, base64_image: str, camera: Optional[str], source: str) -> list:
+    frame_tempos = {"fila": fila_ms}
+    image = decode_base64_image(base64_image, frame_tempos)
+    return recognize_frame(image, frame_tempos, camera_fields(camera), cache_scope=source)
+
+
 @app.post("/detect-and-recognize")
-async def detect_and_recognize(payload: ImagePayload):
+async def detect_and_recognize(payload: ImagePayload, request: Request):
     """
-    Rota que recebe um frame (imagem em Base64), realiza a detecção das faces utilizando dlib,
+    Rota que recebe um frame (imagem em Base64), realiza a detecção das faces utilizando MediaPipe,
     recorta cada face detectada e, para cada uma delas, realiza o reconhecimento e o registro de presença,
     medindo os tempos de início, fim e tempo de processamento.
     Retorna um array com os resultados para cada face processada.
+    O frame passa pela fila de admissão: com o servidor sobrecarregado a resposta é
+    429/503 com Retry-After (ver admission.py).
     """
-    base64_image = payload.image
-    try:
+    with metrics.track_request("/detect-and-recognize"):
+        try:
+            camera = request_camera(request, payload.camera)
+            source = request_source(request)
+            faces_results = await admission_queue.run(_detect_and_recognize_job, payload.image, camera, source,
+                                                      source=source, camera=camera)
+            return JSONResponse({"faces": faces_results}, status_code=200)
+        except admission.Rejected as e:
+            return rejection_response(e)
+        except Exception as e:
+            import traceback
+            print("Erro no detect-and-recognize:", traceback.format_exc())
+            metrics.ERRORS.labels("/detect-and-recognize").inc()
+            return JSONResponse({"error": str(e)}, status_code=500)
+
+def decode_base64_image(base64_image: str, tempos: dict = None) -> Image.Image:
+    """Decodifica uma imagem base64 (com ou sem prefixo data URL) em PIL RGB."""
+    with metrics.stage("base64_decode", tempos, "decodificacao"):
         if "base64," in base64_image:
             base64_image = base64_image.split("base64,")[1]
         image_bytes = base64.b64decode(base64_image)
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    with metrics.stage("image_decode", tempos, "decodificacao"):
+        return Image.open(io.BytesIO(image_bytes)).convert("RGB")
+
+
+def _recognize_crops_job(fila_ms: float, payload: CropBatchPayload, camera: Optional[str], source: str) -> list:
+    metrics.FACES_PER_FRAME.observe(len(payload.faces))
+    faces_results = []
+    for face in payload.faces:
+        start_time = datetime.now()
+        tempos = {"fila": fila_ms}
+        face_image = decode_base64_image(face.image, tempos)
+        extra_fields = {"bbox": face.box, "deteccao_cliente": True, **(camera_fields(camera) or {})}
+        if face.score is not None:
+            extra_fields["score_deteccao"] = face.score
+        if payload.timestamp is not None:
+            extra_fields["timestamp_frame"] = payload.timestamp
+        result_face = process_face(face_image, start_time=start_time, timings=tempos,
+                                   extra_fields=extra_fields, score=face.score, cache_scope=source)
+        result_face["box"] = face.box
+        faces_results.append(result_face)
+    return faces_results
+
+
+@app.post("/recognize-crops")
+async def recognize_crops(payload: CropBatchPayload, request: Request):
+    """
+    Rota para clientes que detectam as faces localmente (ex.: desktop_senderV2 --edge-detect):
+    recebe apenas os recortes das faces de um frame, com seus boxes e o timestamp do frame,
+    e executa o reconhecimento/registro de presença de cada recorte (sem detecção no servidor).
+    """
+    with metrics.track_request("/recognize-crops"):
+        try:
+            camera = request_camera(request, payload.camera)
+            source = request_source(request)
+            faces_results = await admission_queue.run(_recognize_crops_job, payload, camera, source,
+                                                      source=source, camera=camera)
+            return JSONResponse({"faces": faces_results}, status_code=200)
+        except admission.Rejected as e:
+            return rejection_response(e)
+        except Exception as e:
+            import traceback
+            print("Erro no recognize-crops:", traceback.format_exc())
+            metrics.ERRORS.labels("/recognize-crops").inc()
+            return JSONResponse({"error": str(e)}, status_code=500)
+
+# ----------------------------
+# Streaming por WebSocket
+# ----------------------------
+# Frames pendentes por conexão; acima disso o mais antigo é descartado
+WS_MAX_PENDING = int(os.getenv("WS_MAX_PENDING", "2"))
+
+
+def _decode_stream_frame(message: dict, tempos: dict) -> Image.Image:
+    """
+    Decodifica uma mensagem do WebSocket: binária (bytes JPEG/PNG) ou texto
+    (base64/data URL, ou JSON {"image": ...}).
+    """
+    if message.get("bytes") is not None:
+        with metrics.stage("image_decode", tempos, "decodificacao"):
+            return Image.open(io.BytesIO(message["bytes"])).convert("RGB")
+    text = message.get("text") or ""
+    if text.lstrip().startswith("{"):
+        text = json.loads(text)["image"]
+    return decode_base64_image(text, tempos)
 
-        image = image.resize((1344, 760))
 
-        # Converte a imagem para array RGB (MediaPipe lê RGB)
-        image_np = np.array(image)  # já está RGB por causa do .convert("RGB") lá em cima
+def _process_stream_frame(fila_admissao_ms: float, message: dict, fila_ms: float, camera: Optional[str],
+                          source: str) -> list:
+    tempos = {"fila": round(fila_ms + fila_admissao_ms, 3)}
+    image = _decode_stream_frame(message, tempos)
+    return recognize_frame(image, tempos, camera_fields(camera), cache_scope=source)
 
-        # Detecta faces com MediaPipe
-        boxes = detect_faces_mediapipe(image_np, min_conf=0.5, model_selection=1)
 
-        if not boxes:
-            return JSONResponse({"faces": []}, status_code=200)
+@app.websocket("/ws/stream")
+async def stream_frames(websocket: WebSocket, max_pending: int = WS_MAX_PENDING, camera: Optional[str] = None):
+    """
+    Streaming contínuo de uma câmera: o cliente mantém a conexão aberta e envia frames
+    (binário JPEG/PNG ou texto base64); os resultados voltam de forma assíncrona como
+    JSON {"seq", "faces", "dropped", "pending", "latency_ms"}.
+
+    Controle de fluxo por conexão: no máximo `max_pending` frames aguardam processamento;
+    quando chega um frame com a fila cheia, o mais antigo é descartado (drop-oldest),
+    pois para reconhecimento ao vivo só o frame mais recente interessa. Depois disso o
+    frame passa pela fila de admissão compartilhada com as rotas HTTP; se for recusado,
+    o resultado volta com "descartado" (motivo) e "retry_after" (s).
+    A câmera vem de `?camera=` (ou do header X-Camera-Id) e é gravada nas presenças.
+    """
+    await websocket.accept()
+    metrics.STREAM_CONNECTIONS.inc()
+    camera = camera or websocket.headers.get("X-Camera-Id") or None
+    source = f"ws:{websocket.client.host if websocket.client else ''}:{id(websocket)}"
+    pending: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_pending))
+    state = {"seq": 0, "dropped": 0}
 
-        faces_results = []
-        for (x_min, y_min, x_max, y_max) in boxes:
-            start_time = datetime.now()
-            # Recorta a face a partir do bounding box
-            face_image = image.crop((x_min, y_min, x_max, y_max))
-            # Reaproveita seu pipeline de reconhecimento/registro
-            result_face = process_face(face_image, start_time=start_time)
-            faces_results.append(result_face)
+    def enqueue(item) -> None:
+        if pending.full():
+            pending.get_nowait()
+            state["dropped"] += 1
+            metrics.FRAMES_DROPPED.labels("ws_backpressure").inc()
+        pending.put_nowait(item)
 
-        return JSONResponse({"faces": faces_results}, status_code=200)
+    async def receive_frames():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                state["seq"] += 1
+                enqueue((state["seq"], time.perf_counter(), message))
+        finally:
+            # Sentinela: encerra o processamento (sem descartar o que já está pendente, se couber)
+            enqueue(None)
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            seq, received_at, message = item
+            started = time.perf_counter()
+            with metrics.track_request("/ws/stream"):
+                try:
+                    faces = await admission_queue.run(_process_stream_frame, message,
+                                                      round((started - received_at) * 1000, 3), camera, source,
+                                                      source=source, camera=camera)
+                    response = {"seq": seq, "faces": faces}
+                except admission.Rejected as e:
+                    response = {"seq": seq, "faces": [], "descartado": e.reason, "retry_after": e.retry_after}
+                except Exception as e:
+                    print(f"Erro no frame {seq} do stream: {e}")
+                    metrics.ERRORS.labels("/ws/stream").inc()
+                    response = {"seq": seq, "error": str(e)}
+            response.update({
+                "dropped": state["dropped"],
+                "pending": pending.qsize(),
+                "latency_ms": round((time.perf_counter() - received_at) * 1000, 1),
+            })
+            await websocket.send_json(response)
     except Exception as e:
-        import traceback
-        print("Erro no detect-and-recognize:", traceback.format_exc())
-        return JSONResponse({"error": str(e)}, status_code=500)
+        # Conexão fechada pelo cliente durante o envio do resultado
+        print(f"Stream encerrado: {e}")
+    finally:
+        receiver.cancel()
+        metrics.STREAM_CONNECTIONS.dec()
 
 @app.get("/pessoas")
 async def list_pessoas(page: int = 1, limit: int = 10):
@@ -347,21 +1069,74 @@ async def list_pessoas(page: int = 1, limit: int = 10):
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+@app.get("/pessoas/summary")
+async def list_pessoas_summary(page: int = 1, limit: int = 10):
+    """
+    Página de pessoas já com tags, URL da foto principal, quantidade de fotos e a última
+    presença, em uma única agregação (evita as 2 requisições extras por card do frontend).
+    """
+    try:
+        skip = max(0, (page - 1) * limit)
+        result = list(pessoas.aggregate([
+            {"$facet": {
+                "total": [{"$count": "n"}],
+                "pessoas": [
+                    {"$sort": {"_id": 1}},
+                    {"$skip": skip},
+                    {"$limit": limit},
+                    {"$lookup": {
+                        "from": presencas.name,
+                        "let": {"uuid": "$uuid"},
+                        "pipeline": [
+                            {"$match": {"$expr": {"$eq": ["$pessoa", "$$uuid"]}}},
+                            {"$sort": {"inicio": -1}},
+                            {"$limit": 1},
+                            {"$project": {"_id": 0, "inicio": 1}},
+                        ],
+                        "as": "ultima_presenca",
+                    }},
+                    {"$project": {
+                        "uuid": 1,
+                        "tags": {"$ifNull": ["$tags", []]},
+                        "primary_photo": {"$arrayElemAt": [{"$ifNull": ["$image_paths", []]}, 0]},
+                        "photo_count": {"$size": {"$ifNull": ["$image_paths", []]}},
+                        "last_seen": {"$arrayElemAt": ["$ultima_presenca.inicio", 0]},
+                    }},
+                ],
+            }},
+        ]))[0]
+        items = []
+        for p in result["pessoas"]:
+            last_seen = p.pop("last_seen", None)
+            p.setdefault("primary_photo", None)
+            person_cache.put(p)
+            items.append({
+                "uuid": p["uuid"],
+                "tags": p["tags"],
+                "primary_photo": photo_url(p["primary_photo"]) if p["primary_photo"] else None,
+                "photo_count": p["photo_count"],
+                "last_seen": last_seen,
+            })
+        total = result["total"][0]["n"] if result["total"] else 0
+        return JSONResponse({"pessoas": items, "total": total}, status_code=200)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
 @app.get("/pessoas/{uuid}")
 async def get_pessoa(uuid: str):
     """
     Retorna os detalhes de uma pessoa, incluindo UUID, tags e a URL da foto principal.
     """
     try:
-        pessoa = pessoas.find_one({"uuid": uuid})
+        pessoa = person_cache.get(uuid)
         if not pessoa:
             raise HTTPException(status_code=404, detail="Pessoa não encontrada")
         primary_photo = None
-        if pessoa.get("image_paths"):
-            primary_photo = f"http://localhost:8000/static/{os.path.relpath(pessoa['image_paths'][0], IMAGES_DIR).replace(os.path.sep, '/')}"
+        if pessoa["primary_photo"]:
+            primary_photo = photo_url(pessoa["primary_photo"])
         return JSONResponse({
             "uuid": pessoa["uuid"],
-            "tags": pessoa.get("tags", []),
+            "tags": pessoa["tags"],
             "primary_photo": primary_photo
         }, status_code=200)
     except Exception as e:
@@ -377,10 +1152,7 @@ async def list_photos(uuid: str):
         if not pessoa:
             raise HTTPException(status_code=404, detail="Pessoa não encontrada")
         image_paths = pessoa.get("image_paths", [])
-        image_urls = [
-            f"http://localhost:8000/static/{os.path.relpath(path, IMAGES_DIR).replace(os.path.sep, '/')}"
-            for path in image_paths
-        ]
+        image_urls = [photo_url(path) for path in image_paths]
         return JSONResponse({"uuid": uuid, "image_urls": image_urls}, status_code=200)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -391,14 +1163,12 @@ async def get_primary_photo(uuid: str):
     Retorna a URL da foto principal (primeira foto) de uma pessoa.
     """
     try:
-        pessoa = pessoas.find_one({"uuid": uuid})
+        pessoa = person_cache.get(uuid)
         if not pessoa:
             raise HTTPException(status_code=404, detail="Pessoa não encontrada")
-        image_paths = pessoa.get("image_paths", [])
-        if not image_paths:
+        if not pessoa["primary_photo"]:
             raise HTTPException(status_code=404, detail="Nenhuma foto encontrada")
-        primary_photo = image_paths[0]
-        url = f"http://localhost:8000/static/{os.path.relpath(primary_photo, IMAGES_DIR).replace(os.path.sep, '/')}"
+        url = photo_url(pessoa["primary_photo"])
         return JSONResponse({"uuid": uuid, "primary_photo": url}, status_code=200)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -412,9 +1182,13 @@ async def delete_pessoa(uuid: str):
         result = pessoas.delete_one({"uuid": uuid})
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Pessoa não encontrada")
-        person_folder = os.path.join(IMAGES_DIR, uuid)
-        if os.path.exists(person_folder):
-            shutil.rmtree(person_folder)
+        person_cache.invalidate(uuid)
+        gallery.remove_person(uuid)
+        if recognition_cache is not None:
+            recognition_cache.invalidate_person(uuid)
+        if embedding_log:
+            embedding_log.delete_person(uuid)
+        storage.delete_prefix(uuid)
         return JSONResponse({"message": "Pessoa deletada com sucesso"}, status_code=200)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -434,14 +1208,18 @@ async def add_tag(uuid: str, payload: TagPayload):
         )
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Pessoa não encontrada")
-        pessoa = pessoas.find_one({"uuid": uuid})
+        person_cache.invalidate(uuid)
+        if recognition_cache is not None:
+            # Resultados em cache carregam as tags antigas
+            recognition_cache.invalidate_person(uuid)
+        pessoa = person_cache.get(uuid)
         primary_photo = None
-        if pessoa.get("image_paths"):
-            primary_photo = f"http://localhost:8000/static/{os.path.relpath(pessoa['image_paths'][0], IMAGES_DIR).replace(os.path.sep, '/')}"
+        if pessoa["primary_photo"]:
+            primary_photo = photo_url(pessoa["primary_photo"])
         return JSONResponse({
             "message": "Tag adicionada com sucesso",
             "uuid": pessoa["uuid"],
-            "tags": pessoa.get("tags", []),
+            "tags": pessoa["tags"],
             "primary_photo": primary_photo
         }, status_code=200)
     except Exception as e:
@@ -462,11 +1240,15 @@ async def remove_tag(uuid: str, payload: TagPayload):
         )
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Pessoa não encontrada")
-        pessoa = pessoas.find_one({"uuid": uuid})
+        person_cache.invalidate(uuid)
+        if recognition_cache is not None:
+            # Resultados em cache carregam as tags antigas
+            recognition_cache.invalidate_person(uuid)
+        pessoa = person_cache.get(uuid)
         return JSONResponse({
             "message": "Tag removida com sucesso",
             "uuid": pessoa["uuid"],
-            "tags": pessoa.get("tags", [])
+            "tags": pessoa["tags"]
         }, status_code=200)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -474,10 +1256,10 @@ async def remove_tag(uuid: str, payload: TagPayload):
 @app.get("/pessoas/{uuid}/photos/count")
 async def count_photos(uuid: str):
     try:
-        pessoa = pessoas.find_one({"uuid": uuid})
+        pessoa = person_cache.get(uuid)
         if not pessoa:
             raise HTTPException(status_code=404, detail="Pessoa não encontrada")
-        count = len(pessoa.get("image_paths", []))
+        count = pessoa["photo_count"]
         return JSONResponse({"uuid": uuid, "photo_count": count}, status_code=200)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -495,6 +1277,14 @@ async def delete_presenca(id: str):
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Métricas no formato Prometheus (latência por estágio, faces por frame,
+    identidades novas/reconhecidas, erros e requisições em andamento).
+    """
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # Para executar:
 # python -m uvicorn server:app --reload --host 0.0.0.0 --port 8000
 
@@ -518,7 +1308,7 @@ async def list_presencas(date: str = None, page: int = 1, limit: int = 10):
             foto_captura = p.get("foto_captura")
             foto_url = None
             if foto_captura:
-                foto_url = f"http://localhost:8000/static/{os.path.relpath(foto_captura, IMAGES_DIR).replace(os.path.sep, '/')}"
+                foto_url = photo_url(foto_captura)
             results.append({
                 "id": str(p["_id"]),  # Inclui o _id convertido para string
                 "uuid": p.get("pessoa"),
@@ -528,12 +1318,117 @@ async def list_presencas(date: str = None, page: int = 1, limit: int = 10):
                 "tags": p.get("tags", []),
                 "inicio": p.get("inicio"),
                 "fim": p.get("fim"),
-                "tempo_processamento": p.get("tempo_processamento")
+                "tempo_processamento": p.get("tempo_processamento"),
+                "tempos": p.get("tempos")
             })
         total = presencas.count_documents({"data": date})
         return JSONResponse({"presencas": results, "total": total, "date": date}, status_code=200)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+# ----------------------------
+# Estatísticas de latência
+# ----------------------------
+LATENCY_PERCENTILES = (0.50, 0.90, 0.99)
+
+
+def _percentile_expr(values_field: str, p: float) -> dict:
+    """Expressão de agregação do percentil p (nearest-rank) de um array já ordenado."""
+    size = {"$size": values_field}
+    index = {"$max": [0, {"$subtract": [{"$ceil": {"$multiply": [p, size]}}, 1]}]}
+    return {"$arrayElemAt": [values_field, index]}
+
+
+def _latency_group_pipeline(group_key, value_field: str = "$tempo_processamento") -> list:
+    """
+    Estágios que agrupam por `group_key` e calculam total, p50/p90/p99 e o
+    intervalo de tempo (primeiro/último "inicio") usado para a vazão.
+    """
+    project = {
+        "_id": 0,
+        "chave": "$_id",
+        "total": {"$size": "$valores"},
+        "primeiro": 1,
+        "ultimo": 1,
+    }
+    for p in LATENCY_PERCENTILES:
+        project[f"p{int(p * 100)}"] = _percentile_expr("$valores", p)
+    return [
+        {"$sort": {value_field[1:]: 1}},
+        {"$group": {
+            "_id": group_key,
+            "valores": {"$push": value_field},
+            "primeiro": {"$min": "$inicio"},
+            "ultimo": {"$max": "$inicio"},
+        }},
+        {"$project": project},
+        {"$sort": {"chave": 1}},
+    ]
+
+
+def _with_throughput(rows: list, key_name: str) -> list:
+    """Renomeia a chave do grupo e calcula a vazão (presenças/s) entre o primeiro e o último registro."""
+    result = []
+    for row in rows:
+        throughput = None
+        try:
+            first = datetime.strptime(row.pop("primeiro"), "%Y-%m-%d %H:%M:%S.%f")
+            last = datetime.strptime(row.pop("ultimo"), "%Y-%m-%d %H:%M:%S.%f")
+            span = (last - first).total_seconds()
+            if span > 0:
+                throughput = round(row["total"] / span, 4)
+        except (TypeError, ValueError, KeyError):
+            row.pop("primeiro", None)
+            row.pop("ultimo", None)
+        row[key_name] = row.pop("chave")
+        row["throughput_por_s"] = throughput
+        result.append(row)
+    return result
+
+
+@app.get("/stats/latency")
+async def latency_stats(date: str = None, start_date: str = None, end_date: str = None, camera: str = None):
+    """
+    Retorna p50/p90/p99 do tempo de processamento (ms) e a vazão (presenças/s)
+    por data, por câmera e por etapa (campo "tempos" das presenças).
+    Filtros opcionais: date (YYYY-MM-DD) ou intervalo start_date/end_date, e camera.
+    """
+    try:
+        match = {}
+        if date:
+            match["data"] = date
+        elif start_date or end_date:
+            match["data"] = {}
+            if start_date:
+                match["data"]["$gte"] = start_date
+            if end_date:
+                match["data"]["$lte"] = end_date
+        if camera:
+            match["camera"] = camera
+
+        camera_key = {"$ifNull": ["$camera", "desconhecida"]}
+        pipeline = [
+            {"$match": match},
+            {"$facet": {
+                "por_data": _latency_group_pipeline("$data"),
+                "por_camera": _latency_group_pipeline(camera_key),
+                "por_etapa": [
+                    {"$match": {"tempos": {"$type": "object"}}},
+                    {"$project": {"inicio": 1, "etapa": {"$objectToArray": "$tempos"}}},
+                    {"$unwind": "$etapa"},
+                    {"$project": {"inicio": 1, "nome": "$etapa.k", "valor": "$etapa.v"}},
+                ] + _latency_group_pipeline("$nome", "$valor"),
+            }},
+        ]
+        facets = list(presencas.aggregate(pipeline, allowDiskUse=True))[0]
+        return JSONResponse({
+            "filtro": {"date": date, "start_date": start_date, "end_date": end_date, "camera": camera},
+            "por_data": _with_throughput(facets["por_data"], "data"),
+            "por_camera": _with_throughput(facets["por_camera"], "camera"),
+            "por_etapa": _with_throughput(facets["por_etapa"], "etapa"),
+        }, status_code=200)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
 # To run:
 # python -m uvicorn server:app --reload --host 0.0.0.0 --port 8000
@@ -0,0 +1,360 @@
+"""
+Galeria de embeddings compartilhada entre workers (gunicorn/uvicorn --workers).
+
+Os vetores ficam em arquivos mapeados em memória (np.memmap) dentro de GALLERY_DIR,
+de modo que todos os processos leem as mesmas páginas do cache do sistema operacional:
+a memória residente não cresce com o número de workers.
+
+Arquivos:
+- gallery.meta   : 8 inteiros int64 (mágico, dimensão, linhas por segmento, total de
+                   linhas, linhas removidas, pronto, id da execução, pid do construtor);
+- gallery.NNN.seg: segmentos de tamanho fixo com `segment_rows` vetores float32
+                   normalizados (novos segmentos são criados conforme a galeria cresce,
+                   sem remapear os existentes);
+- gallery.ids    : uma linha "uuid<TAB>chave" por vetor, na mesma ordem;
+- gallery.lock   : trava entre processos;
+- gallery.users  : cada processo que usa a galeria mantém uma trava compartilhada nele.
+
+Execuções: a galeria é construída uma vez por execução do servidor, e não por worker.
+Um processo que abre a galeria sem nenhum outro processo vivo usando-a (trava
+exclusiva em gallery.users obtida) está em uma execução nova e a reconstrói; um worker
+que substitui outro sob o mesmo master encontra os irmãos vivos e reaproveita a
+galeria. Se o construtor morrer antes de marcá-la como pronta, o primeiro worker que
+perceber (pid do construtor não existe mais) assume a construção. No Windows, sem
+trava compartilhada, a execução é identificada pelo processo pai.
+
+Escrita: um escritor por vez (trava de arquivo). O escritor grava os vetores e os ids e
+só então publica o novo total em gallery.meta. Leitura: sem trava; a cada busca o leitor
+confere o total publicado e mapeia o que for novo, então um cadastro feito em um worker
+é visto pelos demais já na próxima busca.
+
+Remoção: os vetores da pessoa são zerados (distância 1.0, nunca casam).
+"""
+import os
+import threading
+import time
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+
+from gallery import normalize
+
+_MAGIC = 0x4C414746  # "FGAL"
+(M_MAGIC, M_DIM, M_SEGMENT_ROWS, M_COUNT, M_DELETED, M_READY, M_RUN_ID, M_BUILDER) = range(8)
+META_SLOTS = 8
+
+
+def pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    if os.name == "nt":
+        # os.kill no Windows encerra o processo: consulta o estado pela API
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    try:
+        # Linux: um processo morto ainda não recolhido pelo pai (zumbi) também conta como morto
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            return f.read().rsplit(b")", 1)[1].split()[0] != b"Z"
+    except (OSError, IndexError):
+        return True
+
+
+class FileLock:
+    """Trava exclusiva entre processos (fcntl no Linux/Mac, msvcrt no Windows) e entre threads."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._fh = None
+        self._depth = 0
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            self._fh = open(self.path, "a+b")
+            if os.name == "nt":
+                import msvcrt
+                self._fh.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(self._fh.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+            else:
+                import fcntl
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if os.name == "nt":
+                import msvcrt
+                self._fh.seek(0)
+                msvcrt.locking(self._fh.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+            self._fh.close()
+            self._fh = None
+        self._thread_lock.release()
+
+
+class SharedFaceGallery:
+    """
+    Mesma interface da FaceGallery (add, add_many, remove_person, match, len),
+    com os dados em arquivos mapeados compartilhados entre processos.
+    """
+
+    def __init__(self, directory: str = "gallery", dim: int = 512, segment_rows: int = 65536,
+                 run_id: Optional[int] = None):
+        self.directory = directory
+        self.dim = dim
+        self.segment_rows = segment_rows
+        # Só usado no Windows (ver docstring do módulo): workers do mesmo servidor
+        # compartilham o processo pai
+        self.run_id = run_id if run_id is not None else os.getppid()
+        os.makedirs(directory, exist_ok=True)
+        self._file_lock = FileLock(os.path.join(directory, "gallery.lock"))
+        self._users_fh = None
+        self._local = threading.RLock()
+        self._meta: Optional[np.memmap] = None
+        self._segments: List[np.memmap] = []
+        self._uuids: List[str] = []
+        self._keys: List[str] = []
+        self._ids_offset = 0
+        self.loaded = False
+
+    # ---------- arquivos ----------
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, "gallery.meta")
+
+    def _ids_path(self) -> str:
+        return os.path.join(self.directory, "gallery.ids")
+
+    def _segment_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"gallery.{index:03d}.seg")
+
+    def _open_segment(self, index: int, create: bool = False) -> np.memmap:
+        path = self._segment_path(index)
+        mode = "w+" if create and not os.path.exists(path) else "r+"
+        return np.memmap(path, dtype=np.float32, mode=mode, shape=(self.segment_rows, self.dim))
+
+    def _reset_files(self) -> None:
+        for name in os.listdir(self.directory):
+            if name.startswith("gallery.") and (name.endswith(".seg") or name.endswith(".ids")):
+                os.remove(os.path.join(self.directory, name))
+        open(self._ids_path(), "wb").close()
+        meta = np.memmap(self._meta_path(), dtype=np.int64, mode="w+", shape=(META_SLOTS,))
+        meta[:] = 0
+        meta[M_MAGIC], meta[M_DIM], meta[M_SEGMENT_ROWS] = _MAGIC, self.dim, self.segment_rows
+        meta[M_RUN_ID] = self.run_id
+        meta[M_BUILDER] = os.getpid()
+        meta.flush()
+        del meta
+
+    def _join(self) -> Optional[bool]:
+        """
+        Registra este processo como usuário da galeria (trava compartilhada mantida até
+        o fim do processo). Retorna se havia outro processo vivo usando-a; None no Windows.
+        Chamado com a trava de escrita, então ninguém mais testa a trava ao mesmo tempo.
+        """
+        if os.name == "nt":
+            return None
+        import fcntl
+        if self._users_fh is None:
+            self._users_fh = open(os.path.join(self.directory, "gallery.users"), "a+b")
+        try:
+            fcntl.flock(self._users_fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            others = False
+        except BlockingIOError:
+            others = True
+        fcntl.flock(self._users_fh.fileno(), fcntl.LOCK_SH)
+        return others
+
+    def attach(self) -> bool:
+        """
+        Abre a galeria compartilhada. Retorna True se este processo deve construí-la
+        (primeiro processo desta execução), False se ela já existe/está sendo construída.
+        """
+        with self._file_lock:
+            others = self._join()
+            build = True
+            if os.path.exists(self._meta_path()):
+                meta = np.memmap(self._meta_path(), dtype=np.int64, mode="r", shape=(META_SLOTS,))
+                same_run = others if others is not None else meta[M_RUN_ID] == self.run_id
+                build = not (meta[M_MAGIC] == _MAGIC and meta[M_DIM] == self.dim and same_run)
+                if not build:
+                    self.segment_rows = int(meta[M_SEGMENT_ROWS])
+                del meta
+            if build:
+                self._reset_files()
+            self._open_meta()
+            return build
+
+    def _open_meta(self) -> None:
+        with self._local:
+            self._meta = np.memmap(self._meta_path(), dtype=np.int64, mode="r+", shape=(META_SLOTS,))
+            self._segments, self._uuids, self._keys, self._ids_offset = [], [], [], 0
+
+    def mark_ready(self) -> None:
+        self._meta[M_READY] = 1
+        self._meta.flush()
+
+    def _take_over_build(self) -> bool:
+        """Assume a construção se o construtor morreu antes de terminar. True se assumiu."""
+        with self._file_lock:
+            if self._meta[M_READY] or pid_alive(int(self._meta[M_BUILDER])):
+                return False
+            print(f"[galeria] Construtor (pid {int(self._meta[M_BUILDER])}) morreu antes de terminar; "
+                  f"reconstruindo no pid {os.getpid()}.")
+            self._reset_files()
+            self._open_meta()
+            return True
+
+    def wait_ready(self, timeout: float = 3600.0, poll: float = 0.5) -> bool:
+        """
+        Aguarda o processo construtor terminar de popular a galeria. Retorna True quando
+        ela fica pronta, ou False se o construtor morreu e este processo assumiu a
+        construção (o chamador deve então construí-la e chamar mark_ready).
+        """
+        deadline = time.monotonic() + timeout
+        while not self._meta[M_READY]:
+            if self._take_over_build():
+                return False
+            if time.monotonic() > deadline:
+                raise TimeoutError("Galeria compartilhada não ficou pronta a tempo")
+            time.sleep(poll)
+        self._refresh()
+        return True
+
+    # ---------- leitura ----------
+    def _refresh(self) -> int:
+        """Incorpora as linhas publicadas por outros processos. Retorna o total."""
+        count = int(self._meta[M_COUNT])
+        with self._local:
+            if count > len(self._uuids):
+                with open(self._ids_path(), "rb") as f:
+                    f.seek(self._ids_offset)
+                    data = f.read()
+                consumed = 0
+                for line in data.split(b"\n")[:-1]:  # só linhas completas
+                    if len(self._uuids) >= count:
+                        break
+                    person_uuid, key = line.decode("utf-8").split("\t", 1)
+                    self._uuids.append(person_uuid)
+                    self._keys.append(key)
+                    consumed += len(line) + 1
+                self._ids_offset += consumed
+            needed = (len(self._uuids) + self.segment_rows - 1) // self.segment_rows
+            while len(self._segments) < needed:
+                self._segments.append(self._open_segment(len(self._segments)))
+            return len(self._uuids)
+
+    def __len__(self) -> int:
+        if self._meta is None:
+            return 0
+        return self._refresh() - int(self._meta[M_DELETED])
+
+    def match(self, embedding, threshold: float) -> Tuple[Optional[str], Optional[float]]:
+        vec = normalize(embedding)
+        with self._local:
+            total = self._refresh()
+            if total == 0:
+                return None, None
+            best_distance, best_row = None, None
+            for index, segment in enumerate(self._segments):
+                start = index * self.segment_rows
+                rows = min(self.segment_rows, total - start)
+                if rows <= 0:
+                    break
+                distances = 1.0 - segment[:rows] @ vec
+                i = int(np.argmin(distances))
+                if best_distance is None or distances[i] < best_distance:
+                    best_distance, best_row = float(distances[i]), start + i
+            best_uuid = self._uuids[best_row]
+        if best_distance <= threshold:
+            return best_uuid, best_distance
+        return None, best_distance
+
+    def snapshot(self, person_uuids: Optional[Set[str]] = None) -> Tuple[List[str], List[str], np.ndarray]:
+        """
+        Cópia de (uuids, chaves, vetores) das linhas válidas (as removidas são zeradas),
+        opcionalmente só das pessoas dadas.
+        """
+        with self._local:
+            total = self._refresh()
+            if person_uuids is None:
+                parts = [segment[:min(self.segment_rows, total - index * self.segment_rows)]
+                         for index, segment in enumerate(self._segments) if total > index * self.segment_rows]
+                vectors = np.concatenate(parts) if parts else np.empty((0, self.dim), dtype=np.float32)
+                rows = np.arange(total)
+            else:
+                rows = np.asarray([i for i in range(total) if self._uuids[i] in person_uuids], dtype=np.int64)
+                vectors = np.empty((len(rows), self.dim), dtype=np.float32)
+                for n, row in enumerate(rows):
+                    vectors[n] = self._segments[row // self.segment_rows][row % self.segment_rows]
+            live = np.flatnonzero(vectors.any(axis=1))
+            return ([self._uuids[i] for i in rows[live]], [self._keys[i] for i in rows[live]],
+                    vectors[live])
+
+    # ---------- escrita ----------
+    def add(self, person_uuid: str, key: str, embedding) -> None:
+        self.add_many([person_uuid], [key], [embedding])
+
+    def add_many(self, person_uuids: List[str], keys: List[str], embeddings) -> None:
+        if not person_uuids:
+            return
+        vecs = np.asarray(embeddings, dtype=np.float32).reshape(len(person_uuids), self.dim)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        vecs = vecs / np.where(norms > 0, norms, 1.0)
+        with self._file_lock, self._local:
+            count = self._refresh()
+            row = count
+            for vec in vecs:
+                index, offset = divmod(row, self.segment_rows)
+                while len(self._segments) <= index:
+                    self._segments.append(self._open_segment(len(self._segments), create=True))
+                self._segments[index][offset] = vec
+                row += 1
+            for index in range(count // self.segment_rows, len(self._segments)):
+                self._segments[index].flush()
+            with open(self._ids_path(), "ab") as f:
+                f.write("".join(f"{u}\t{k}\n" for u, k in zip(person_uuids, keys)).encode("utf-8"))
+            # Publica o novo total só depois dos vetores e ids estarem gravados
+            self._meta[M_COUNT] = row
+            self._meta.flush()
+            self._refresh()
+
+    def remove_person(self, person_uuid: str) -> int:
+        with self._file_lock, self._local:
+            self._refresh()
+            removed = 0
+            for row, u in enumerate(self._uuids):
+                if u != person_uuid:
+                    continue
+                index, offset = divmod(row, self.segment_rows)
+                if self._segments[index][offset].any():
+                    self._segments[index][offset] = 0.0
+                    removed += 1
+            if removed:
+                for segment in self._segments:
+                    segment.flush()
+                self._meta[M_DELETED] += removed
+                self._meta.flush()
+            return removed
@@ -0,0 +1,305 @@
+"""
+Armazenamento das fotos de faces.
+
+O servidor grava e lê as fotos apenas através de um `PhotoStorage`, usando
+chaves relativas no formato "<uuid>/<arquivo>.png". Há duas implementações:
+
+- LocalPhotoStorage: diretório local (comportamento original, servido em /static);
+- S3PhotoStorage: bucket S3-compatível (AWS, MinIO, ...), com upload multipart
+  assíncrono e URLs pré-assinadas ou de CDN.
+
+A implementação é escolhida por variáveis de ambiente (ver `create_storage`).
+"""
+import io
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------
+# Utilitários de chave
+# ----------------------------
+def to_key(stored_path: str, images_dir: str = "faces_images") -> str:
+    """
+    Converte um valor salvo no Mongo em chave de armazenamento.
+    Aceita tanto chaves novas ("<uuid>/<arquivo>") quanto caminhos antigos
+    ("faces_images/<uuid>/<arquivo>", relativos ou absolutos).
+    """
+    path = stored_path.replace("\\", "/")
+    base = images_dir.replace("\\", "/").rstrip("/")
+    if os.path.isabs(stored_path):
+        path = os.path.relpath(stored_path, os.path.abspath(images_dir)).replace(os.path.sep, "/")
+    elif path.startswith(base + "/"):
+        path = path[len(base) + 1:]
+    return path.lstrip("/")
+
+
+def encode_png(image: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+# ----------------------------
+# Interface
+# ----------------------------
+class PhotoStorage:
+    """
+    Interface de armazenamento de fotos.
+    As chaves são sempre relativas ("<uuid>/<arquivo>.png").
+    """
+
+    # Chamado com (chave, exceção) quando uma gravação assíncrona falha (ex.: métrica)
+    on_upload_error: Optional[Callable[[str, Exception], None]] = None
+
+    def save(self, key: str, image: Image.Image) -> str:
+        """Grava a imagem e retorna a chave a ser salva no Mongo."""
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        """URL pública (ou pré-assinada) para o frontend exibir a foto."""
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> str:
+        """Caminho local legível pelo DeepFace/OpenCV para a foto."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str) -> None:
+        """Remove todas as fotos sob um prefixo (ex.: a pasta de uma pessoa)."""
+        raise NotImplementedError
+
+    def move_prefix(self, src_prefix: str, dst_prefix: str) -> int:
+        """
+        Move as fotos de um prefixo para outro (ex.: pessoas mescladas). Retorna quantas.
+        Uma foto gravada na origem durante a chamada pode ficar lá: chamar de novo a move.
+        """
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Aguarda gravações pendentes (no-op para armazenamento síncrono)."""
+        return None
+
+
+# ----------------------------
+# Sistema de arquivos local
+# ----------------------------
+class LocalPhotoStorage(PhotoStorage):
+    def __init__(self, root: str = "faces_images", public_base_url: str = "http://localhost:8000"):
+        self.root = root
+        self.public_base_url = public_base_url.rstrip("/")
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def save(self, key: str, image: Image.Image) -> str:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        image.save(path)
+        return key
+
+    def url(self, key: str) -> str:
+        return f"{self.public_base_url}/static/{key}"
+
+    def local_path(self, key: str) -> str:
+        return self._path(key)
+
+    def delete(self, key: str) -> None:
+        path = self._path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def delete_prefix(self, prefix: str) -> None:
+        path = self._path(prefix.rstrip("/"))
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+    def move_prefix(self, src_prefix: str, dst_prefix: str) -> int:
+        src = self._path(src_prefix.rstrip("/"))
+        if not os.path.isdir(src):
+            return 0
+        dst = self._path(dst_prefix.rstrip("/"))
+        os.makedirs(dst, exist_ok=True)
+        moved = 0
+        for name in os.listdir(src):
+            os.replace(os.path.join(src, name), os.path.join(dst, name))
+            moved += 1
+        try:
+            os.rmdir(src)
+        except OSError:
+            pass  # foto gravada durante a movimentação: fica para a próxima chamada
+        return moved
+
+
+# ----------------------------
+# S3-compatível (AWS S3, MinIO, ...)
+# ----------------------------
+class S3PhotoStorage(PhotoStorage):
+    """
+    Armazena as fotos em um bucket S3-compatível.
+
+    - Os uploads são enviados a um pool de threads (não bloqueiam o reconhecimento)
+      e usam upload multipart do boto3 acima de `multipart_threshold`.
+    - Uma cópia local (cache de leitura) é mantida em `cache_dir`, pois o DeepFace
+      precisa de arquivos locais; como os nomes são UUIDs, as fotos são imutáveis.
+    - As URLs usam `public_base_url` (CDN) se configurada; senão são pré-assinadas.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region_name: Optional[str] = None, public_base_url: Optional[str] = None,
+                 url_expires: int = 3600, cache_dir: str = os.path.join("temp", "s3-cache"),
+                 max_workers: int = 4, multipart_threshold: int = 8 * 1024 * 1024,
+                 client=None):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.public_base_url = public_base_url.rstrip("/") if public_base_url else None
+        self.url_expires = url_expires
+        self.cache_dir = cache_dir
+        self.client = client or boto3.client("s3", endpoint_url=endpoint_url, region_name=region_name)
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold,
+                                              multipart_chunksize=multipart_threshold,
+                                              max_concurrency=max_workers,
+                                              use_threads=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="s3-upload")
+        self._pending: List[Future] = []
+        self._lock = threading.Lock()
+        self.upload_failures = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, *key.split("/"))
+
+    def _upload(self, key: str, data: bytes) -> None:
+        try:
+            self.client.upload_fileobj(io.BytesIO(data), self.bucket, self._object_key(key),
+                                       ExtraArgs={"ContentType": "image/png"},
+                                       Config=self.transfer_config)
+        except Exception as e:
+            # A chave já foi devolvida ao chamador (e gravada no Mongo): a falha precisa
+            # ficar visível, pois a foto só existe no cache local deste processo
+            with self._lock:
+                self.upload_failures += 1
+            logger.error("Falha ao enviar %s para o S3 (bucket %s): %s", key, self.bucket, e)
+            if self.on_upload_error is not None:
+                self.on_upload_error(key, e)
+            raise
+
+    def save(self, key: str, image: Image.Image) -> str:
+        data = encode_png(image)
+        cache_path = self._cache_path(key)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "wb") as f:
+            f.write(data)
+        future = self._executor.submit(self._upload, key, data)
+        with self._lock:
+            self._pending = [f for f in self._pending if not f.done()]
+            self._pending.append(future)
+        return key
+
+    def url(self, key: str) -> str:
+        if self.public_base_url:
+            return f"{self.public_base_url}/{self._object_key(key)}"
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._object_key(key)},
+            ExpiresIn=self.url_expires,
+        )
+
+    def local_path(self, key: str) -> str:
+        path = self._cache_path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.part"
+            self.client.download_file(self.bucket, self._object_key(key), tmp_path)
+            os.replace(tmp_path, path)
+        return path
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        path = self._cache_path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def delete_prefix(self, prefix: str) -> None:
+        self.flush()
+        object_prefix = self._object_key(prefix.rstrip("/") + "/")
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=object_prefix):
+            objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects})
+        cache_folder = self._cache_path(prefix.rstrip("/"))
+        if os.path.isdir(cache_folder):
+            shutil.rmtree(cache_folder)
+
+    def move_prefix(self, src_prefix: str, dst_prefix: str) -> int:
+        # S3 não tem "mover": copia cada objeto e remove o original
+        self.flush()
+        src_object_prefix = self._object_key(src_prefix.rstrip("/") + "/")
+        dst_object_prefix = self._object_key(dst_prefix.rstrip("/") + "/")
+        paginator = self.client.get_paginator("list_objects_v2")
+        moved = 0
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=src_object_prefix):
+            objects = [obj["Key"] for obj in page.get("Contents", [])]
+            for object_key in objects:
+                self.client.copy_object(Bucket=self.bucket, Key=dst_object_prefix + object_key[len(src_object_prefix):],
+                                        CopySource={"Bucket": self.bucket, "Key": object_key})
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": [{"Key": k} for k in objects]})
+            moved += len(objects)
+        cache_folder = self._cache_path(src_prefix.rstrip("/"))
+        if os.path.isdir(cache_folder):
+            shutil.rmtree(cache_folder, ignore_errors=True)
+        return moved
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            try:
+                future.result()
+            except Exception:
+                pass  # já contada e registrada em _upload
+
+
+# ----------------------------
+# Fábrica a partir do ambiente
+# ----------------------------
+def create_storage(images_dir: str = "faces_images") -> PhotoStorage:
+    """
+    Cria o armazenamento de acordo com as variáveis de ambiente:
+    - STORAGE_BACKEND: "local" (default) ou "s3"
+    - PUBLIC_BASE_URL: base das URLs locais (default: http://localhost:8000)
+    - S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION
+    - S3_PUBLIC_BASE_URL: base de CDN (se ausente, usa URLs pré-assinadas)
+    - S3_URL_EXPIRES: validade das URLs pré-assinadas em segundos (default: 3600)
+    """
+    backend = os.getenv("STORAGE_BACKEND", "local").lower()
+    if backend == "s3":
+        return S3PhotoStorage(
+            bucket=os.environ["S3_BUCKET"],
+            prefix=os.getenv("S3_PREFIX", ""),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+            region_name=os.getenv("S3_REGION") or None,
+            public_base_url=os.getenv("S3_PUBLIC_BASE_URL") or None,
+            url_expires=int(os.getenv("S3_URL_EXPIRES", "3600")),
+        )
+    if backend != "local":
+        raise ValueError(f"STORAGE_BACKEND inválido: {backend}")
+    return LocalPhotoStorage(images_dir, os.getenv("PUBLIC_BASE_URL", "http://localhost:8000"))
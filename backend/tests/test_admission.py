@@ -0,0 +1,281 @@
+"""
+Testes do AdmissionQueue com workers reais: um frame "bloqueador" segura os workers
+para que os demais fiquem na fila enquanto o teste verifica limites, descartes,
+prioridades e a ordem de atendimento.
+"""
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+import metrics  # noqa: E402
+from admission import BULK, UNKNOWN_CAMERA, AdmissionQueue, Rejected  # noqa: E402
+
+TIMEOUT = 5
+
+
+def make_queue(**kwargs) -> AdmissionQueue:
+    options = dict(workers=1, max_depth=16, max_age_s=0, policy="drop-oldest", max_per_source=2,
+                   weights={}, cameras=set())
+    options.update(kwargs)
+    return AdmissionQueue(**options)
+
+
+def wait_until(condition, timeout: float = TIMEOUT) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condição não atingida"
+        time.sleep(0.005)
+
+
+class Blocker:
+    """fn de frame que só termina quando liberada; conta quantas rodam ao mesmo tempo."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, _fila_ms, *args):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            assert self.release.wait(TIMEOUT)
+        finally:
+            with self._lock:
+                self.running -= 1
+        return "bloqueador"
+
+
+def hold_workers(queue: AdmissionQueue, count: int = 1) -> Blocker:
+    blocker = Blocker()
+    for i in range(count):
+        queue.submit(blocker, source=f"bloqueador-{i}")
+    wait_until(lambda: blocker.running == count)
+    return blocker
+
+
+def label(_fila_ms, name):
+    return name
+
+
+def test_drop_oldest_supersedes_oldest_frame_of_the_source():
+    queue = make_queue(max_per_source=2)
+    blocker = hold_workers(queue)
+    try:
+        futures = [queue.submit(label, f"a{i}", source="a") for i in range(3)]
+        other = queue.submit(label, "b0", source="b")
+
+        with pytest.raises(Rejected) as excinfo:
+            futures[0].result(TIMEOUT)
+        assert (excinfo.value.reason, excinfo.value.status_code) == ("superseded", 200)
+        assert queue.depth_by_source() == {"a": 2, "b": 1}
+    finally:
+        blocker.release.set()
+    assert [f.result(TIMEOUT) for f in futures[1:]] == ["a1", "a2"]
+    assert other.result(TIMEOUT) == "b0"
+
+
+def test_full_queue_evicts_from_the_largest_source():
+    queue = make_queue(max_depth=3, max_per_source=4)
+    blocker = hold_workers(queue)
+    try:
+        a = [queue.submit(label, f"a{i}", source="a") for i in range(2)]
+        queue.submit(label, "b0", source="b")
+        queue.submit(label, "c0", source="c")
+
+        with pytest.raises(Rejected, match="superseded"):
+            a[0].result(TIMEOUT)
+        assert queue.depth_by_source() == {"a": 1, "b": 1, "c": 1}
+    finally:
+        blocker.release.set()
+
+
+def test_reject_policy_refuses_with_429():
+    queue = make_queue(policy="reject", max_per_source=2)
+    blocker = hold_workers(queue)
+    try:
+        futures = [queue.submit(label, f"a{i}", source="a") for i in range(2)]
+        with pytest.raises(Rejected) as excinfo:
+            queue.submit(label, "a2", source="a")
+        assert (excinfo.value.reason, excinfo.value.status_code) == ("queue_full", 429)
+        assert excinfo.value.retry_after >= 1
+        queue.submit(label, "b0", source="b")  # outra origem continua entrando
+    finally:
+        blocker.release.set()
+    assert [f.result(TIMEOUT) for f in futures] == ["a0", "a1"]
+
+
+def test_expected_wait_above_age_limit_gives_503_with_retry_after():
+    queue = make_queue(max_age_s=0.5, max_per_source=8)
+    blocker = hold_workers(queue)
+    try:
+        queue._service_s = 0.3  # cada frame leva ~0.3 s
+        pending = [queue.submit(label, f"a{i}", source="a") for i in range(2)]
+        with pytest.raises(Rejected) as excinfo:
+            queue.submit(label, "a2", source="a")  # esperaria os 2 frames da própria fila
+        assert (excinfo.value.reason, excinfo.value.status_code) == ("overloaded", 503)
+        assert excinfo.value.retry_after == 1
+        # Outra origem só espera 1 frame de "a" no round-robin: ainda cabe no limite
+        queue.submit(label, "b0", source="b")
+    finally:
+        blocker.release.set()
+    assert [f.result(TIMEOUT) for f in pending] == ["a0", "a1"]
+
+
+def test_frame_older_than_age_limit_expires_in_the_queue():
+    queue = make_queue(max_age_s=0.05)
+    blocker = hold_workers(queue)
+    late = queue.submit(label, "a0", source="a")
+    time.sleep(0.1)
+    blocker.release.set()
+
+    with pytest.raises(Rejected) as excinfo:
+        late.result(TIMEOUT)
+    assert (excinfo.value.reason, excinfo.value.status_code) == ("expired", 503)
+
+
+def test_cancelled_frame_is_skipped():
+    queue = make_queue()
+    blocker = hold_workers(queue)
+    calls = []
+    cancelled = queue.submit(lambda _fila_ms: calls.append("cancelado"), source="a")
+    assert cancelled.cancel()
+    after = queue.submit(label, "a1", source="a")
+    blocker.release.set()
+
+    assert after.result(TIMEOUT) == "a1"
+    assert calls == []
+    wait_until(lambda: queue.depth() == 0)
+
+
+def test_weighted_round_robin_shares_follow_weights():
+    queue = make_queue(weights={"a": 3, "b": 1}, max_per_source=12, max_depth=32)
+    order = []
+    blocker = hold_workers(queue)
+    try:
+        futures = [queue.submit(lambda _fila_ms, s: order.append(s), source, source=source)
+                   for source in ("a", "b") for _ in range(12)]
+    finally:
+        blocker.release.set()
+    for future in futures:
+        future.result(TIMEOUT)
+
+    # Com as duas filas cheias, cada janela de 4 frames tem 3 de "a" e 1 de "b"
+    for start in range(0, 16, 4):
+        assert sorted(order[start:start + 4]) == ["a", "a", "a", "b"]
+    assert order[16:] == ["b"] * 8  # "a" esvaziou: "b" fica com todos os workers
+
+
+def test_fast_camera_does_not_starve_the_others():
+    queue = make_queue(max_per_source=4)
+    order = []
+    blocker = hold_workers(queue)
+    try:
+        futures = [queue.submit(lambda _fila_ms, s: order.append(s), "rapida", source="rapida") for _ in range(10)]
+        futures.append(queue.submit(lambda _fila_ms, s: order.append(s), "lenta", source="lenta"))
+    finally:
+        blocker.release.set()
+    for future in futures[6:]:
+        future.result(TIMEOUT)
+
+    assert order.index("lenta") <= 1  # atendida na 1ª ou 2ª vez, não depois dos 4 da câmera rápida
+
+
+class CountingCounter:
+    """Substitui um Counter do Prometheus registrando os rótulos usados."""
+
+    def __init__(self):
+        self.seen = []
+
+    def labels(self, *values):
+        self.seen.append(values)
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+
+def test_camera_is_the_queue_and_unknown_cameras_share_one_label(monkeypatch):
+    queue = make_queue(weights={"entrada": 2}, cameras={"patio"})
+    assert queue.camera_label("entrada") == "entrada"
+    assert queue.camera_label("patio") == "patio"
+    assert queue.camera_label("qualquer") == UNKNOWN_CAMERA
+    assert queue.camera_label(None) == UNKNOWN_CAMERA
+
+    blocker = hold_workers(queue)
+    counter = CountingCounter()
+    monkeypatch.setattr(metrics, "CAMERA_FRAMES", counter)
+    try:
+        futures = [queue.submit(label, camera, source="cliente", camera=camera)
+                   for camera in ("cam-x", "cam-y", "patio")]
+        # A fila é a da câmera, não a do cliente
+        assert queue.depth_by_source() == {"cam-x": 1, "cam-y": 1, "patio": 1}
+    finally:
+        blocker.release.set()
+    assert [f.result(TIMEOUT) for f in futures] == ["cam-x", "cam-y", "patio"]
+    wait_until(lambda: queue.depth() == 0)
+
+    # Câmeras não configuradas caem no mesmo rótulo (cardinalidade limitada)
+    assert ("patio", "ok") in counter.seen
+    assert counter.seen.count((UNKNOWN_CAMERA, "ok")) >= 2
+    assert {camera for camera, _result in counter.seen} <= {"patio", UNKNOWN_CAMERA}
+
+
+def test_live_frames_go_ahead_of_bulk():
+    queue = make_queue(workers=1)
+    order = []
+    blocker = hold_workers(queue)
+    try:
+        bulk = [queue.submit(lambda _fila_ms, s: order.append(s), f"bulk{i}", priority=BULK) for i in range(3)]
+        live = queue.submit(lambda _fila_ms, s: order.append(s), "live", source="a")
+    finally:
+        blocker.release.set()
+    for future in bulk + [live]:
+        future.result(TIMEOUT)
+
+    assert order == ["live", "bulk0", "bulk1", "bulk2"]
+
+
+@pytest.mark.parametrize("workers,share,slots", [(2, 1.0, 1), (4, 1.0, 3), (4, 0.5, 2)])
+def test_bulk_flood_never_takes_the_last_worker(workers, share, slots):
+    queue = make_queue(workers=workers, bulk_max_share=share)
+    assert queue.bulk_slots == slots
+    video = Blocker()
+    bulk = [queue.submit(video, priority=BULK) for _ in range(20)]
+    try:
+        wait_until(lambda: video.running == slots)
+        time.sleep(0.05)  # nenhum outro worker pega BULK
+        assert video.max_running == slots
+
+        # Um frame ao vivo encontra um worker livre mesmo com o vídeo ocupando as vagas BULK
+        assert queue.submit(label, "live", source="a").result(TIMEOUT) == "live"
+        assert video.running == slots
+    finally:
+        video.release.set()
+    for future in bulk:
+        assert future.result(TIMEOUT) == "bloqueador"
+    assert video.max_running == slots
+
+
+def test_single_worker_still_runs_bulk():
+    queue = make_queue(workers=1, bulk_max_share=0.5)
+
+    assert queue.bulk_slots == 1
+    assert queue.submit(label, "bulk", priority=BULK).result(TIMEOUT) == "bulk"
+
+
+def test_bulk_frames_are_never_dropped():
+    queue = make_queue(max_depth=1, max_per_source=1, max_age_s=0.01, policy="reject")
+    blocker = hold_workers(queue)
+    try:
+        queue._service_s = 10.0
+        bulk = [queue.submit(label, i, priority=BULK) for i in range(5)]
+        time.sleep(0.05)
+    finally:
+        blocker.release.set()
+    assert [f.result(TIMEOUT) for f in bulk] == list(range(5))
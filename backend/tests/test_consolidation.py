@@ -0,0 +1,179 @@
+"""
+Testes do merge de identidades (consolidation.py) com o Mongo simulado do mongomock,
+a galeria em memória e o armazenamento local: fotos, presenças e vetores seguem o
+alvo, cadeias de merges levam ao alvo final e só uma execução roda por vez.
+"""
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from PIL import Image
+
+mongomock = pytest.importorskip("mongomock")
+
+from consolidation import _LOCK_ID, DONE, RUNNING, Busy, Consolidator  # noqa: E402
+from embedding_store import EmbeddingLog  # noqa: E402
+from gallery import FaceGallery  # noqa: E402
+from storage import LocalPhotoStorage  # noqa: E402
+
+DIM = 8
+TIMEOUT = 10
+
+
+def direction(axis: int, seed: int) -> np.ndarray:
+    vec = np.zeros(DIM, dtype=np.float32)
+    vec[axis] = 1.0
+    return vec + np.random.default_rng(seed).normal(scale=0.01, size=DIM).astype(np.float32)
+
+
+class World:
+    def __init__(self, tmp_path):
+        self.db = mongomock.MongoClient().db
+        self.images_dir = str(tmp_path / "faces")
+        self.storage = LocalPhotoStorage(self.images_dir)
+        self.gallery = FaceGallery(dim=DIM)
+        self.log = EmbeddingLog(str(tmp_path / "log"), dim=DIM, backend="teste").open()
+        self.merges = []
+        self.consolidator = Consolidator(
+            self.db.consolidacoes, self.db.pessoas, self.db.presencas, self.gallery, self.storage, self.log,
+            images_dir=self.images_dir, on_merge=lambda target, sources: self.merges.append((target, sources)),
+            settle_s=0,
+        )
+        self._seed = 0
+
+    def person(self, person_uuid: str, axis: int, photos: int = 2, tags=()) -> None:
+        keys = []
+        for n in range(photos):
+            # Nomes únicos, como os das fotos gravadas pelo process_face
+            key = self.storage.save(f"{person_uuid}/{person_uuid}-{n}.png", Image.new("RGB", (4, 4)))
+            self._seed += 1
+            vec = direction(axis, self._seed)
+            self.gallery.add(person_uuid, key, vec)
+            self.log.append(person_uuid, key, vec)
+            keys.append(key)
+        self.db.pessoas.insert_one({"uuid": person_uuid, "image_paths": keys, "tags": list(tags)})
+        self.db.presencas.insert_one({"pessoa": person_uuid, "foto_captura": keys[0]})
+
+    def doc(self, person_uuid: str) -> dict:
+        return self.db.pessoas.find_one({"uuid": person_uuid})
+
+    def wait_report(self, report_id: str) -> dict:
+        deadline = time.monotonic() + TIMEOUT
+        while self.consolidator.get(report_id)["status"] == RUNNING:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        return self.consolidator.get(report_id)
+
+
+@pytest.fixture
+def world(tmp_path):
+    return World(tmp_path)
+
+
+def test_merge_moves_photos_presences_and_vectors(world):
+    world.person("alvo", 0, photos=3)
+    world.person("origem", 0, photos=2, tags=["joao"])
+    world.db.presencas.insert_one({"pessoa": "origem", "foto_captura": None})
+
+    assert world.consolidator.merge("alvo", ["origem"]) == ["origem"]
+
+    assert world.doc("origem") is None
+    target = world.doc("alvo")
+    assert sorted(target["image_paths"]) == ["alvo/alvo-0.png", "alvo/alvo-1.png", "alvo/alvo-2.png",
+                                             "alvo/origem-0.png", "alvo/origem-1.png"]
+    assert target["tags"] == ["joao"] and target["merged_from"] == ["origem"]
+    presences = list(world.db.presencas.find({}, {"_id": 0}))
+    assert presences == [{"pessoa": "alvo", "foto_captura": "alvo/alvo-0.png"},
+                         {"pessoa": "alvo", "foto_captura": "alvo/origem-0.png"},
+                         {"pessoa": "alvo", "foto_captura": None}]
+    assert sorted(os.listdir(os.path.join(world.images_dir, "alvo")))[-2:] == ["origem-0.png", "origem-1.png"]
+    assert not os.path.exists(os.path.join(world.images_dir, "origem"))
+    uuids, keys, _vectors = world.gallery.snapshot()
+    assert set(uuids) == {"alvo"} and "alvo/origem-1.png" in keys
+    assert set(world.log.load()[0]) == {"alvo"}
+    assert world.merges == [("alvo", ["origem"])]
+
+
+def test_repeating_a_merge_step_is_harmless(world):
+    world.person("alvo", 0)
+    world.person("origem", 0)
+    world.consolidator.merge("alvo", ["origem"])
+
+    world.consolidator._move_presences("alvo", "origem")
+
+    assert [p["foto_captura"] for p in world.db.presencas.find()] == ["alvo/alvo-0.png", "alvo/origem-0.png"]
+    assert world.consolidator.merge("alvo", ["origem"]) == []  # origem já não existe
+
+
+def test_chained_merges_reassign_to_the_final_target(world):
+    for person_uuid in "abc":
+        world.person(person_uuid, 0)
+    world.consolidator.merge("b", ["a"])
+    world.consolidator.merge("c", ["b"])
+
+    assert sorted(world.doc("c")["merged_from"]) == ["a", "b"]
+    assert [p["pessoa"] for p in world.db.presencas.find()] == ["c", "c", "c"]
+    assert [p["foto_captura"] for p in world.db.presencas.find()] == ["c/a-0.png", "c/b-0.png", "c/c-0.png"]
+
+    # Um worker sem galeria compartilhada ainda tem o vetor de "a": reassign o leva para "c"
+    world.gallery.add("a", "a/a-9.png", direction(0, 99))
+    assert world.consolidator.reassign("a") == "c"
+    assert "a" not in world.gallery.snapshot()[0]
+    assert world.consolidator.reassign("b") == "c"
+    assert world.consolidator.reassign("excluida") is None
+
+
+def test_run_applies_auto_proposals_and_releases_the_lock(world):
+    world.person("grande", 0, photos=3)
+    world.person("pequena", 0, photos=1)
+    world.person("outra", 1, photos=2)
+
+    report = world.consolidator.start(apply=True)
+    report = world.wait_report(report["_id"])
+
+    assert report["status"] == DONE
+    [proposal] = report["proposals"]
+    assert (proposal["target"], proposal["sources"], proposal["applied"]) == ("grande", ["pequena"], True)
+    assert report["shrink"]["persons_merged"] == 1
+    assert world.doc("pequena") is None
+    # Trava liberada: outra execução pode começar, e a trava não aparece como relatório
+    assert world.consolidator.start() is not None
+    total, reports = world.consolidator.list()
+    assert total == 2 and _LOCK_ID not in [r["_id"] for r in reports]
+    assert world.consolidator.get(_LOCK_ID) is None
+
+
+def test_only_one_run_at_a_time(world):
+    world.person("a", 0)
+    world.person("b", 0)
+    assert world.consolidator._claim("outro-worker")
+
+    assert world.consolidator.start() is None
+    report = world.consolidator.run("manual")  # relatório fictício: o run não solta a trava alheia
+    assert report is None
+    assert world.db.consolidacoes.find_one({"_id": _LOCK_ID})["owner"] == "outro-worker"
+
+    world.consolidator._release("outro-worker")
+    report = world.wait_report(world.consolidator.start()["_id"])
+    assert report["status"] == DONE and report["proposals"][0]["applied"] is False
+
+    assert world.consolidator._claim("outro-worker")
+    with pytest.raises(Busy):
+        world.consolidator.apply(report["_id"])
+    assert world.doc("b") is not None
+    world.consolidator._release("outro-worker")
+    assert world.consolidator.apply(report["_id"])["proposals"][0]["applied"] is True
+
+
+def test_stale_lock_is_taken_over(world):
+    assert world.consolidator._claim("morto")
+    assert not world.consolidator._claim("novo")
+
+    old = datetime.now() - timedelta(seconds=world.consolidator.stale_s + 1)
+    world.db.consolidacoes.update_one({"_id": _LOCK_ID}, {"$set": {"claimed_at": old}})
+
+    assert world.consolidator._claim("novo")
+    world.consolidator._release("morto")  # o dono antigo não solta a trava do novo
+    assert world.db.consolidacoes.find_one({"_id": _LOCK_ID})["owner"] == "novo"
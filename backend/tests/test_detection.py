@@ -0,0 +1,110 @@
+"""
+Testes da geometria da detecção (detection.py) sem o MediaPipe: blocos da varredura,
+supressão de não-máximos e reprojeção dos boxes para a resolução original.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+
+import detection  # noqa: E402
+from detection import _tiles, merge_detections  # noqa: E402
+
+
+@pytest.mark.parametrize("width,height,max_pixels", [
+    (3840, 2160, 1344 * 760),
+    (4000, 300, 200 * 200),
+    (1000, 3000, 400 * 400),
+    (1350, 770, 1344 * 760),
+])
+def test_tiles_cover_the_frame_with_overlap(width, height, max_pixels):
+    overlap = 0.2
+    tiles = _tiles(width, height, max_pixels, overlap)
+
+    covered = np.zeros((height, width), dtype=bool)
+    for x0, y0, x1, y1 in tiles:
+        assert 0 <= x0 < x1 <= width and 0 <= y0 < y1 <= height
+        assert (x1 - x0) * (y1 - y0) <= max_pixels * 1.01
+        covered[y0:y1, x0:x1] = True
+    assert covered.all()
+
+    # Os últimos blocos encostam nas bordas direita/inferior, e vizinhos se sobrepõem
+    tile_w, tile_h = tiles[0][2] - tiles[0][0], tiles[0][3] - tiles[0][1]
+    xs = sorted({t[0] for t in tiles})
+    ys = sorted({t[1] for t in tiles})
+    assert xs[-1] + tile_w == width and ys[-1] + tile_h == height
+    for a, b in zip(xs, xs[1:]):
+        assert a + tile_w - b >= int(tile_w * overlap)
+    for a, b in zip(ys, ys[1:]):
+        assert a + tile_h - b >= int(tile_h * overlap)
+
+
+def test_merge_detections_keeps_highest_score():
+    low = (100, 100, 200, 200, 0.6, ())
+    high = (105, 98, 205, 198, 0.9, ())
+    other = (400, 100, 480, 180, 0.7, ())
+
+    kept = merge_detections([low, other, high])
+
+    assert kept == [high, other]
+
+
+def test_merge_detections_keeps_boxes_below_iou_threshold():
+    a = (0, 0, 100, 100, 0.9, ())
+    b = (80, 0, 180, 100, 0.8, ())  # IoU ~0.11
+
+    assert merge_detections([a, b], iou_threshold=0.3) == [a, b]
+
+
+def test_detect_scaled_projects_boxes_to_full_resolution(monkeypatch):
+    seen = []
+
+    def fake_raw(image, min_conf, model_selection):
+        seen.append(image.shape)
+        h, w = image.shape[:2]
+        # Face no centro da imagem reduzida, com os olhos como keypoints
+        return [(w // 4, h // 4, w // 2, h // 2, 0.9, ((w * 0.3, h * 0.3), (w * 0.45, h * 0.3)))]
+
+    monkeypatch.setattr(detection, "_detect_raw", fake_raw)
+    frame = np.zeros((2000, 4000, 3), dtype=np.uint8)
+
+    [(x0, y0, x1, y1, score, keypoints)] = detection._detect_scaled(frame, 1000 * 500, 0.5, 1, offset=(10, 20))
+
+    assert seen == [(500, 1000, 3)]  # reduzida para caber no orçamento, mantendo a proporção
+    assert (x0, y0, x1, y1) == (1000 + 10, 500 + 20, 2000 + 10, 1000 + 20)
+    assert score == 0.9
+    np.testing.assert_allclose(keypoints, [(1210, 620), (1810, 620)])
+
+
+def test_detect_scaled_never_upscales(monkeypatch):
+    seen = []
+    monkeypatch.setattr(detection, "_detect_raw",
+                        lambda image, *_: seen.append(image.shape) or [(10, 10, 50, 50, 0.8, ())])
+
+    assert detection._detect_scaled(np.zeros((100, 200, 3), np.uint8), 10 ** 6, 0.5, 1) == \
+        [(10, 10, 50, 50, 0.8, ())]
+    assert seen == [(100, 200, 3)]
+
+
+def test_detect_faces_with_tiles_merges_duplicates_and_adds_margin(monkeypatch):
+    frame = np.zeros((1000, 2000, 3), dtype=np.uint8)
+    face = (1200, 400, 1300, 500)  # coordenadas no frame original
+    offsets = []
+
+    def fake_scaled(image, max_pixels, min_conf, model_selection, offset=(0, 0)):
+        # A mesma face aparece no frame reduzido e em cada bloco que a contém inteira
+        offsets.append(offset)
+        x0, y0 = offset
+        h, w = image.shape[:2]
+        if x0 <= face[0] and face[2] <= x0 + w and y0 <= face[1] and face[3] <= y0 + h:
+            return [face + ((0.9 if offset == (0, 0) else 0.7), ())]
+        return []
+
+    monkeypatch.setattr(detection, "_detect_scaled", fake_scaled)
+
+    faces = detection.detect_faces(frame, max_pixels=500 * 500, tiles=True, tile_overlap=0.2)
+
+    assert offsets[0] == (0, 0) and len(offsets) > 2  # frame inteiro reduzido + blocos
+    assert len(faces) == 1
+    assert faces[0].score == 0.9
+    assert faces[0].box == (1190, 390, 1310, 510)  # margem de 10% do maior lado
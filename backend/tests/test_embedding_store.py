@@ -0,0 +1,163 @@
+"""
+Testes do EmbeddingLog: reparo de acréscimos interrompidos, deleted.txt, compactação
+entre gerações e reabertura depois de uma compactação interrompida.
+"""
+import json
+import os
+
+import numpy as np
+
+from embedding_store import EmbeddingLog
+
+DIM = 4
+
+
+def open_log(directory) -> EmbeddingLog:
+    return EmbeddingLog(str(directory), dim=DIM, backend="teste").open()
+
+
+def vector(seed: int) -> np.ndarray:
+    vec = np.random.default_rng(seed).normal(size=DIM).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def test_append_and_reopen(tmp_path):
+    log = open_log(tmp_path)
+    log.append_many(["a", "b"], ["a/1.png", "b/1.png"], [vector(1), vector(2)])
+
+    uuids, keys, vectors = open_log(tmp_path).load()
+
+    assert uuids == ["a", "b"]
+    assert keys == ["a/1.png", "b/1.png"]
+    np.testing.assert_allclose(vectors, [vector(1), vector(2)], rtol=1e-6)
+
+
+def test_reopen_with_other_backend_discards_log(tmp_path):
+    open_log(tmp_path).append("a", "a/1.png", vector(1))
+
+    other = EmbeddingLog(str(tmp_path), dim=DIM, backend="outro").open()
+
+    assert other.load()[0] == []
+
+
+def test_torn_vector_is_truncated(tmp_path):
+    log = open_log(tmp_path)
+    log.append("a", "a/1.png", vector(1))
+    # Processo morreu no meio do vetor da 2ª linha (antes da linha de ids)
+    with open(log._vectors_path(), "ab") as f:
+        f.write(vector(2).tobytes()[:6])
+
+    reopened = open_log(tmp_path)
+
+    assert os.path.getsize(reopened._vectors_path()) == DIM * 4
+    assert reopened.load()[0] == ["a"]
+    reopened.append("b", "b/1.png", vector(2))
+    uuids, _keys, vectors = reopened.load()
+    assert uuids == ["a", "b"]
+    np.testing.assert_allclose(vectors[1], vector(2), rtol=1e-6)
+
+
+def test_vector_without_ids_line_is_truncated(tmp_path):
+    log = open_log(tmp_path)
+    log.append("a", "a/1.png", vector(1))
+    # Vetor completo gravado, linha de ids interrompida no meio
+    with open(log._vectors_path(), "ab") as f:
+        f.write(vector(2).tobytes())
+    with open(log._ids_path(), "ab") as f:
+        f.write(b"b\tb/1.p")
+
+    reopened = open_log(tmp_path)
+
+    with open(reopened._ids_path(), "rb") as f:
+        assert f.read() == b"a\ta/1.png\n"
+    assert os.path.getsize(reopened._vectors_path()) == DIM * 4
+    assert reopened.stats()["rows"] == 1
+
+
+def test_deleted_people_and_replaced_keys_are_hidden(tmp_path):
+    log = open_log(tmp_path)
+    log.append_many(["a", "b", "c"], ["a/1.png", "b/1.png", "c/1.png"], [vector(1), vector(2), vector(3)])
+    log.delete_person("b")
+    log.append("a", "a/1.png", vector(4))  # mesma chave de novo: vale a última linha
+
+    uuids, keys, vectors = open_log(tmp_path).load()  # deleted.txt relido na reabertura
+
+    assert uuids == ["c", "a"]
+    assert keys == ["c/1.png", "a/1.png"]
+    np.testing.assert_allclose(vectors, [vector(3), vector(4)], rtol=1e-6)
+    assert log.stats() == {"rows": 4, "live": 2, "dead": 2, "generation": 0}
+
+
+def test_compact_respects_min_dead_ratio(tmp_path):
+    log = open_log(tmp_path)
+    log.append_many([f"p{i}" for i in range(4)], [f"p{i}/1.png" for i in range(4)], [vector(i) for i in range(4)])
+    log.delete_person("p0")
+
+    assert log.compact(min_dead_ratio=0.5) == 0  # 1 de 4 mortas: abaixo do limite
+    assert log.generation == 0
+
+    assert log.compact(min_dead_ratio=0.25) == 1
+    assert log.generation == 1
+    assert sorted(os.listdir(tmp_path)) == ["deleted.txt", "ids.1.tsv", "log.lock", "meta.json", "vectors.1.f32"]
+    with open(tmp_path / "deleted.txt", "rb") as f:
+        assert f.read() == b""
+
+    # Outro processo com a geração antiga no objeto segue a geração do meta.json
+    stale = EmbeddingLog(str(tmp_path), dim=DIM, backend="teste")
+    stale._lock, stale.generation = log._lock, 0
+    stale.append("p4", "p4/1.png", vector(4))
+    uuids, _keys, vectors = open_log(tmp_path).load()
+    assert uuids == ["p1", "p2", "p3", "p4"]
+    np.testing.assert_allclose(vectors, [vector(i) for i in range(1, 5)], rtol=1e-6)
+
+
+def test_crash_before_meta_switch_keeps_old_generation(tmp_path):
+    log = open_log(tmp_path)
+    log.append_many(["a", "b"], ["a/1.png", "b/1.png"], [vector(1), vector(2)])
+    log.delete_person("a")
+    # Compactação interrompida: nova geração parcialmente gravada, meta.json ainda na antiga
+    with open(tmp_path / "vectors.1.f32", "wb") as f:
+        f.write(vector(2).tobytes()[:5])
+    with open(tmp_path / "ids.1.tsv", "wb") as f:
+        f.write(b"b\tb/")
+
+    reopened = open_log(tmp_path)
+
+    assert reopened.generation == 0
+    assert reopened.load()[0] == ["b"]
+    assert not os.path.exists(tmp_path / "vectors.1.f32")
+    assert reopened.compact() == 1
+    assert reopened.load()[0] == ["b"]
+
+
+def test_crash_after_meta_switch_uses_new_generation(tmp_path):
+    log = open_log(tmp_path)
+    log.append_many(["a", "b"], ["a/1.png", "b/1.png"], [vector(1), vector(2)])
+    log.delete_person("a")
+    # Compactação interrompida depois de publicar a geração 1: geração 0 e deleted.txt ficaram
+    with open(tmp_path / "vectors.1.f32", "wb") as f:
+        f.write(vector(2).tobytes())
+    with open(tmp_path / "ids.1.tsv", "wb") as f:
+        f.write(b"b\tb/1.png\n")
+    with open(tmp_path / "meta.json", "w", encoding="utf-8") as f:
+        json.dump({"dim": DIM, "backend": "teste", "generation": 1}, f)
+
+    reopened = open_log(tmp_path)
+
+    assert reopened.generation == 1
+    assert not os.path.exists(tmp_path / "vectors.0.f32")
+    uuids, _keys, vectors = reopened.load()
+    assert uuids == ["b"]
+    np.testing.assert_allclose(vectors, [vector(2)], rtol=1e-6)
+    assert reopened.stats()["dead"] == 0
+
+
+def test_reset_discards_everything(tmp_path):
+    log = open_log(tmp_path)
+    log.append("a", "a/1.png", vector(1))
+
+    log.reset()
+
+    assert log.generation == 1
+    assert log.load()[0] == []
+    assert open_log(tmp_path).load()[0] == []
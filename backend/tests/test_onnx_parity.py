@@ -0,0 +1,137 @@
+"""
+Paridade do backend ONNX (embedding.OnnxEmbedder) com o caminho do DeepFace.
+
+Um modelo ONNX mínimo (projeção linear + ReLU sobre a entrada 160x160x3) é gerado no
+teste; a referência aplica o pré-processamento do DeepFace.represent (redimensiona
+mantendo a proporção, preenche centralizado até 160x160, BGR / 255) e o mesmo modelo.
+Qualquer regressão no letterbox ou na escala muda as decisões de match.
+
+Com o Facenet512 exportado (models/facenet512.onnx) e o DeepFace instalado, o teste
+de paridade completo (onnx_tools.py parity) também roda.
+
+    pip install onnx onnxruntime pytest
+    cd backend && python -m pytest tests
+"""
+import os
+import types
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from onnx import TensorProto, helper, numpy_helper  # noqa: E402
+
+import onnx_tools  # noqa: E402
+from embedding import INPUT_SIZE, ONNX_MODEL_PATH, OnnxEmbedder  # noqa: E402
+
+DIM = 64
+
+
+@pytest.fixture(scope="module")
+def weights():
+    rng = np.random.default_rng(0)
+    flat = INPUT_SIZE[0] * INPUT_SIZE[1] * 3
+    w = rng.normal(scale=1 / np.sqrt(flat), size=(flat, DIM)).astype(np.float32)
+    # Colunas de média zero: o brilho médio, comum a todos os recortes, não domina o embedding
+    w -= w.mean(axis=0)
+    return w, rng.normal(scale=0.1, size=DIM).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tmp_path_factory, weights):
+    w, b = weights
+    graph = helper.make_graph(
+        [
+            helper.make_node("Reshape", ["input", "shape"], ["flat"]),
+            helper.make_node("MatMul", ["flat", "w"], ["projected"]),
+            helper.make_node("Add", ["projected", "b"], ["biased"]),
+            helper.make_node("Relu", ["biased"], ["embedding"]),
+        ],
+        "tiny_facenet",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [None, INPUT_SIZE[0], INPUT_SIZE[1], 3])],
+        [helper.make_tensor_value_info("embedding", TensorProto.FLOAT, [None, DIM])],
+        [numpy_helper.from_array(np.array([-1, w.shape[0]], dtype=np.int64), "shape"),
+         numpy_helper.from_array(w, "w"), numpy_helper.from_array(b, "b")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 7  # aceito por versões antigas do ONNX Runtime
+    path = str(tmp_path_factory.mktemp("onnx") / "tiny.onnx")
+    onnx.save(model, path)
+    return path
+
+
+def deepface_preprocess(img_bgr: np.ndarray) -> np.ndarray:
+    """Pré-processamento do DeepFace.represent para o Facenet512 (referência do teste)."""
+    target_h, target_w = INPUT_SIZE
+    factor = min(target_h / img_bgr.shape[0], target_w / img_bgr.shape[1])
+    resized = cv2.resize(img_bgr, (int(img_bgr.shape[1] * factor), int(img_bgr.shape[0] * factor)))
+    diff_h, diff_w = target_h - resized.shape[0], target_w - resized.shape[1]
+    padded = np.pad(resized, ((diff_h // 2, diff_h - diff_h // 2), (diff_w // 2, diff_w - diff_w // 2), (0, 0)),
+                    "constant")
+    if padded.shape[:2] != INPUT_SIZE:
+        padded = cv2.resize(padded, (target_w, target_h))
+    return padded.astype(np.float32) / 255.0
+
+
+def stretch_preprocess(img_bgr: np.ndarray) -> np.ndarray:
+    """Pré-processamento errado (estica até 160x160, sem letterbox): o teste precisa detectá-lo."""
+    return cv2.resize(img_bgr, INPUT_SIZE[::-1]).astype(np.float32) / 255.0
+
+
+def faces() -> list:
+    """Recortes de 'pessoas' sintéticas em tamanhos e proporções variados, com variações leves."""
+    rng = np.random.default_rng(1)
+    crops = []
+    for person in range(6):
+        base = cv2.resize(rng.integers(0, 256, (12, 10, 3), dtype=np.uint8), (100, 120),
+                          interpolation=cv2.INTER_CUBIC)
+        for width, height in ((100, 120), (80, 130), (150, 140)):
+            crop = cv2.resize(base, (width, height))
+            noise = rng.normal(scale=4, size=crop.shape)
+            crops.append(np.clip(crop + noise, 0, 255).astype(np.uint8))
+    return crops
+
+
+def reference_embeddings(crops: list, weights, preprocess) -> np.ndarray:
+    w, b = weights
+    flat = np.stack([preprocess(c) for c in crops]).reshape(len(crops), -1)
+    return np.maximum(flat @ w + b, 0)
+
+
+def test_onnx_embed_matches_deepface_preprocessing(tiny_model, weights):
+    crops = faces()
+    reference = reference_embeddings(crops, weights, deepface_preprocess)
+    candidate = np.stack([OnnxEmbedder(tiny_model).embed(c) for c in crops])
+
+    report = onnx_tools._compare(reference, candidate)
+
+    assert report["max_cosine_distance"] < 1e-5
+    assert report["match_decision_agreement"] == 1.0
+    # O conjunto tem pares que casam e pares que não casam
+    pairs = 1.0 - onnx_tools._normalize(reference) @ onnx_tools._normalize(reference).T
+    upper = pairs[np.triu_indices(len(crops), k=1)]
+    assert (upper <= onnx_tools.MATCH_THRESHOLD).any() and (upper > onnx_tools.MATCH_THRESHOLD).any()
+
+
+def test_wrong_preprocessing_is_detected(weights):
+    crops = faces()
+    reference = reference_embeddings(crops, weights, deepface_preprocess)
+    stretched = reference_embeddings(crops, weights, stretch_preprocess)
+    unscaled = reference_embeddings(crops, weights, lambda c: deepface_preprocess(c) * 255.0)
+
+    assert onnx_tools._compare(reference, stretched)["match_decision_agreement"] < 0.99
+    assert onnx_tools._compare(reference, unscaled)["match_decision_agreement"] < 0.99
+
+
+@pytest.mark.skipif(not os.path.exists(ONNX_MODEL_PATH) or not os.path.isdir("faces_images"),
+                    reason="modelo ONNX exportado ou faces_images ausente")
+def test_exported_model_parity(tmp_path):
+    pytest.importorskip("deepface")
+    args = types.SimpleNamespace(
+        faces_dir="faces_images", limit=50, onnx=ONNX_MODEL_PATH, onnx_int8=str(tmp_path / "ausente.onnx"),
+        output=None, tolerance=1e-4, int8_tolerance=2e-2, min_agreement=0.99,
+    )
+    assert onnx_tools.parity(args) == 0
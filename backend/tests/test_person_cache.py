@@ -0,0 +1,145 @@
+"""
+Testes do PersonCache: LRU, TTL, atualização após foto adicionada e invalidação pelo
+_id (eventos do change stream).
+"""
+import types
+
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+import person_cache  # noqa: E402
+from person_cache import PersonCache  # noqa: E402
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(person_cache, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+class Loader:
+    """Simula o find_one no Mongo e conta as leituras."""
+
+    def __init__(self):
+        self.people = {}
+        self.calls = []
+
+    def add(self, person_uuid: str, photos: int = 1) -> dict:
+        self.people[person_uuid] = {
+            "_id": f"oid-{person_uuid}", "uuid": person_uuid, "tags": [],
+            "primary_photo": f"{person_uuid}/1.png" if photos else None, "photo_count": photos,
+        }
+        return self.people[person_uuid]
+
+    def __call__(self, person_uuid: str):
+        self.calls.append(person_uuid)
+        summary = self.people.get(person_uuid)
+        return dict(summary) if summary is not None else None
+
+
+@pytest.fixture
+def loader():
+    return Loader()
+
+
+def test_hit_does_not_reload(clock, loader):
+    loader.add("a")
+    cache = PersonCache(loader)
+
+    assert cache.get("a")["uuid"] == "a"
+    assert cache.get("a")["uuid"] == "a"
+    assert loader.calls == ["a"]
+
+
+def test_missing_person_is_not_cached(clock, loader):
+    cache = PersonCache(loader)
+
+    assert cache.get("nada") is None
+    assert cache.get("nada") is None
+    assert loader.calls == ["nada", "nada"]
+    assert len(cache) == 0
+
+
+def test_lru_eviction(clock, loader):
+    for person_uuid in "abc":
+        loader.add(person_uuid)
+    cache = PersonCache(loader, max_entries=2)
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")  # "b" passa a ser o menos recente
+    cache.get("c")
+
+    assert len(cache) == 2
+    loader.calls.clear()
+    cache.get("a")
+    cache.get("c")
+    cache.get("b")
+    assert loader.calls == ["b"]
+
+
+def test_eviction_forgets_oid(clock, loader):
+    loader.add("a")
+    loader.add("b")
+    cache = PersonCache(loader, max_entries=1)
+    cache.get("a")
+    cache.get("b")
+
+    cache.invalidate_oid("oid-a")  # não pode remover outra entrada
+
+    assert len(cache) == 1
+    assert cache._uuid_by_oid == {"oid-b": "b"}
+
+
+def test_entries_expire_after_ttl(clock, loader):
+    loader.add("a")
+    cache = PersonCache(loader, ttl_s=30.0)
+    cache.get("a")
+
+    clock[0] += 30.0
+    cache.get("a")
+    assert loader.calls == ["a"]
+    clock[0] += 0.1
+    loader.people["a"]["tags"] = ["nova"]
+    assert cache.get("a")["tags"] == ["nova"]
+    assert loader.calls == ["a", "a"]
+
+
+def test_photo_added_updates_without_reload(clock, loader):
+    loader.add("a", photos=0)
+    cache = PersonCache(loader)
+    cache.get("a")
+
+    cache.photo_added("a", "a/1.png")
+    cache.photo_added("a", "a/2.png")
+
+    summary = cache.get("a")
+    assert summary["photo_count"] == 2
+    assert summary["primary_photo"] == "a/1.png"  # a primeira foto continua sendo a principal
+    assert loader.calls == ["a"]
+
+
+def test_photo_added_ignores_uncached_person(clock, loader):
+    cache = PersonCache(loader)
+
+    cache.photo_added("a", "a/1.png")
+
+    assert len(cache) == 0
+
+
+def test_invalidate_oid_and_uuid(clock, loader):
+    loader.add("a")
+    loader.add("b")
+    cache = PersonCache(loader)
+    cache.get("a")
+    cache.get("b")
+
+    cache.invalidate_oid("oid-a")
+    cache.invalidate("b")
+    cache.invalidate_oid("desconhecido")
+
+    assert len(cache) == 0
+    assert cache._uuid_by_oid == {}
+    cache.get("a")
+    assert loader.calls == ["a", "b", "a"]
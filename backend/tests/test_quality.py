@@ -0,0 +1,82 @@
+"""
+Testes do filtro de qualidade (quality.py): cada motivo de reprovação isolado, com os
+limiares padrão do módulo.
+"""
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip("cv2")
+
+from quality import assess_face, pose_from_keypoints  # noqa: E402
+
+# Olhos e nariz de uma face frontal em um recorte 100x100
+FRONTAL = ((30.0, 40.0), (70.0, 40.0), (50.0, 60.0))
+
+
+def sharp(size: int = 100) -> Image.Image:
+    """Tabuleiro de xadrez: muitas bordas, Laplaciano com variância alta."""
+    cells = np.indices((size, size)).sum(axis=0) // max(1, size // 10) % 2
+    return Image.fromarray((cells * 255).astype(np.uint8)).convert("RGB")
+
+
+def test_good_face_passes():
+    quality = assess_face(sharp(), score=0.9, keypoints=FRONTAL)
+
+    assert quality.ok and quality.reasons == []
+    assert quality.size == 100
+    assert quality.yaw == pytest.approx(0.0) and quality.roll == pytest.approx(0.0)
+
+
+def test_small_crop_is_rejected_for_size():
+    quality = assess_face(sharp(20), score=0.9)
+
+    assert quality.reasons == ["tamanho"]
+    assert quality.size == 20
+
+
+def test_flat_crop_is_rejected_for_blur():
+    flat = Image.new("RGB", (100, 100), (128, 128, 128))
+
+    quality = assess_face(flat, score=0.9, keypoints=FRONTAL)
+
+    assert quality.reasons == ["nitidez"]
+    assert quality.blur == pytest.approx(0.0)
+
+
+def test_low_detection_score_is_rejected():
+    assert assess_face(sharp(), score=0.3).reasons == ["score"]
+    assert assess_face(sharp(), score=None).ok  # sem score da detecção: não avalia
+
+
+def test_turned_face_is_rejected_for_yaw():
+    nose_on_left_eye = ((30.0, 40.0), (70.0, 40.0), (76.0, 60.0))  # nariz 26px fora do centro / 40px
+
+    quality = assess_face(sharp(), score=0.9, keypoints=nose_on_left_eye)
+
+    assert quality.reasons == ["pose"]
+    assert quality.yaw == pytest.approx(0.65)
+
+
+def test_tilted_face_is_rejected_for_roll():
+    tilted = ((30.0, 40.0), (70.0, 80.0), (40.0, 70.0))  # linha dos olhos a 45°
+
+    quality = assess_face(sharp(), score=0.9, keypoints=tilted)
+
+    assert quality.reasons == ["pose"]
+    assert quality.roll == pytest.approx(45.0)
+
+
+def test_pose_is_skipped_without_keypoints():
+    assert pose_from_keypoints(()) == (None, None)
+    assert pose_from_keypoints(((10.0, 10.0), (10.0, 10.0), (10.0, 20.0))) == (None, None)
+    assert assess_face(sharp(), score=0.9, keypoints=None).ok
+
+
+def test_every_reason_is_reported():
+    tiny_flat = Image.new("RGB", (20, 20), (10, 10, 10))
+
+    quality = assess_face(tiny_flat, score=0.1, keypoints=((0.0, 0.0), (10.0, 10.0), (5.0, 5.0)))
+
+    assert not quality.ok
+    assert quality.reasons == ["tamanho", "nitidez", "score", "pose"]
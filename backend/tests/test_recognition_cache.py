@@ -0,0 +1,120 @@
+"""
+Testes do RecognitionCache: busca por distância de Hamming do dHash, isolamento entre
+origens, TTL, invalidação por pessoa e cópias das entradas.
+"""
+import types
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import recognition_cache
+from recognition_cache import RecognitionCache, fingerprint
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(recognition_cache, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def crop(seed: int = 0, size=(96, 112)) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (8, 9, 3), dtype=np.uint8)
+    return Image.fromarray(small).resize(size, Image.BILINEAR)
+
+
+def flip_bits(key, count: int):
+    prefix, dhash = key
+    for bit in range(count):
+        dhash ^= 1 << (bit * 7)
+    return prefix, dhash
+
+
+def test_fingerprint_tolerates_small_noise():
+    image = crop()
+    noisy = np.clip(np.asarray(image, dtype=np.int16) + np.random.default_rng(1).integers(-2, 3, (112, 96, 3)), 0, 255)
+
+    a, b = fingerprint(image, "cam1"), fingerprint(Image.fromarray(noisy.astype(np.uint8)), "cam1")
+
+    assert a[0] == b[0] == "cam1:6x7"
+    assert bin(a[1] ^ b[1]).count("1") <= 4
+
+
+def test_lookup_within_hamming_distance(clock):
+    cache = RecognitionCache(max_distance=4)
+    key = fingerprint(crop(), "cam1")
+    cache.put(key, {"uuid": "a"})
+
+    assert cache.get(flip_bits(key, 4)) == {"uuid": "a"}
+    assert cache.get(flip_bits(key, 5)) is None
+
+
+def test_nearest_entry_wins(clock):
+    cache = RecognitionCache(max_distance=4)
+    key = fingerprint(crop(), "cam1")
+    cache.put(flip_bits(key, 3), {"uuid": "longe"})
+    cache.put(flip_bits(key, 1), {"uuid": "perto"})
+
+    assert cache.get(key) == {"uuid": "perto"}
+
+
+def test_scopes_never_share_results(clock):
+    cache = RecognitionCache()
+    image = crop()
+    cache.put(fingerprint(image, "cliente-a"), {"uuid": "a"})
+
+    assert cache.get(fingerprint(image, "cliente-a")) == {"uuid": "a"}
+    assert cache.get(fingerprint(image, "cliente-b")) is None
+    assert cache.get(fingerprint(image)) is None
+    assert cache.get(fingerprint(image.resize((160, 160)), "cliente-a")) is None  # outro tamanho
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = RecognitionCache(ttl_s=5.0)
+    key = fingerprint(crop(), "cam1")
+    cache.put(key, {"uuid": "a"})
+
+    clock[0] += 5.0
+    assert cache.get(key) == {"uuid": "a"}
+    clock[0] += 0.1
+    assert cache.get(key) is None
+    assert len(cache) == 0
+
+
+def test_lru_eviction(clock):
+    cache = RecognitionCache(max_entries=2, max_distance=0)
+    keys = [fingerprint(crop(seed), "cam1") for seed in range(3)]
+    cache.put(keys[0], {"uuid": "0"})
+    cache.put(keys[1], {"uuid": "1"})
+    cache.get(keys[0])  # mais recente que keys[1]
+    cache.put(keys[2], {"uuid": "2"})
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == {"uuid": "0"} and cache.get(keys[2]) == {"uuid": "2"}
+
+
+def test_invalidate_person(clock):
+    cache = RecognitionCache(max_distance=0)
+    keys = [fingerprint(crop(seed), scope) for seed, scope in ((0, "cam1"), (1, "cam2"), (2, "cam1"))]
+    cache.put(keys[0], {"uuid": "a"})
+    cache.put(keys[1], {"uuid": "a"})
+    cache.put(keys[2], {"uuid": "b"})
+
+    assert cache.invalidate_person("a") == 2
+    assert cache.get(keys[0]) is None and cache.get(keys[1]) is None
+    assert cache.get(keys[2]) == {"uuid": "b"}
+
+
+def test_entries_are_copies(clock):
+    cache = RecognitionCache()
+    key = fingerprint(crop(), "cam1")
+    result = {"uuid": "a", "tags": ["x"]}
+    cache.put(key, result)
+    result["uuid"] = "alterado"
+
+    first = cache.get(key)
+    first["box"] = [1, 2, 3, 4]
+
+    assert cache.get(key) == {"uuid": "a", "tags": ["x"]}
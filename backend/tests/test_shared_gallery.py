@@ -0,0 +1,112 @@
+"""
+Testes da SharedFaceGallery com processos reais (fork): um processo vê as linhas
+publicadas por outro, remoções somem para os leitores e um construtor que morre antes
+de marcar a galeria como pronta é substituído.
+"""
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+from shared_gallery import SharedFaceGallery
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="usa fork e as travas de arquivo POSIX")
+
+DIM = 4
+TIMEOUT = 10
+
+
+@pytest.fixture
+def ctx():
+    return multiprocessing.get_context("fork")
+
+
+def vector(*values) -> np.ndarray:
+    return np.asarray(values, dtype=np.float32)
+
+
+def open_gallery(directory: str) -> SharedFaceGallery:
+    return SharedFaceGallery(str(directory), dim=DIM, segment_rows=2)
+
+
+def _reader(directory, results, changed):
+    gallery = open_gallery(directory)
+    results.put(("attach", gallery.attach()))
+    results.put(("ready", gallery.wait_ready(timeout=TIMEOUT, poll=0.05)))
+    results.put(("before", sorted(gallery.snapshot()[0]), gallery.match(vector(1, 0, 0, 0), 0.1)[0]))
+    changed.wait(TIMEOUT)
+    results.put(("after", sorted(gallery.snapshot()[0]), len(gallery),
+                 gallery.match(vector(1, 0, 0, 0), 0.1)[0], gallery.match(vector(0, 0, 1, 0), 0.1)[0]))
+
+
+def test_second_process_sees_rows_and_removals(tmp_path, ctx):
+    builder = open_gallery(tmp_path)
+    assert builder.attach() is True
+    builder.add_many(["a", "b"], ["a/1.png", "b/1.png"], [vector(1, 0, 0, 0), vector(0, 1, 0, 0)])
+    builder.mark_ready()
+
+    results, changed = ctx.Queue(), ctx.Event()
+    reader = ctx.Process(target=_reader, args=(str(tmp_path), results, changed))
+    reader.start()
+    try:
+        assert results.get(timeout=TIMEOUT) == ("attach", False)  # mesma execução: não reconstrói
+        assert results.get(timeout=TIMEOUT) == ("ready", True)
+        assert results.get(timeout=TIMEOUT) == ("before", ["a", "b"], "a")
+
+        # Linhas novas (em um segmento novo) e uma remoção depois que o leitor já mapeou a galeria
+        builder.add("c", "c/1.png", vector(0, 0, 1, 0))
+        builder.remove_person("a")
+        changed.set()
+
+        assert results.get(timeout=TIMEOUT) == ("after", ["b", "c"], 2, None, "c")
+    finally:
+        reader.join(TIMEOUT)
+    assert reader.exitcode == 0
+
+
+def _dying_builder(directory, attached, release):
+    gallery = open_gallery(directory)
+    assert gallery.attach() is True
+    gallery.add("parcial", "parcial/1.png", vector(1, 0, 0, 0))
+    attached.set()
+    release.wait(TIMEOUT)
+    os._exit(0)  # morre sem mark_ready
+
+
+def test_waiter_takes_over_when_builder_dies(tmp_path, ctx):
+    attached, release = ctx.Event(), ctx.Event()
+    builder = ctx.Process(target=_dying_builder, args=(str(tmp_path), attached, release))
+    builder.start()
+    assert attached.wait(TIMEOUT)
+
+    waiter = open_gallery(tmp_path)
+    assert waiter.attach() is False  # o construtor está vivo: aguarda em vez de reconstruir
+    release.set()
+    builder.join(TIMEOUT)
+
+    assert waiter.wait_ready(timeout=TIMEOUT, poll=0.05) is False  # assumiu a construção
+    assert len(waiter) == 0  # a construção parcial foi descartada
+    waiter.add("a", "a/1.png", vector(1, 0, 0, 0))
+    waiter.mark_ready()
+
+    late = open_gallery(tmp_path)
+    assert late.attach() is False
+    assert late.wait_ready(timeout=TIMEOUT, poll=0.05) is True
+    assert late.snapshot()[0] == ["a"]
+
+
+def test_new_run_rebuilds_when_no_process_is_alive(tmp_path, ctx):
+    def build_and_exit(directory):
+        gallery = open_gallery(directory)
+        gallery.attach()
+        gallery.add("antiga", "antiga/1.png", vector(1, 0, 0, 0))
+        gallery.mark_ready()
+
+    previous = ctx.Process(target=build_and_exit, args=(str(tmp_path),))
+    previous.start()
+    previous.join(TIMEOUT)
+
+    gallery = open_gallery(tmp_path)
+    assert gallery.attach() is True
+    assert len(gallery) == 0
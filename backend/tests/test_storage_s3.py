@@ -0,0 +1,122 @@
+"""
+Testes do S3PhotoStorage contra o S3 simulado em processo do moto.
+
+    pip install "moto[s3]" pytest
+    cd backend && python -m pytest tests
+"""
+import os
+
+import pytest
+from PIL import Image
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from storage import S3PhotoStorage  # noqa: E402
+
+BUCKET = "faces-teste"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "teste")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "teste")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def make_storage(s3, tmp_path, **kwargs) -> S3PhotoStorage:
+    return S3PhotoStorage(BUCKET, prefix="fotos", cache_dir=str(tmp_path / "cache"), client=s3, **kwargs)
+
+
+def image(color=(255, 0, 0)) -> Image.Image:
+    return Image.new("RGB", (8, 8), color)
+
+
+def object_keys(s3, prefix="") -> list:
+    return sorted(obj["Key"] for obj in s3.list_objects_v2(Bucket=BUCKET, Prefix=prefix).get("Contents", []))
+
+
+def test_save_and_flush_uploads_object(s3, tmp_path):
+    storage = make_storage(s3, tmp_path)
+    key = storage.save("pessoa-a/foto1.png", image())
+    storage.flush()
+
+    assert key == "pessoa-a/foto1.png"
+    head = s3.head_object(Bucket=BUCKET, Key="fotos/pessoa-a/foto1.png")
+    assert head["ContentType"] == "image/png"
+    # A cópia local fica no cache de leitura
+    assert os.path.exists(tmp_path / "cache" / "pessoa-a" / "foto1.png")
+    assert storage.upload_failures == 0
+
+
+def test_presigned_url(s3, tmp_path):
+    storage = make_storage(s3, tmp_path, url_expires=120)
+    url = storage.url("pessoa-a/foto1.png")
+
+    assert BUCKET in url
+    assert "fotos/pessoa-a/foto1.png" in url
+    assert "Expires=" in url or "X-Amz-Expires=120" in url
+
+
+def test_public_base_url(s3, tmp_path):
+    storage = make_storage(s3, tmp_path, public_base_url="https://cdn.exemplo.com/")
+
+    assert storage.url("pessoa-a/foto1.png") == "https://cdn.exemplo.com/fotos/pessoa-a/foto1.png"
+
+
+def test_local_path_downloads_when_cache_is_empty(s3, tmp_path):
+    writer = make_storage(s3, tmp_path / "escrita")
+    writer.save("pessoa-a/foto1.png", image((0, 255, 0)))
+    writer.flush()
+
+    reader = make_storage(s3, tmp_path / "leitura")
+    path = reader.local_path("pessoa-a/foto1.png")
+
+    assert path == os.path.join(str(tmp_path / "leitura" / "cache"), "pessoa-a", "foto1.png")
+    with Image.open(path) as downloaded:
+        assert downloaded.getpixel((0, 0)) == (0, 255, 0)
+    assert not os.path.exists(path + ".part")
+
+
+def test_delete_prefix(s3, tmp_path):
+    storage = make_storage(s3, tmp_path)
+    storage.save("pessoa-a/foto1.png", image())
+    storage.save("pessoa-a/foto2.png", image())
+    storage.save("pessoa-b/foto1.png", image())
+
+    storage.delete_prefix("pessoa-a")
+
+    assert object_keys(s3) == ["fotos/pessoa-b/foto1.png"]
+    assert not os.path.exists(tmp_path / "cache" / "pessoa-a")
+    assert os.path.exists(tmp_path / "cache" / "pessoa-b" / "foto1.png")
+
+
+def test_move_prefix(s3, tmp_path):
+    storage = make_storage(s3, tmp_path)
+    storage.save("pessoa-a/foto1.png", image())
+    storage.save("pessoa-a/foto2.png", image())
+    storage.save("pessoa-b/foto3.png", image())
+
+    moved = storage.move_prefix("pessoa-a", "pessoa-b")
+
+    assert moved == 2
+    assert object_keys(s3) == ["fotos/pessoa-b/foto1.png", "fotos/pessoa-b/foto2.png", "fotos/pessoa-b/foto3.png"]
+    assert not os.path.exists(tmp_path / "cache" / "pessoa-a")
+    # As fotos movidas continuam legíveis pela nova chave (baixadas do bucket)
+    assert os.path.exists(storage.local_path("pessoa-b/foto1.png"))
+
+
+def test_failed_upload_is_counted(s3, tmp_path):
+    errors = []
+    storage = S3PhotoStorage("bucket-inexistente", cache_dir=str(tmp_path / "cache"), client=s3)
+    storage.on_upload_error = lambda key, error: errors.append(key)
+
+    storage.save("pessoa-a/foto1.png", image())
+    storage.flush()
+
+    assert storage.upload_failures == 1
+    assert errors == ["pessoa-a/foto1.png"]
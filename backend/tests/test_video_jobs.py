@@ -0,0 +1,219 @@
+"""
+Testes dos jobs de vídeo (video_jobs.py) com o Mongo simulado do mongomock e um vídeo
+MJPG sintético: processamento completo, retomada do next_frame, cancelamento e a posse
+do job (um runner que perdeu o job não grava mais nada).
+
+    pip install mongomock opencv-python-headless pytest
+"""
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+mongomock = pytest.importorskip("mongomock")
+
+import video_jobs  # noqa: E402
+from video_jobs import CANCELLED, DONE, QUEUED, RUNNING, VideoJobs  # noqa: E402
+
+FRAMES = 20
+TIMEOUT = 10
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    """20 frames de 64x48; o brilho do frame i é 10*i (identifica o frame na imagem)."""
+    path = str(tmp_path_factory.mktemp("video") / "src.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (64, 48))
+    for i in range(FRAMES):
+        writer.write(np.full((48, 64, 3), 10 * i, np.uint8))
+    writer.release()
+    return path
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+@pytest.fixture
+def pool():
+    executor = ThreadPoolExecutor(2)
+    yield executor
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Recognizer:
+    """`submit` de teste: devolve uma face por frame, com pessoa nos frames múltiplos de 4."""
+
+    def __init__(self, pool, on_frame=None):
+        self.pool = pool
+        self.on_frame = on_frame
+        self.frames = []
+
+    def _run(self, image):
+        frame = int(round(np.asarray(image)[..., 0].mean() / 10))
+        self.frames.append(frame)
+        if self.on_frame is not None:
+            self.on_frame(frame)
+        return [{"uuid": f"p{frame}" if frame % 4 == 0 else None}]
+
+    def __call__(self, image) -> Future:
+        return self.pool.submit(self._run, image)
+
+
+def make_jobs(db, tmp_path, submit, **kwargs) -> VideoJobs:
+    jobs = VideoJobs(db.video_jobs, db.video_job_results, submit=submit, directory=str(tmp_path / "jobs"),
+                     frame_step=2, **kwargs)
+    jobs.ensure_indexes()
+    return jobs
+
+
+def upload(jobs: VideoJobs, video: str) -> dict:
+    job_id, path = jobs.new_upload_path("video.avi")
+    shutil.copy(video, path)
+    return jobs.create(job_id, path, "video.avi")
+
+
+def test_job_processes_sampled_frames_in_order(db, tmp_path, pool, video):
+    recognizer = Recognizer(pool)
+    jobs = make_jobs(db, tmp_path, recognizer)
+    created = upload(jobs, video)
+
+    jobs.run_job(jobs._claim())
+
+    job = jobs.get(created["_id"])
+    assert job["status"] == DONE
+    assert (job["frames_total"], job["frames_done"], job["next_frame"]) == (10, 10, 19)
+    assert job["faces_found"] == 5  # frames 0, 4, 8, 12, 16
+    total, rows = jobs.frame_results(created["_id"], limit=100)
+    assert total == 10
+    assert [row["frame"] for row in rows] == list(range(0, FRAMES, 2))
+    assert rows[1] == {"frame": 2, "timestamp_ms": 200, "faces": [{"uuid": None}]}
+    assert not os.path.exists(created["path"])
+
+
+def test_stale_job_is_recovered_and_resumes_from_next_frame(db, tmp_path, pool, video):
+    recognizer = Recognizer(pool)
+    jobs = make_jobs(db, tmp_path, recognizer, stale_s=60)
+    created = upload(jobs, video)
+    claimed = jobs._claim()
+    # O runner morreu depois de gravar os frames 0..8 e o progresso
+    for frame in range(0, 10, 2):
+        db.video_job_results.insert_one({"job": created["_id"], "frame": frame, "faces": [{"uuid": "x"}]})
+    db.video_jobs.update_one({"_id": created["_id"]}, {"$set": {"next_frame": 10, "heartbeat": time.time() - 30}})
+
+    assert jobs.recover() == 0  # heartbeat ainda recente
+    db.video_jobs.update_one({"_id": created["_id"]}, {"$set": {"heartbeat": time.time() - 61}})
+    assert jobs.recover() == 1
+    job = jobs.get(created["_id"])
+    assert job["status"] == QUEUED and "owner" not in job
+
+    resumed = jobs._claim()
+    assert resumed["owner"] != claimed["owner"]
+    jobs.run_job(resumed)
+
+    assert sorted(recognizer.frames) == [10, 12, 14, 16, 18]
+    job = jobs.get(created["_id"])
+    assert job["status"] == DONE
+    assert job["frames_done"] == 10
+    assert job["faces_found"] == 5 + 2  # 5 gravadas antes da queda + frames 12 e 16
+    assert jobs.frame_results(created["_id"], limit=100)[0] == 10
+
+
+def test_cancel_queued_job_removes_upload(db, tmp_path, pool, video):
+    jobs = make_jobs(db, tmp_path, Recognizer(pool))
+    created = upload(jobs, video)
+
+    assert jobs.cancel(created["_id"])["status"] == CANCELLED
+    assert not os.path.exists(created["path"])
+    assert jobs._claim() is None
+
+
+def test_cancel_running_job_stops_at_next_progress(db, tmp_path, pool, video, monkeypatch):
+    monkeypatch.setattr(video_jobs, "PROGRESS_INTERVAL_S", 0.0)
+    jobs = make_jobs(db, tmp_path, None, inflight=1)
+    created = upload(jobs, video)
+    jobs.submit = Recognizer(pool, on_frame=lambda frame: frame == 4 and jobs.cancel(created["_id"]))
+
+    jobs.run_job(jobs._claim())
+
+    job = jobs.get(created["_id"])
+    assert job["status"] == CANCELLED
+    assert job["frames_done"] < 10
+
+
+def test_stale_owner_cannot_write_after_takeover(db, tmp_path, pool, video, monkeypatch):
+    monkeypatch.setattr(video_jobs, "PROGRESS_INTERVAL_S", 0.0)
+    jobs = make_jobs(db, tmp_path, None, inflight=1)
+    other = make_jobs(db, tmp_path, Recognizer(pool))
+    created = upload(jobs, video)
+    taken_over = threading.Event()
+
+    def takeover(frame):
+        # Outro runner retoma o job enquanto este processa o frame 4
+        if frame == 4 and not taken_over.is_set():
+            db.video_jobs.update_one({"_id": created["_id"]}, {"$set": {"heartbeat": 0}})
+            assert other.recover() == 1
+            assert other._claim() is not None
+            taken_over.set()
+
+    jobs.submit = Recognizer(pool, on_frame=takeover)
+    stale = jobs._claim()
+    jobs.run_job(stale)
+
+    assert taken_over.is_set()
+    job = jobs.get(created["_id"])
+    assert job["status"] == RUNNING and job["owner"] != stale["owner"]
+    assert "finished_at" not in job
+    assert os.path.exists(created["path"])  # o vídeo continua para o novo dono
+    frames = [row["frame"] for row in jobs.frame_results(created["_id"], limit=100)[1]]
+    assert 4 not in frames and max(frames) < 4  # nada gravado depois da retomada
+
+    # O novo dono termina o job normalmente
+    other.run_job(jobs.get(created["_id"]))
+    assert jobs.get(created["_id"])["status"] == DONE
+
+
+def test_heartbeat_detects_lost_ownership(db, tmp_path, pool, video):
+    jobs = make_jobs(db, tmp_path, Recognizer(pool), stale_s=0.3, heartbeat_s=0.01)
+    created = upload(jobs, video)
+    claimed = jobs._claim()
+    stop, lost = threading.Event(), threading.Event()
+    thread = threading.Thread(target=jobs._heartbeat, args=(claimed, stop, lost), daemon=True)
+    thread.start()
+    try:
+        before = jobs.get(created["_id"])["heartbeat"]
+        time.sleep(0.05)
+        assert jobs.get(created["_id"])["heartbeat"] > before
+        assert not lost.is_set()
+
+        db.video_jobs.update_one({"_id": created["_id"]}, {"$set": {"owner": "outro"}})
+        assert lost.wait(TIMEOUT)
+    finally:
+        stop.set()
+        thread.join(TIMEOUT)
+
+
+def test_frame_timeout_is_recorded_and_job_continues(db, tmp_path, pool, video):
+    recognizer = Recognizer(pool)
+
+    def submit(image):
+        if len(recognizer.frames) == 0 and not getattr(submit, "stuck", False):
+            submit.stuck = True
+            return Future()  # nunca fica pronto
+        return recognizer(image)
+
+    jobs = make_jobs(db, tmp_path, submit, frame_timeout_s=0.05)
+    created = upload(jobs, video)
+
+    jobs.run_job(jobs._claim())
+
+    assert jobs.get(created["_id"])["status"] == DONE
+    rows = jobs.frame_results(created["_id"], limit=100)[1]
+    assert rows[0]["faces"] == [] and "0.05 s" in rows[0]["error"]
+    assert len(rows) == 10
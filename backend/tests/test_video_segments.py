@@ -0,0 +1,98 @@
+"""
+Testes das fronteiras dos segmentos (video_segments.py) com um VideoCapture simulado
+cujo seek para no keyframe seguinte, como em vídeos com poucos keyframes.
+"""
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+
+import video_segments  # noqa: E402
+from video_segments import _seek, plan_segments, process_segment  # noqa: E402
+
+
+class KeyframeCapture:
+    """Vídeo de `frames` frames com keyframes a cada `gop`; o seek vai ao keyframe seguinte."""
+
+    def __init__(self, frames: int = 300, gop: int = 30, first_keyframe: int = 0):
+        self.frames = frames
+        self.gop = gop
+        self.first_keyframe = first_keyframe
+        self.pos = 0
+        self.seeks = []
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        assert prop == cv2.CAP_PROP_POS_FRAMES
+        self.seeks.append(value)
+        keyframe = -(-int(value) // self.gop) * self.gop
+        self.pos = min(self.frames, max(keyframe, self.first_keyframe))
+        return True
+
+    def get(self, prop):
+        assert prop == cv2.CAP_PROP_POS_FRAMES
+        return float(self.pos)
+
+    def grab(self):
+        if self.pos >= self.frames:
+            return False
+        self.pos += 1
+        return True
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return True, np.full((8, 8, 3), self.pos - 1, np.uint8)
+
+    def release(self):
+        pass
+
+
+def test_seek_backs_off_until_before_start():
+    cap = KeyframeCapture(gop=30)
+
+    assert _seek(cap, 100, overlap=4) == 90
+    assert cap.seeks == [96, 92, 84]
+
+
+def test_seek_is_exact_when_the_decoder_lands_on_target():
+    cap = KeyframeCapture(gop=1)
+
+    assert _seek(cap, 100, overlap=4) == 96
+    assert cap.seeks == [96]
+    assert _seek(KeyframeCapture(), 0, overlap=4) == 0
+
+
+def test_seek_reports_frame_after_start_when_nothing_helps():
+    cap = KeyframeCapture(first_keyframe=50)
+
+    assert _seek(cap, 10, overlap=4) == 50
+    assert cap.seeks[-1] == 0
+
+
+@pytest.fixture
+def no_detection(monkeypatch):
+    monkeypatch.setattr(video_segments, "detect_faces", lambda *args, **kwargs: [])
+
+
+def test_segment_reads_from_its_start_despite_late_seek(monkeypatch, no_detection):
+    monkeypatch.setattr(cv2, "VideoCapture", lambda path: KeyframeCapture(gop=30))
+
+    frames = process_segment("video.mp4", 100, 120, step=2, overlap=4)
+
+    assert [idx for idx, _faces in frames] == list(range(100, 120, 2))
+
+
+def test_unrecoverable_gap_is_logged(monkeypatch, capsys, no_detection):
+    monkeypatch.setattr(cv2, "VideoCapture", lambda path: KeyframeCapture(first_keyframe=50))
+
+    frames = process_segment("video.mp4", 40, 60, step=2, overlap=4)
+
+    assert [idx for idx, _faces in frames] == list(range(50, 60, 2))
+    assert "frames 40..49 ficam de fora" in capsys.readouterr().out
+
+
+def test_plan_segments_aligns_starts_to_step():
+    assert plan_segments(3, 50, 20, 4) == [(4, 24), (24, 44), (44, 50)]
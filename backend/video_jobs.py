@@ -0,0 +1,370 @@
+"""
+Processamento de vídeos em segundo plano (jobs).
+
+O upload grava o vídeo em VIDEO_JOBS_DIR e cria um documento na coleção video_jobs
+com status "queued"; a resposta volta na hora com o id do job. Threads de
+processamento (VIDEO_JOBS_RUNNERS por processo) pegam os jobs da fila com um
+find_one_and_update atômico, o que permite vários workers do gunicorn, e processam
+1 frame a cada VIDEO_FRAME_STEP pela função `submit` (no servidor, detecção e
+reconhecimento na classe BULK da fila de admissão). Com um SegmentRunner (ver
+video_segments.py), vídeos longos são decodificados e detectados em processos
+paralelos e só as faces prontas passam por `submit_faces`.
+
+O resultado de cada frame ({job, frame, timestamp_ms, faces}) vai para a coleção
+video_job_results, na ordem dos frames, e o job guarda o progresso: frames
+processados, faces encontradas, próximo frame (ponto de retomada), velocidade, ETA e
+heartbeat. Estados: queued, running, done, failed, cancelled.
+
+Retomada: um job "running" cujo heartbeat passou de VIDEO_JOB_STALE_S (processo
+reiniciado ou morto) volta para "queued" e continua do próximo frame; os frames
+processados depois do último progresso gravado (no máximo ~1 s + os frames em
+andamento) são processados de novo. O resultado do frame é sobrescrito, mas as
+presenças desses frames podem ficar duplicadas.
+
+Dono: ao pegar o job o runner grava em "owner" um identificador único da posse
+(host:pid:token), e uma thread de heartbeat o renova a cada VIDEO_JOB_HEARTBEAT_S,
+independente de quanto cada frame demora. Todo progresso, resultado e a finalização
+só são gravados enquanto o job continua com esse dono (conferido antes de gravar cada
+frame); se o job foi retomado por outro runner (o heartbeat não chegou a tempo), este
+runner para sem gravar nada nem apagar o vídeo. Um frame que não fica pronto em VIDEO_FRAME_TIMEOUT_S é gravado
+com erro e o job segue.
+"""
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import datetime
+from typing import Callable, Iterator, Optional, Tuple
+
+from PIL import Image
+from pymongo import ReturnDocument
+
+VIDEO_JOBS_DIR = os.getenv("VIDEO_JOBS_DIR", "video_jobs")
+VIDEO_JOBS_RUNNERS = int(os.getenv("VIDEO_JOBS_RUNNERS", "1"))
+VIDEO_JOB_STALE_S = float(os.getenv("VIDEO_JOB_STALE_S", "60"))
+VIDEO_FRAME_STEP = int(os.getenv("VIDEO_FRAME_STEP", "2"))
+VIDEO_JOB_HEARTBEAT_S = float(os.getenv("VIDEO_JOB_HEARTBEAT_S", "10"))
+VIDEO_FRAME_TIMEOUT_S = float(os.getenv("VIDEO_FRAME_TIMEOUT_S", "120"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# Intervalo entre gravações do progresso (e verificações de cancelamento)
+PROGRESS_INTERVAL_S = 1.0
+
+
+class OwnershipLost(Exception):
+    """O job foi retomado por outro runner; este não deve gravar mais nada."""
+
+
+class VideoJobs:
+    def __init__(self, jobs, results, submit: Callable[[Image.Image], Future],
+                 directory: str = VIDEO_JOBS_DIR, frame_step: int = VIDEO_FRAME_STEP,
+                 inflight: int = 4, stale_s: float = VIDEO_JOB_STALE_S,
+                 segments=None, submit_faces: Callable[[list], Future] = None,
+                 heartbeat_s: float = VIDEO_JOB_HEARTBEAT_S, frame_timeout_s: float = VIDEO_FRAME_TIMEOUT_S):
+        """
+        `jobs`/`results`: coleções do Mongo. `submit(imagem)` agenda o processamento de
+        um frame (PIL RGB) e devolve um Future com a lista de faces reconhecidas.
+        `inflight`: frames de um job aguardando processamento ao mesmo tempo.
+        `segments`/`submit_faces`: SegmentRunner e a função que reconhece as faces
+        (SegmentFace) de um frame já detectado, para os vídeos longos.
+        `heartbeat_s`: intervalo da thread de heartbeat (bem abaixo de `stale_s`).
+        `frame_timeout_s`: espera máxima pelo resultado de um frame.
+        """
+        self.jobs = jobs
+        self.results = results
+        self.submit = submit
+        self.segments = segments
+        self.submit_faces = submit_faces
+        self.directory = directory
+        self.frame_step = max(1, frame_step)
+        self.inflight = max(1, inflight)
+        self.stale_s = stale_s
+        self.heartbeat_s = min(heartbeat_s, stale_s / 3)
+        self.frame_timeout_s = frame_timeout_s
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        os.makedirs(directory, exist_ok=True)
+
+    def ensure_indexes(self) -> None:
+        self.jobs.create_index([("status", 1), ("created_at", 1)])
+        self.results.create_index([("job", 1), ("frame", 1)], unique=True)
+
+    # ----------------------------
+    # API
+    # ----------------------------
+    def new_upload_path(self, filename: str) -> Tuple[str, str]:
+        """(id do job, caminho onde gravar o upload)."""
+        job_id = str(uuid.uuid4())
+        ext = os.path.splitext(filename or "")[1] or ".mp4"
+        return job_id, os.path.join(self.directory, job_id + ext)
+
+    def create(self, job_id: str, path: str, filename: str) -> dict:
+        job = {
+            "_id": job_id,
+            "status": QUEUED,
+            "filename": filename,
+            "path": path,
+            "created_at": datetime.now(),
+            "frames_total": None,
+            "frames_done": 0,
+            "faces_found": 0,
+            "next_frame": 0,
+            "cancel_requested": False,
+        }
+        self.jobs.insert_one(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.jobs.find_one({"_id": job_id})
+
+    def list(self, page: int = 1, limit: int = 10) -> Tuple[int, list]:
+        total = self.jobs.count_documents({})
+        cursor = self.jobs.find({}).sort("created_at", -1).skip((page - 1) * limit).limit(limit)
+        return total, list(cursor)
+
+    def frame_results(self, job_id: str, page: int = 1, limit: int = 50) -> Tuple[int, list]:
+        total = self.results.count_documents({"job": job_id})
+        cursor = (self.results.find({"job": job_id}, {"_id": 0, "job": 0})
+                  .sort("frame", 1).skip((page - 1) * limit).limit(limit))
+        return total, list(cursor)
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """Cancela na hora um job na fila; um job em andamento para no próximo progresso."""
+        job = self.jobs.find_one_and_update(
+            {"_id": job_id, "status": QUEUED},
+            {"$set": {"status": CANCELLED, "finished_at": datetime.now()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is not None:
+            self._remove_upload(job)
+            return job
+        return self.jobs.find_one_and_update(
+            {"_id": job_id, "status": RUNNING},
+            {"$set": {"cancel_requested": True}},
+            return_document=ReturnDocument.AFTER,
+        ) or self.get(job_id)
+
+    @staticmethod
+    def public(job: dict) -> dict:
+        """Representação do job nas respostas da API."""
+        frames_total = job.get("frames_total")
+        progress = round(job["frames_done"] / frames_total, 4) if frames_total else None
+        return {
+            "job_id": job["_id"],
+            "status": job["status"],
+            "filename": job.get("filename"),
+            "frames_total": frames_total,
+            "frames_done": job["frames_done"],
+            "faces_found": job["faces_found"],
+            "progress": progress,
+            "fps": job.get("fps"),
+            "eta_s": job.get("eta_s") if job["status"] == RUNNING else None,
+            "error": job.get("error"),
+            "cancel_requested": job.get("cancel_requested", False),
+            **{k: job[k].isoformat() for k in ("created_at", "started_at", "finished_at") if job.get(k)},
+        }
+
+    # ----------------------------
+    # Processamento
+    # ----------------------------
+    def recover(self) -> int:
+        """Devolve à fila os jobs "running" sem heartbeat recente (processo reiniciado)."""
+        result = self.jobs.update_many(
+            {"status": RUNNING, "heartbeat": {"$lt": time.time() - self.stale_s}},
+            {"$set": {"status": QUEUED}, "$unset": {"owner": ""}},
+        )
+        return result.modified_count
+
+    def _claim(self) -> Optional[dict]:
+        # Token por posse: distingue também os runners do mesmo processo e uma nova
+        # posse do mesmo job por este runner depois de uma retomada
+        owner = f"{self.owner}:{uuid.uuid4().hex[:8]}"
+        return self.jobs.find_one_and_update(
+            {"status": QUEUED},
+            {"$set": {"status": RUNNING, "owner": owner, "heartbeat": time.time(),
+                      "started_at": datetime.now()}},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def run_forever(self, poll_s: float = 2.0) -> None:
+        """Loop de uma thread de processamento. Bloqueia."""
+        last_recover = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_recover > self.stale_s / 2:
+                    recovered = self.recover()
+                    if recovered:
+                        print(f"[video-jobs] {recovered} job(s) retomado(s).")
+                    last_recover = time.monotonic()
+                job = self._claim()
+            except Exception as e:
+                print(f"[video-jobs] Falha ao buscar jobs: {e}")
+                job = None
+            if job is None:
+                time.sleep(poll_s)
+                continue
+            self.run_job(job)
+
+    def start(self, runners: int = VIDEO_JOBS_RUNNERS) -> None:
+        for i in range(runners):
+            threading.Thread(target=self.run_forever, name=f"video-jobs-{i}", daemon=True).start()
+
+    def run_job(self, job: dict) -> None:
+        stop, lost = threading.Event(), threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, stop, lost),
+                                     name=f"video-job-heartbeat-{job['_id']}", daemon=True)
+        heartbeat.start()
+        try:
+            status = self._process(job, lost)
+            update = {"status": status}
+        except OwnershipLost:
+            print(f"[video-jobs] Job {job['_id']} foi retomado por outro runner; abandonando.")
+            return
+        except Exception as e:
+            print(f"[video-jobs] Job {job['_id']} falhou: {e}")
+            update = {"status": FAILED, "error": str(e)}
+        finally:
+            stop.set()
+        update["finished_at"] = datetime.now()
+        result = self.jobs.update_one({"_id": job["_id"], "owner": job["owner"]},
+                                      {"$set": update, "$unset": {"eta_s": ""}})
+        if result.matched_count:
+            self._remove_upload(job)
+        else:
+            print(f"[video-jobs] Job {job['_id']} foi retomado por outro runner; resultado descartado.")
+
+    def _heartbeat(self, job: dict, stop: threading.Event, lost: threading.Event) -> None:
+        """Renova o heartbeat enquanto o job roda; sinaliza `lost` se o job mudou de dono."""
+        while not stop.wait(self.heartbeat_s):
+            try:
+                result = self.jobs.update_one({"_id": job["_id"], "owner": job["owner"]},
+                                              {"$set": {"heartbeat": time.time()}})
+            except Exception as e:
+                print(f"[video-jobs] Falha ao gravar o heartbeat do job {job['_id']}: {e}")
+                continue
+            if result.matched_count == 0:
+                lost.set()
+                return
+
+    def _remove_upload(self, job: dict) -> None:
+        try:
+            os.remove(job["path"])
+        except OSError:
+            pass
+
+    def _count_faces(self, job_id: str) -> int:
+        rows = list(self.results.aggregate([
+            {"$match": {"job": job_id}},
+            {"$unwind": "$faces"},
+            {"$match": {"faces.uuid": {"$ne": None}}},
+            {"$count": "n"},
+        ]))
+        return rows[0]["n"] if rows else 0
+
+    def _decode_frames(self, cap, start: int) -> Iterator[Tuple[int, Future]]:
+        """Laço único: decodifica no próprio thread e agenda cada frame amostrado."""
+        import cv2
+        frame_idx = start
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if frame_idx % self.frame_step == 0:
+                yield frame_idx, self.submit(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+            frame_idx += 1
+
+    def _process(self, job: dict, lost: threading.Event) -> str:
+        import cv2
+
+        job_id = job["_id"]
+        mine = {"_id": job_id, "owner": job["owner"]}
+        cap = cv2.VideoCapture(job["path"])
+        if not cap.isOpened():
+            raise RuntimeError("não foi possível abrir o vídeo")
+        video_fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        next_frame = job.get("next_frame", 0)
+        if next_frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, next_frame)
+        # Contadores a partir dos resultados já gravados (corretos mesmo após uma retomada)
+        progress = {
+            "frames_total": math.ceil(frame_count / self.frame_step) if frame_count else None,
+            "frames_done": self.results.count_documents({"job": job_id}),
+            "faces_found": self._count_faces(job_id),
+            "next_frame": next_frame,
+        }
+        done_at_start = progress["frames_done"]
+        segmented = self.segments is not None and self.segments.should_split(frame_count, video_fps)
+        if segmented:
+            frames = self.segments.iter_frames(job["path"], next_frame, frame_count, video_fps, self.frame_step)
+            source = ((idx, self.submit_faces(faces)) for idx, faces in frames)
+        else:
+            frames = None
+            source = self._decode_frames(cap, next_frame)
+        if not self.jobs.update_one(mine, {"$set": {"segmented": segmented}}).matched_count:
+            raise OwnershipLost()
+        started = time.monotonic()
+        last_flush = 0.0
+        pending = deque()  # (índice do frame, Future)
+
+        def commit(frame_idx: int, future: Future) -> None:
+            doc = {"job": job_id, "frame": frame_idx,
+                   "timestamp_ms": round(frame_idx / video_fps * 1000) if video_fps else None}
+            try:
+                doc["faces"] = future.result(timeout=self.frame_timeout_s)
+            except FutureTimeout:
+                future.cancel()
+                doc["faces"] = []
+                doc["error"] = f"frame não processado em {self.frame_timeout_s:g} s"
+            except Exception as e:
+                doc["faces"] = []
+                doc["error"] = str(e)
+            # Verificado depois da espera: o job pode ter mudado de dono enquanto o frame rodava
+            if lost.is_set() or not self.jobs.count_documents(mine, limit=1):
+                raise OwnershipLost()
+            self.results.replace_one({"job": job_id, "frame": frame_idx}, doc, upsert=True)
+            progress["frames_done"] += 1
+            progress["faces_found"] += sum(1 for face in doc["faces"] if face.get("uuid"))
+            progress["next_frame"] = frame_idx + 1
+
+        def flush() -> bool:
+            """Grava o progresso e o heartbeat; True se o cancelamento foi pedido."""
+            if lost.is_set():
+                raise OwnershipLost()
+            elapsed = time.monotonic() - started
+            rate = (progress["frames_done"] - done_at_start) / elapsed if elapsed > 0 else 0.0
+            fields = dict(progress, heartbeat=time.time(), fps=round(rate, 2))
+            if rate > 0 and progress["frames_total"]:
+                fields["eta_s"] = round(max(0, progress["frames_total"] - progress["frames_done"]) / rate, 1)
+            current = self.jobs.find_one_and_update(mine, {"$set": fields},
+                                                    projection={"cancel_requested": 1})
+            if current is None:
+                raise OwnershipLost()
+            return bool(current.get("cancel_requested"))
+
+        try:
+            for frame_idx, future in source:
+                pending.append((frame_idx, future))
+                if len(pending) >= self.inflight:
+                    commit(*pending.popleft())
+                if time.monotonic() - last_flush >= PROGRESS_INTERVAL_S:
+                    last_flush = time.monotonic()
+                    if flush():
+                        return CANCELLED
+            while pending:
+                commit(*pending.popleft())
+            flush()
+            return DONE
+        finally:
+            source.close()
+            if frames is not None:
+                frames.close()  # cancela os segmentos que ainda não começaram
+            for _idx, future in pending:
+                future.cancel()
+            cap.release()
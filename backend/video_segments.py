@@ -0,0 +1,202 @@
+"""
+Processamento de vídeos longos em segmentos paralelos.
+
+Com um único laço de cv2.VideoCapture, um vídeo longo é decodificado e analisado em
+um só núcleo. Aqui o vídeo é dividido em segmentos de VIDEO_SEGMENT_S segundos,
+decodificados em VIDEO_SEGMENT_WORKERS processos; cada processo faz a parte pesada e
+sem estado de cada frame amostrado (decodificação, detecção, recorte e embedding das
+faces). O processo principal consome os segmentos na ordem do vídeo e faz a parte
+com estado (busca na galeria, cadastro e presenças, via process_face com o embedding
+pronto). Assim as identidades continuam consistentes: uma pessoa que aparece no fim de
+um segmento e no começo do seguinte casa com a mesma entrada da galeria, como no laço
+único.
+
+Fronteiras: cada segmento começa VIDEO_SEGMENT_OVERLAP frames antes do seu início
+nominal (o seek do OpenCV nem sempre é exato em vídeos com poucos keyframes) e
+informa o índice de cada frame segundo CAP_PROP_POS_FRAMES; a junção descarta os
+frames já emitidos pelo segmento anterior, então nenhum frame gera presença duas
+vezes. Se o decodificador parar depois do início do segmento, o seek é refeito cada
+vez mais cedo (até o frame 0); se nem assim chegar antes do início, os frames do
+intervalo ficam de fora e o salto é registrado no log. O índice é o que o OpenCV
+informa: em backends cujo CAP_PROP_POS_FRAMES não acompanha o seek de verdade, a
+fronteira pode se deslocar alguns frames.
+
+Os processos rodam com prioridade reduzida (nice VIDEO_SEGMENT_NICE) para não tirar
+CPU do reconhecimento ao vivo. Vídeos mais curtos que VIDEO_SEGMENT_MIN_S seguem no
+laço único.
+"""
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import embedding
+from detection import detect_faces
+
+VIDEO_SEGMENT_WORKERS = int(os.getenv("VIDEO_SEGMENT_WORKERS", "0"))  # 0 = desativado
+VIDEO_SEGMENT_S = float(os.getenv("VIDEO_SEGMENT_S", "10"))
+VIDEO_SEGMENT_MIN_S = float(os.getenv("VIDEO_SEGMENT_MIN_S", "30"))
+VIDEO_SEGMENT_OVERLAP = int(os.getenv("VIDEO_SEGMENT_OVERLAP", "4"))
+VIDEO_SEGMENT_NICE = int(os.getenv("VIDEO_SEGMENT_NICE", "10"))
+
+
+class SegmentFace(NamedTuple):
+    box: Tuple[int, int, int, int]
+    score: float
+    keypoints: tuple
+    crop: np.ndarray                     # recorte RGB uint8 em resolução cheia
+    embedding: Optional[np.ndarray]      # None sem backend de embedding nos processos
+
+
+def plan_segments(start: int, end: int, segment_frames: int, step: int) -> List[Tuple[int, int]]:
+    """Intervalos [início, fim) de frames, com inícios alinhados ao passo de amostragem."""
+    segment_frames = max(step, segment_frames - segment_frames % step)
+    first = start + (-start) % step
+    return [(s, min(s + segment_frames, end)) for s in range(first, end, segment_frames)]
+
+
+# ----------------------------
+# Processos de segmento
+# ----------------------------
+_embedder = None
+
+
+def _init_worker(backend: Optional[str], nice: int) -> None:
+    global _embedder
+    # Ctrl+C e o desligamento do servidor são tratados pelo processo principal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if nice and hasattr(os, "nice"):
+        os.nice(nice)
+    _embedder = embedding.create_embedder(backend) if backend else None
+
+
+def _embed_crops(crops: List[np.ndarray]) -> List[Optional[np.ndarray]]:
+    if _embedder is None or not crops:
+        return [None] * len(crops)
+    if isinstance(_embedder, embedding.OnnxEmbedder):
+        # Todas as faces do frame em uma única inferência
+        batch = np.stack([embedding.preprocess_face(np.ascontiguousarray(c[:, :, ::-1])) for c in crops])
+        return list(_embedder.forward(batch).astype(np.float32))
+    return [_embedder.embed(np.ascontiguousarray(c[:, :, ::-1])) for c in crops]
+
+
+def _seek(cap, start: int, overlap: int) -> int:
+    """
+    Posiciona `cap` em um frame <= start, começando `overlap` frames antes e recuando
+    o dobro a cada tentativa em que o decodificador para depois de `start`. Devolve o
+    índice do próximo frame (pode ser > start se nem o seek para o frame 0 resolver).
+    """
+    import cv2
+
+    target, back = max(0, start - overlap), max(1, overlap)
+    frame_idx = 0
+    while target or frame_idx:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+        frame_idx = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+        if frame_idx <= start or not target:
+            break
+        back *= 2
+        target = max(0, start - back)
+    return frame_idx
+
+
+def process_segment(path: str, start: int, end: int, step: int,
+                    overlap: int = VIDEO_SEGMENT_OVERLAP) -> List[Tuple[int, List[SegmentFace]]]:
+    """
+    Decodifica os frames [start, end) (amostrando 1 a cada `step`) e devolve
+    [(índice do frame, faces)] na ordem. Roda em um processo de segmento.
+    """
+    import cv2
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"não foi possível abrir o vídeo: {path}")
+    frames = []
+    try:
+        landed = _seek(cap, start, overlap)
+        if landed > start:
+            print(f"[video-segments] {os.path.basename(path)}: seek parou no frame {landed}, depois do "
+                  f"início do segmento ({start}); frames {start}..{landed - 1} ficam de fora.")
+        while True:
+            frame_idx = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+            if frame_idx >= end:
+                break
+            if frame_idx < start or frame_idx % step:
+                # grab() avança sem decodificar a imagem completa
+                if not cap.grab():
+                    break
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            faces = detect_faces(rgb, min_conf=0.5, model_selection=1)
+            crops = [rgb[y0:y1, x0:x1].copy() for (x0, y0, x1, y1) in (f.box for f in faces)]
+            embeddings = _embed_crops(crops)
+            frames.append((frame_idx, [SegmentFace(tuple(f.box), f.score, tuple(f.keypoints), crop, emb)
+                                       for f, crop, emb in zip(faces, crops, embeddings)]))
+    finally:
+        cap.release()
+    return frames
+
+
+class SegmentRunner:
+    """Pool de processos de segmento, compartilhado pelos jobs de vídeo do processo."""
+
+    def __init__(self, workers: int = VIDEO_SEGMENT_WORKERS, segment_s: float = VIDEO_SEGMENT_S,
+                 min_duration_s: float = VIDEO_SEGMENT_MIN_S, backend: Optional[str] = None,
+                 nice: int = VIDEO_SEGMENT_NICE):
+        """`backend`: backend de embedding dos processos (None = sem embedding nos segmentos)."""
+        self.workers = max(1, workers)
+        self.segment_s = segment_s
+        self.min_duration_s = min_duration_s
+        self.backend = backend
+        self.nice = nice
+        self._executor = None
+
+    def should_split(self, frame_count: int, fps: float) -> bool:
+        return bool(frame_count and fps) and frame_count / fps >= self.min_duration_s
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Processos criados no primeiro vídeo longo (cada um carrega detector e modelo).
+        # "spawn": o servidor já tem threads e o TensorFlow carregado, e fork herdaria locks
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                 initargs=(self.backend, self.nice),
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def iter_frames(self, path: str, start: int, end: int, fps: float,
+                    step: int) -> Iterator[Tuple[int, List[SegmentFace]]]:
+        """
+        (índice do frame, faces) em ordem de tempo. Mantém no máximo 2 segmentos por
+        processo em andamento; fechar o iterador cancela os que ainda não começaram.
+        """
+        segments = plan_segments(start, end, max(1, int(self.segment_s * fps)), step)
+        pool = self._pool()
+        futures = []
+        next_segment = 0
+        last_emitted = start - 1
+        try:
+            while next_segment < len(segments) or futures:
+                while next_segment < len(segments) and len(futures) < 2 * self.workers:
+                    s, e = segments[next_segment]
+                    futures.append(pool.submit(process_segment, path, s, e, step))
+                    next_segment += 1
+                for frame_idx, faces in futures.pop(0).result():
+                    # Junção: frames já emitidos pelo segmento anterior são descartados
+                    if frame_idx <= last_emitted:
+                        continue
+                    last_emitted = frame_idx
+                    yield frame_idx, faces
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
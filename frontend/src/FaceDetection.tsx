@@ -8,6 +8,8 @@ function FaceDetectionComponent() {
   const cameraRef = useRef<Camera | null>(null);
   const throttleInterval = 1000; // Envia 1 frame a cada 1000 ms (1 segundo)
   const lastSentTimeRef = useRef<number>(0);
+  // Conexão WebSocket mantida aberta enquanto a detecção estiver ativa
+  const socketRef = useRef<WebSocket | null>(null);
   // Adição para upload de vídeo
   const [useVideoFile, setUseVideoFile] = useState(false);
   const [videoFile, setVideoFile] = useState<File | null>(null);
@@ -29,8 +31,16 @@ function FaceDetectionComponent() {
         method: 'POST',
         body: formData,
       });
-      const result = await response.json();
-      console.log('Resultado do processamento:', result);
+      // O backend responde na hora com um job; o processamento segue em segundo plano
+      let job = await response.json();
+      console.log('Job de vídeo criado:', job);
+      while (job.job_id && !['done', 'failed', 'cancelled'].includes(job.status)) {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        job = await (await fetch(`http://localhost:8000/video-jobs/${job.job_id}`)).json();
+        console.log(`Vídeo: ${job.frames_done}/${job.frames_total ?? '?'} frames, ETA ${job.eta_s ?? '?'} s`);
+      }
+      const result = await (await fetch(`http://localhost:8000/video-jobs/${job.job_id}/results?limit=1000`)).json();
+      console.log('Resultado do processamento:', job, result);
       // Aqui você pode exibir o resultado para o usuário
     } catch (error) {
       console.error('Erro ao enviar vídeo:', error);
@@ -53,6 +63,25 @@ function FaceDetectionComponent() {
     }
   }, [isDetecting]);
 
+  // Abre o stream WebSocket ao iniciar a detecção e fecha ao parar
+  useEffect(() => {
+    if (!isDetecting) return;
+    const socket = new WebSocket('ws://localhost:8000/ws/stream');
+    socket.binaryType = 'arraybuffer';
+    socket.onmessage = (event) => {
+      const result = JSON.parse(event.data);
+      if (result.error) {
+        console.error('Erro no frame', result.seq, result.error);
+      }
+    };
+    socket.onerror = (err) => console.error('Erro no WebSocket:', err);
+    socketRef.current = socket;
+    return () => {
+      socket.close();
+      socketRef.current = null;
+    };
+  }, [isDetecting]);
+
   // Função que captura o frame atual e envia para o backend
   const sendFrame = () => {
     if (!videoRef.current || !canvasRef.current) return;
@@ -72,7 +101,22 @@ function FaceDetectionComponent() {
     canvas.width = video.videoWidth;
     canvas.height = video.videoHeight;
     ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
-    
+
+    // Com o WebSocket aberto, envia o frame como JPEG binário na mesma conexão.
+    // Se ainda houver dados do frame anterior no buffer de saída, descarta este frame.
+    const socket = socketRef.current;
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      if (socket.bufferedAmount === 0) {
+        canvas.toBlob((blob) => {
+          if (blob && socket.readyState === WebSocket.OPEN) {
+            socket.send(blob);
+          }
+        }, 'image/jpeg', 0.9);
+      }
+      return;
+    }
+
+    // Sem WebSocket: envia via HTTP POST
     // Converte o canvas para Base64
     const base64Image = canvas.toDataURL('image/png');
 
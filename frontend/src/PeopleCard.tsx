@@ -3,52 +3,21 @@ import React, { useEffect, useState } from "react";
 interface PeopleCardProps {
   uuid: string;
   tags: string[];
+  primaryPhoto: string | null;
+  photoCount: number;
+  lastSeen: string | null;
   onOpenModal: (uuid: string) => void;
   onDelete: (uuid: string) => void;
 }
 
-interface PessoaDetails {
-  uuid: string;
-  tags: string[];
-  primary_photo: string;
-}
-
-const PeopleCard: React.FC<PeopleCardProps> = ({ uuid, tags, onOpenModal, onDelete }) => {
-  const [primaryPhoto, setPrimaryPhoto] = useState<string>("");
+// Os dados do card vêm da listagem (/pessoas/summary); o card não faz requisições próprias
+const PeopleCard: React.FC<PeopleCardProps> = ({ uuid, tags, primaryPhoto, photoCount, lastSeen, onOpenModal, onDelete }) => {
   const [tagInput, setTagInput] = useState<string>("");
   const [localTags, setLocalTags] = useState<string[]>(tags);
-  const [photoCount, setPhotoCount] = useState<number>(0);
 
-  // Busca os detalhes da pessoa (incluindo a foto primária e tags)
   useEffect(() => {
-    async function fetchDetails() {
-      try {
-        const res = await fetch(`http://localhost:8000/pessoas/${uuid}`);
-        const data: PessoaDetails = await res.json();
-        setPrimaryPhoto(data.primary_photo);
-        setLocalTags(data.tags);
-      } catch (error) {
-        console.error("Erro ao buscar detalhes da pessoa", uuid, error);
-      }
-    }
-    fetchDetails();
-  }, [uuid]);
-
-  // Busca a quantidade de fotos da pessoa
-  useEffect(() => {
-    async function fetchPhotoCount() {
-      try {
-        const res = await fetch(`http://localhost:8000/pessoas/${uuid}/photos/count`);
-        const data = await res.json();
-        if (data.photo_count !== undefined) {
-          setPhotoCount(data.photo_count);
-        }
-      } catch (error) {
-        console.error("Erro ao buscar quantidade de fotos para pessoa", uuid, error);
-      }
-    }
-    fetchPhotoCount();
-  }, [uuid]);
+    setLocalTags(tags);
+  }, [tags]);
 
   const addTag = async () => {
     if (!tagInput.trim()) return;
@@ -118,6 +87,11 @@ const PeopleCard: React.FC<PeopleCardProps> = ({ uuid, tags, onOpenModal, onDele
       ) : (
         <div style={{ width: "100%", height: "120px", backgroundColor: "#eee" }} />
       )}
+      {lastSeen && (
+        <div style={{ marginTop: "6px", fontSize: "12px", color: "#666" }}>
+          Visto por último: {lastSeen.slice(0, 19)}
+        </div>
+      )}
       <div style={{ marginTop: "10px", fontSize: "14px", color: "#333" }}>
         <strong>Tags:</strong>{" "}
         {localTags && localTags.length > 0 ? (
@@ -6,6 +6,9 @@ import PeopleCard from "./PeopleCard";
 interface Pessoa {
   uuid: string;
   tags: string[];
+  primary_photo: string | null;
+  photo_count: number;
+  last_seen: string | null;
 }
 
 interface PessoaPhotos {
@@ -31,7 +34,8 @@ export const PeopleList: React.FC = () => {
   const fetchPessoas = async () => {
     setLoading(true);
     try {
-      const res = await fetch(`http://localhost:8000/pessoas?page=${page}&limit=${limit}`);
+      // Uma única chamada traz tags, foto principal, contagem de fotos e última presença
+      const res = await fetch(`http://localhost:8000/pessoas/summary?page=${page}&limit=${limit}`);
       const data = await res.json();
       setPessoas(data.pessoas);
       setTotal(data.total);
@@ -118,6 +122,9 @@ export const PeopleList: React.FC = () => {
                 key={pessoa.uuid}
                 uuid={pessoa.uuid}
                 tags={pessoa.tags}
+                primaryPhoto={pessoa.primary_photo}
+                photoCount={pessoa.photo_count}
+                lastSeen={pessoa.last_seen}
                 onOpenModal={openModal}
                 onDelete={deletePessoa}
               />
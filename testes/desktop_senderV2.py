@@ -1,9 +1,16 @@
 import argparse
 import base64
 import io
+import queue
+import random
+import statistics
 import sys
+import threading
 import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dataclasses import dataclass
+from typing import Optional
 
 import cv2
 import requests
@@ -11,6 +18,7 @@ from PIL import Image
 
 
 DEFAULT_ENDPOINT = "http://localhost:8000/detect-and-recognize"
+DEFAULT_CROP_ENDPOINT = "http://localhost:8000/recognize-crops"
 
 @dataclass
 class Config:
@@ -23,9 +31,24 @@ class Config:
     jpeg_quality: int
     retries: int
     backoff_ms: int
+    pipeline: bool = False
+    inflight: int = 4
+    ordered: bool = True
+    edge_detect: bool = False
+    crop_endpoint: str = DEFAULT_CROP_ENDPOINT
+    edge_min_conf: float = 0.5
+    edge_pad: float = 0.10
+    adaptive: bool = False
+    target_latency_ms: int = 2000
+    max_interval_ms: int = 10000
+    camera: Optional[str] = None
 
-def frame_to_data_url(frame_bgr, use_jpeg: bool, jpeg_quality: int) -> str:
-    """Converte frame BGR -> base64 data URL (JPEG ou PNG)."""
+def frame_to_data_url(frame_bgr, use_jpeg: bool, jpeg_quality: int, scale: float = 1.0) -> str:
+    """Converte frame BGR -> base64 data URL (JPEG ou PNG), opcionalmente reduzido por `scale`."""
+    if scale < 1.0:
+        h, w = frame_bgr.shape[:2]
+        frame_bgr = cv2.resize(frame_bgr, (max(1, int(w * scale)), max(1, int(h * scale))),
+                               interpolation=cv2.INTER_AREA)
     frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
     pil_img = Image.fromarray(frame_rgb)
     buf = io.BytesIO()
@@ -38,17 +61,189 @@ def frame_to_data_url(frame_bgr, use_jpeg: bool, jpeg_quality: int) -> str:
     b64 = base64.b64encode(buf.getvalue()).decode("ascii")
     return f"data:{mime};base64,{b64}"
 
-def send_frame(endpoint: str, data_url: str, timeout: float, retries: int, backoff_ms: int) -> None:
-    payload = {"image": data_url}
+class EdgeDetector:
+    """
+    Detecção de faces no cliente (MediaPipe, mesmo modelo do servidor).
+    Uma instância por thread: o detector é criado uma vez e reutilizado entre frames.
+    """
+
+    def __init__(self, min_conf: float = 0.5, pad: float = 0.10, model_selection: int = 1):
+        import mediapipe as mp
+        self.pad = pad
+        self._detector = mp.solutions.face_detection.FaceDetection(
+            model_selection=model_selection, min_detection_confidence=min_conf)
+
+    def detect(self, frame_bgr) -> list:
+        """Retorna [(x_min, y_min, x_max, y_max, score)] com margem `pad` em volta de cada face."""
+        h, w = frame_bgr.shape[:2]
+        results = self._detector.process(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB))
+        faces = []
+        for det in (results.detections or []) if results else []:
+            rel = det.location_data.relative_bounding_box
+            x_min, y_min = int(rel.xmin * w), int(rel.ymin * h)
+            x_max, y_max = x_min + int(rel.width * w), y_min + int(rel.height * h)
+            margin = int(self.pad * max(x_max - x_min, y_max - y_min))
+            x_min, y_min = max(0, x_min - margin), max(0, y_min - margin)
+            x_max, y_max = min(w - 1, x_max + margin), min(h - 1, y_max + margin)
+            if x_max > x_min and y_max > y_min:
+                faces.append((x_min, y_min, x_max, y_max, float(det.score[0])))
+        return faces
+
+    def close(self) -> None:
+        self._detector.close()
+
+class AdaptiveController:
+    """
+    Controle adaptativo de taxa e qualidade guiado pela carga anunciada pelo servidor
+    (headers X-Queue-Depth e X-Recent-Latency-Ms) e pela latência observada no cliente.
+
+    A cada `window` respostas compara a latência efetiva (maior entre a mediana observada
+    e a latência recente do servidor) com o alvo:
+    - acima do alvo, fila no servidor ou erro: aumenta o intervalo entre envios (x1.5);
+      no intervalo máximo, reduz a resolução e depois a qualidade JPEG;
+    - bem abaixo do alvo (< 60%): desfaz na ordem inversa (qualidade, resolução, taxa).
+    Cada decisão é registrada no log com o motivo.
+    """
+
+    def __init__(self, target_latency_ms: int, interval_ms: int, quality: int,
+                 max_interval_ms: int = 10000, min_quality: int = 40, min_scale: float = 0.5,
+                 max_queue_depth: int = 2, window: int = 5):
+        self.target_latency_ms = target_latency_ms
+        self.base_interval_ms = max(50, interval_ms)
+        self.interval_ms = interval_ms
+        self.max_interval_ms = max(max_interval_ms, self.base_interval_ms)
+        self.base_quality = quality
+        self.quality = quality
+        self.min_quality = min(min_quality, quality)
+        self.scale = 1.0
+        self.min_scale = min_scale
+        self.max_queue_depth = max_queue_depth
+        self.window = window
+        self._samples = deque(maxlen=window)
+        self._server_latency_ms = 0.0
+        self._queue_depth = 0
+        self._lock = threading.Lock()
+
+    def observe(self, latency_ms: float, headers, ok: bool = True) -> None:
+        with self._lock:
+            self._samples.append(latency_ms)
+            try:
+                self._server_latency_ms = float(headers.get("X-Recent-Latency-Ms", self._server_latency_ms))
+                self._queue_depth = int(headers.get("X-Queue-Depth", self._queue_depth))
+            except (TypeError, ValueError):
+                pass
+            if ok and len(self._samples) < self.window:
+                return
+            effective = max(statistics.median(self._samples), self._server_latency_ms)
+            self._samples.clear()
+            state = f"latência {effective:.0f} ms (alvo {self.target_latency_ms}), fila {self._queue_depth}"
+            if not ok:
+                self._decrease(f"erro/sobrecarga; {state}")
+            elif effective > self.target_latency_ms or self._queue_depth > self.max_queue_depth:
+                self._decrease(state)
+            elif effective < 0.6 * self.target_latency_ms and self._queue_depth <= 1:
+                self._increase(state)
+
+    def _decrease(self, reason: str) -> None:
+        if self.interval_ms < self.max_interval_ms:
+            new = min(self.max_interval_ms, int(max(self.interval_ms, self.base_interval_ms) * 1.5))
+            print(f"[ADAPT] {reason}: intervalo {self.interval_ms} -> {new} ms")
+            self.interval_ms = new
+        elif self.scale > self.min_scale:
+            new = round(max(self.min_scale, self.scale - 0.1), 2)
+            print(f"[ADAPT] {reason}: escala {self.scale:.2f} -> {new:.2f}")
+            self.scale = new
+        elif self.quality > self.min_quality:
+            new = max(self.min_quality, self.quality - 10)
+            print(f"[ADAPT] {reason}: qualidade JPEG {self.quality} -> {new}")
+            self.quality = new
+
+    def _increase(self, reason: str) -> None:
+        if self.quality < self.base_quality:
+            new = min(self.base_quality, self.quality + 5)
+            print(f"[ADAPT] {reason}: qualidade JPEG {self.quality} -> {new}")
+            self.quality = new
+        elif self.scale < 1.0:
+            new = round(min(1.0, self.scale + 0.05), 2)
+            print(f"[ADAPT] {reason}: escala {self.scale:.2f} -> {new:.2f}")
+            self.scale = new
+        elif self.interval_ms > self.base_interval_ms:
+            new = max(self.base_interval_ms, int(self.interval_ms * 0.9))
+            print(f"[ADAPT] {reason}: intervalo {self.interval_ms} -> {new} ms")
+            self.interval_ms = new
+
+def build_request(frame_bgr, cfg: "Config", detector: Optional[EdgeDetector] = None,
+                  controller: Optional[AdaptiveController] = None):
+    """
+    Monta (endpoint, payload) para um frame. Com --edge-detect, envia só os recortes
+    das faces (com box e timestamp) para o endpoint de recortes e retorna None se o
+    frame não tiver faces (nada a enviar). Com --adaptive, a qualidade e a escala vêm
+    do controlador.
+    """
+    quality = controller.quality if controller else cfg.jpeg_quality
+    scale = controller.scale if controller else 1.0
+    camera = {"camera": cfg.camera} if cfg.camera else {}
+    if detector is None:
+        return cfg.endpoint, {"image": frame_to_data_url(frame_bgr, cfg.use_jpeg, quality, scale), **camera}
+    faces = detector.detect(frame_bgr)
+    if not faces:
+        return None
+    crops = [{
+        "image": frame_to_data_url(frame_bgr[y_min:y_max, x_min:x_max], cfg.use_jpeg, quality, scale),
+        "box": [x_min, y_min, x_max, y_max],
+        "score": round(score, 4),
+    } for (x_min, y_min, x_max, y_max, score) in faces]
+    return cfg.crop_endpoint, {"faces": crops, "timestamp": int(time.time() * 1000), **camera}
+
+def payload_size(payload: dict) -> int:
+    """Tamanho aproximado (bytes) das imagens base64 de um payload."""
+    if "image" in payload:
+        return len(payload["image"])
+    return sum(len(face["image"]) for face in payload.get("faces", []))
+
+def make_session(pool_size: int = 1) -> requests.Session:
+    """Sessão HTTP persistente (keep-alive) com pool de conexões para `pool_size` envios simultâneos."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def send_frame(endpoint: str, data_url: str, timeout: float, retries: int, backoff_ms: int,
+               session: Optional[requests.Session] = None) -> dict:
+    return send_payload(endpoint, {"image": data_url}, timeout, retries, backoff_ms, session)
+
+def send_payload(endpoint: str, payload: dict, timeout: float, retries: int, backoff_ms: int,
+                 session: Optional[requests.Session] = None,
+                 controller: Optional[AdaptiveController] = None) -> dict:
+    """
+    Envia o payload com novas tentativas em backoff exponencial com jitter
+    (respeitando Retry-After em 429/503). Informa a latência e os headers de carga
+    ao controlador adaptativo, se houver.
+    """
+    http = session or requests
     for attempt in range(retries + 1):
+        sent = time.perf_counter()
         try:
-            r = requests.post(endpoint, json=payload, timeout=timeout)
+            r = http.post(endpoint, json=payload, timeout=timeout)
             r.raise_for_status()
-            return
+            if controller:
+                controller.observe((time.perf_counter() - sent) * 1000, r.headers)
+            return r.json()
         except requests.exceptions.RequestException as e:
+            response = getattr(e, "response", None)
+            headers = response.headers if response is not None else {}
+            if controller:
+                controller.observe((time.perf_counter() - sent) * 1000, headers, ok=False)
             if attempt >= retries:
                 raise
-            sleep_s = (backoff_ms * (attempt + 1)) / 1000.0
+            sleep_s = (backoff_ms * (2 ** attempt)) / 1000.0 * random.uniform(0.5, 1.5)
+            retry_after = headers.get("Retry-After")
+            if retry_after:
+                try:
+                    sleep_s = max(sleep_s, min(float(retry_after), timeout))
+                except ValueError:
+                    pass
             time.sleep(sleep_s)
 
 def process_video(path: str, cfg: Config) -> None:
@@ -60,11 +255,17 @@ def process_video(path: str, cfg: Config) -> None:
     print(f"[INFO] Enviando frames de '{path}' para {cfg.endpoint}")
     print(f"[INFO] 1 a cada {cfg.frame_skip} frames | limite: {cfg.max_seconds}s | timeout: {cfg.timeout}s")
     print(f"[INFO] Formato: {'JPEG q=%d' % cfg.jpeg_quality if cfg.use_jpeg else 'PNG'} | intervalo mínimo: {cfg.min_interval_ms} ms")
+    if cfg.edge_detect:
+        print(f"[INFO] Detecção local: enviando apenas recortes para {cfg.crop_endpoint}")
 
     start = time.time()
     last_sent_ts = 0.0
     sent = 0
     total = 0
+    bytes_sent = 0
+    session = make_session()
+    detector = EdgeDetector(cfg.edge_min_conf, cfg.edge_pad) if cfg.edge_detect else None
+    controller = make_controller(cfg)
 
     try:
         while True:
@@ -82,15 +283,19 @@ def process_video(path: str, cfg: Config) -> None:
             if total % cfg.frame_skip != 0:
                 continue
 
-            # respeitar intervalo mínimo entre envios
+            # respeitar intervalo mínimo entre envios (ajustado pelo controlador com --adaptive)
             now = time.time() * 1000.0
-            if now - last_sent_ts < cfg.min_interval_ms:
+            if now - last_sent_ts < (controller.interval_ms if controller else cfg.min_interval_ms):
                 continue
 
-            data_url = frame_to_data_url(frame, cfg.use_jpeg, cfg.jpeg_quality)
+            request = build_request(frame, cfg, detector, controller)
+            if request is None:
+                continue  # --edge-detect: frame sem faces, nada a enviar
+            endpoint, payload = request
             try:
-                send_frame(cfg.endpoint, data_url, cfg.timeout, cfg.retries, cfg.backoff_ms)
+                send_payload(endpoint, payload, cfg.timeout, cfg.retries, cfg.backoff_ms, session, controller)
                 sent += 1
+                bytes_sent += payload_size(payload)
                 last_sent_ts = now
             except requests.exceptions.RequestException as e:
                 print(f"[WARN] Falha ao enviar frame {total}: {e}")
@@ -103,9 +308,150 @@ def process_video(path: str, cfg: Config) -> None:
         print("\n[INFO] Interrompido pelo usuário (Ctrl+C).")
     finally:
         cap.release()
+        session.close()
+        if detector:
+            detector.close()
+
+    elapsed = time.time() - start
+    print(f"[OK] Total lidos: {total} | Total enviados: {sent} | Tempo: {elapsed:.1f}s | "
+          f"Enviado: {bytes_sent / 1e6:.2f} MB")
+
+def make_controller(cfg: Config) -> Optional[AdaptiveController]:
+    if not cfg.adaptive:
+        return None
+    print(f"[INFO] Modo adaptativo: alvo de latência {cfg.target_latency_ms} ms")
+    return AdaptiveController(cfg.target_latency_ms, cfg.min_interval_ms, cfg.jpeg_quality,
+                              max_interval_ms=cfg.max_interval_ms)
+
+def _produce_frames(cap, cfg: Config, out_q: queue.Queue, stop: threading.Event, counters: dict,
+                    controller: Optional[AdaptiveController] = None) -> None:
+    """
+    Thread de captura/codificação do modo pipeline: lê o vídeo, aplica --skip e
+    --min-interval-ms, codifica o frame (ou os recortes, com --edge-detect) e o coloca
+    na fila (bloqueia se a fila encher).
+    Termina colocando None na fila.
+    """
+    start = time.time()
+    last_sent_ts = 0.0
+    detector = EdgeDetector(cfg.edge_min_conf, cfg.edge_pad) if cfg.edge_detect else None
+    try:
+        while not stop.is_set():
+            ok, frame = cap.read()
+            if not ok:
+                break
+            counters["total"] += 1
+            if time.time() - start >= cfg.max_seconds:
+                print("[INFO] Tempo máximo atingido; finalizando.")
+                break
+            if counters["total"] % cfg.frame_skip != 0:
+                continue
+            now = time.time() * 1000.0
+            if now - last_sent_ts < (controller.interval_ms if controller else cfg.min_interval_ms):
+                continue
+            request = build_request(frame, cfg, detector, controller)
+            if request is None:
+                continue  # --edge-detect: frame sem faces, nada a enviar
+            last_sent_ts = now
+            counters["bytes"] += payload_size(request[1])
+            while not stop.is_set():
+                try:
+                    out_q.put((counters["total"], *request), timeout=0.2)
+                    break
+                except queue.Full:
+                    continue
+    finally:
+        if detector:
+            detector.close()
+        out_q.put(None)
+
+def process_video_pipelined(path: str, cfg: Config) -> None:
+    """
+    Modo pipeline: captura/codificação em uma thread, envio com sessão keep-alive e
+    até `cfg.inflight` requisições simultâneas. Os resultados são tratados na ordem
+    dos frames (`cfg.ordered`) ou à medida que chegam.
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        print(f"[ERRO] Não foi possível abrir o vídeo: {path}")
+        sys.exit(1)
+
+    print(f"[INFO] Enviando frames de '{path}' para {cfg.endpoint} (pipeline)")
+    print(f"[INFO] 1 a cada {cfg.frame_skip} frames | limite: {cfg.max_seconds}s | timeout: {cfg.timeout}s")
+    print(f"[INFO] Em voo: {cfg.inflight} | resultados {'em ordem' if cfg.ordered else 'fora de ordem'}")
+    if cfg.edge_detect:
+        print(f"[INFO] Detecção local: enviando apenas recortes para {cfg.crop_endpoint}")
+
+    start = time.time()
+    counters = {"total": 0, "bytes": 0}
+    sent = 0
+    failed = 0
+    frames_q: queue.Queue = queue.Queue(maxsize=cfg.inflight * 2)
+    stop = threading.Event()
+    controller = make_controller(cfg)
+    producer = threading.Thread(target=_produce_frames, args=(cap, cfg, frames_q, stop, counters, controller),
+                                daemon=True)
+    session = make_session(cfg.inflight)
+    executor = ThreadPoolExecutor(max_workers=cfg.inflight, thread_name_prefix="sender")
+    in_flight = deque()  # (frame_idx, future) na ordem de envio
+
+    def handle(frame_idx, future):
+        nonlocal sent, failed
+        try:
+            result = future.result()
+            sent += 1
+            faces = len(result.get("faces", [])) if isinstance(result, dict) else 0
+            if faces:
+                print(f"[INFO] Frame {frame_idx}: {faces} face(s)")
+        except requests.exceptions.RequestException as e:
+            failed += 1
+            print(f"[WARN] Falha ao enviar frame {frame_idx}: {e}")
+        if sent and sent % 5 == 0:
+            print(f"[INFO] Enviados: {sent} | Lidos: {counters['total']} | Elapsed: {time.time() - start:.1f}s")
+
+    def drain(block: bool):
+        """Trata resultados prontos; com block=True espera pelo menos um."""
+        if cfg.ordered:
+            while in_flight and (block or in_flight[0][1].done()):
+                frame_idx, future = in_flight.popleft()
+                handle(frame_idx, future)
+                block = False
+        else:
+            futures = [f for _, f in in_flight]
+            if not futures:
+                return
+            done, _ = wait(futures, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for item in [item for item in in_flight if item[1] in done]:
+                in_flight.remove(item)
+                handle(*item)
+
+    producer.start()
+    try:
+        while True:
+            item = frames_q.get()
+            if item is None:
+                break
+            while len(in_flight) >= cfg.inflight:
+                drain(block=True)
+            frame_idx, endpoint, payload = item
+            future = executor.submit(send_payload, endpoint, payload, cfg.timeout,
+                                     cfg.retries, cfg.backoff_ms, session, controller)
+            in_flight.append((frame_idx, future))
+            drain(block=False)
+        while in_flight:
+            drain(block=True)
+    except KeyboardInterrupt:
+        print("\n[INFO] Interrompido pelo usuário (Ctrl+C).")
+    finally:
+        stop.set()
+        producer.join(timeout=5)
+        executor.shutdown(wait=True, cancel_futures=True)
+        cap.release()
+        session.close()
 
     elapsed = time.time() - start
-    print(f"[OK] Total lidos: {total} | Total enviados: {sent} | Tempo: {elapsed:.1f}s")
+    print(f"[OK] Total lidos: {counters['total']} | Total enviados: {sent} | Falhas: {failed} | "
+          f"Tempo: {elapsed:.1f}s | {sent / elapsed if elapsed > 0 else 0:.2f} frames/s | "
+          f"Enviado: {counters['bytes'] / 1e6:.2f} MB")
 
 def main():
     parser = argparse.ArgumentParser(description="Envia frames de um vídeo para o backend.")
@@ -128,6 +474,28 @@ def main():
                         help="Número de tentativas extras por frame (default: 1)")
     parser.add_argument("--backoff-ms", type=int, default=500,
                         help="Backoff entre tentativas (ms) (default: 500)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Captura/codificação em paralelo com o envio e várias requisições em voo")
+    parser.add_argument("--inflight", type=int, default=4,
+                        help="Máximo de requisições simultâneas no modo pipeline (default: 4)")
+    parser.add_argument("--unordered", action="store_true",
+                        help="No modo pipeline, tratar as respostas na ordem de chegada (default: ordem dos frames)")
+    parser.add_argument("--edge-detect", action="store_true",
+                        help="Detecta as faces localmente (MediaPipe) e envia só os recortes")
+    parser.add_argument("--crop-endpoint", default=DEFAULT_CROP_ENDPOINT,
+                        help=f"Endpoint para os recortes (default: {DEFAULT_CROP_ENDPOINT})")
+    parser.add_argument("--edge-min-conf", type=float, default=0.5,
+                        help="Confiança mínima da detecção local (default: 0.5)")
+    parser.add_argument("--edge-pad", type=float, default=0.10,
+                        help="Margem em volta de cada face, relativa ao maior lado (default: 0.10)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Ajusta intervalo, resolução e qualidade JPEG pela carga anunciada pelo servidor")
+    parser.add_argument("--target-latency-ms", type=int, default=2000,
+                        help="Latência alvo do modo adaptativo (ms) (default: 2000)")
+    parser.add_argument("--max-interval-ms", type=int, default=10000,
+                        help="Intervalo máximo entre envios no modo adaptativo (ms) (default: 10000)")
+    parser.add_argument("--camera", default=None,
+                        help="Identificador da câmera, gravado nas presenças e usado na fila justa do servidor")
     args = parser.parse_args()
 
     cfg = Config(
@@ -140,8 +508,22 @@ def main():
         jpeg_quality=max(1, min(95, args.quality)),
         retries=max(0, args.retries),
         backoff_ms=max(0, args.backoff_ms),
+        pipeline=bool(args.pipeline),
+        inflight=max(1, args.inflight),
+        ordered=not args.unordered,
+        edge_detect=bool(args.edge_detect),
+        crop_endpoint=args.crop_endpoint,
+        edge_min_conf=max(0.0, min(1.0, args.edge_min_conf)),
+        edge_pad=max(0.0, args.edge_pad),
+        adaptive=bool(args.adaptive),
+        target_latency_ms=max(1, args.target_latency_ms),
+        max_interval_ms=max(0, args.max_interval_ms),
+        camera=args.camera,
     )
-    process_video(args.video, cfg)
+    if cfg.pipeline:
+        process_video_pipelined(args.video, cfg)
+    else:
+        process_video(args.video, cfg)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,220 @@
+"""
+Gerador de carga: reproduz N vídeos como N câmeras simultâneas enviando frames
+para o backend, a uma taxa alvo (FPS por câmera), e mede a latência de cada requisição.
+
+Exemplo:
+    python load_test.py A01-ENTRADA.avi A02-ENTRADA.avi --cameras 8 --fps 1 --duration 60 --jpeg --json carga.json --csv carga.csv
+"""
+import argparse
+import csv
+import json
+import math
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+import cv2
+import requests
+
+from desktop_senderV2 import DEFAULT_ENDPOINT, frame_to_data_url
+
+
+@dataclass
+class Sample:
+    camera: str
+    seq: int
+    sent_at: float        # segundos desde o início do teste
+    encode_ms: float
+    latency_ms: Optional[float]
+    status: Optional[int]
+    faces: Optional[int]
+    error: Optional[str]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Percentil nearest-rank (p entre 0 e 100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return round(ordered[rank - 1], 2)
+
+
+def summarize(samples: List[Sample], elapsed_s: float, target_fps: float, cameras: int) -> dict:
+    ok = [s for s in samples if s.error is None]
+    latencies = [s.latency_ms for s in ok]
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": len(samples) - len(ok),
+        "error_rate": round((len(samples) - len(ok)) / len(samples), 4) if samples else 0.0,
+        "latency_p50_ms": percentile(latencies, 50),
+        "latency_p95_ms": percentile(latencies, 95),
+        "latency_p99_ms": percentile(latencies, 99),
+        "latency_max_ms": round(max(latencies), 2) if latencies else None,
+        "encode_p50_ms": percentile([s.encode_ms for s in samples], 50),
+        "target_rps": round(target_fps * cameras, 3),
+        "achieved_rps": round(len(ok) / elapsed_s, 3) if elapsed_s > 0 else None,
+        "faces": sum(s.faces or 0 for s in ok),
+    }
+
+
+class Camera(threading.Thread):
+    """
+    Uma câmera simulada: lê o vídeo na cadência alvo e envia um frame por vez.
+    Se a resposta demorar mais que o intervalo, os horários perdidos são descartados
+    (como uma câmera real que não enfileira frames) e contados em `missed`.
+    """
+
+    def __init__(self, name: str, video: str, args, t0: float, stop: threading.Event):
+        super().__init__(name=name, daemon=True)
+        self.camera = name
+        self.video = video
+        self.args = args
+        self.t0 = t0
+        self.stop_event = stop
+        self.samples: List[Sample] = []
+        self.missed = 0
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.video)
+        if not cap.isOpened():
+            raise RuntimeError(f"Não foi possível abrir o vídeo: {self.video}")
+        return cap
+
+    def run(self):
+        args = self.args
+        session = requests.Session()
+        cap = self._open()
+        video_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        # Quantos frames do vídeo avançar a cada envio para manter o tempo do vídeo
+        step = max(1, round(video_fps / args.fps))
+        interval = 1.0 / args.fps
+        seq = 0
+        next_slot = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                ok, frame = cap.read()
+                if not ok:
+                    if not args.loop:
+                        break
+                    cap.release()
+                    cap = self._open()
+                    continue
+                for _ in range(step - 1):
+                    cap.grab()
+
+                now = time.perf_counter()
+                if now < next_slot:
+                    if self.stop_event.wait(next_slot - now):
+                        break
+
+                t_enc = time.perf_counter()
+                data_url = frame_to_data_url(frame, args.jpeg, args.quality)
+                encode_ms = (time.perf_counter() - t_enc) * 1000
+
+                sent = time.perf_counter()
+                status = faces = error = latency = None
+                try:
+                    headers = {"X-Camera-Id": self.camera}
+                    r = session.post(args.endpoint, json={"image": data_url}, headers=headers,
+                                     timeout=args.timeout)
+                    latency = (time.perf_counter() - sent) * 1000
+                    status = r.status_code
+                    if r.ok:
+                        faces = len(r.json().get("faces", []))
+                    else:
+                        error = f"HTTP {r.status_code}"
+                except requests.exceptions.RequestException as e:
+                    latency = (time.perf_counter() - sent) * 1000
+                    error = type(e).__name__
+                self.samples.append(Sample(self.camera, seq, round(sent - self.t0, 4), round(encode_ms, 2),
+                                           round(latency, 2) if latency is not None else None,
+                                           status, faces, error))
+                seq += 1
+
+                next_slot += interval
+                behind = time.perf_counter() - next_slot
+                if behind > 0:
+                    skipped = int(behind // interval) + 1
+                    self.missed += skipped
+                    next_slot += skipped * interval
+        finally:
+            cap.release()
+            session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga com várias câmeras simuladas.")
+    parser.add_argument("videos", nargs="+", help="Vídeos a reproduzir (reutilizados em ciclo se --cameras for maior)")
+    parser.add_argument("--cameras", type=int, default=None, help="Número de câmeras simuladas (default: nº de vídeos)")
+    parser.add_argument("--fps", type=float, default=1.0, help="FPS alvo por câmera (default: 1.0)")
+    parser.add_argument("--duration", type=float, default=60.0, help="Duração do teste em segundos (default: 60)")
+    parser.add_argument("--loop", action="store_true", help="Reinicia o vídeo ao terminar")
+    parser.add_argument("--endpoint", default=DEFAULT_ENDPOINT, help=f"Endpoint do backend (default: {DEFAULT_ENDPOINT})")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Timeout por requisição em segundos (default: 60.0)")
+    parser.add_argument("--jpeg", action="store_true", help="Enviar como JPEG (default: PNG)")
+    parser.add_argument("--quality", type=int, default=80, help="Qualidade JPEG 1-95 (default: 80)")
+    parser.add_argument("--json", help="Arquivo JSON com o resumo (e as amostras)")
+    parser.add_argument("--csv", help="Arquivo CSV com uma linha por requisição")
+    args = parser.parse_args()
+    args.fps = max(1e-3, args.fps)
+    args.quality = max(1, min(95, args.quality))
+    n_cameras = max(1, args.cameras or len(args.videos))
+
+    stop = threading.Event()
+    t0 = time.perf_counter()
+    cameras = [Camera(f"cam{i + 1:02d}", args.videos[i % len(args.videos)], args, t0, stop)
+               for i in range(n_cameras)]
+    print(f"[INFO] {n_cameras} câmeras x {args.fps} FPS -> alvo de {n_cameras * args.fps:.2f} req/s em {args.endpoint}")
+    for cam in cameras:
+        cam.start()
+    try:
+        while any(c.is_alive() for c in cameras) and time.perf_counter() - t0 < args.duration:
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        print("\n[INFO] Interrompido pelo usuário (Ctrl+C).")
+    stop.set()
+    for cam in cameras:
+        cam.join(timeout=args.timeout + 1)
+    elapsed = time.perf_counter() - t0
+
+    all_samples = [s for cam in cameras for s in cam.samples]
+    overall = summarize(all_samples, elapsed, args.fps, n_cameras)
+    overall["missed_slots"] = sum(c.missed for c in cameras)
+    per_camera = {}
+    for cam in cameras:
+        per_camera[cam.camera] = summarize(cam.samples, elapsed, args.fps, 1)
+        per_camera[cam.camera].update({"video": cam.video, "missed_slots": cam.missed})
+
+    print(f"\n{'câmera':<8} {'req':>6} {'erros':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>7}")
+    for name, s in per_camera.items():
+        print(f"{name:<8} {s['requests']:>6} {s['errors']:>6} {str(s['latency_p50_ms']):>9} "
+              f"{str(s['latency_p95_ms']):>9} {str(s['latency_p99_ms']):>9} {str(s['achieved_rps']):>7}")
+    print(f"\n[OK] {overall['requests']} requisições em {elapsed:.1f}s | "
+          f"vazão: {overall['achieved_rps']} req/s (alvo {overall['target_rps']}) | "
+          f"erros: {overall['error_rate']:.1%} | p50/p95/p99: {overall['latency_p50_ms']}/"
+          f"{overall['latency_p95_ms']}/{overall['latency_p99_ms']} ms | horários perdidos: {overall['missed_slots']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "config": {k: v for k, v in vars(args).items() if k not in ("json", "csv")} | {"cameras": n_cameras},
+                "elapsed_s": round(elapsed, 3),
+                "overall": overall,
+                "per_camera": per_camera,
+                "samples": [asdict(s) for s in all_samples],
+            }, f, indent=2, ensure_ascii=False)
+        print(f"[OK] Resumo gravado em {args.json}")
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(Sample.__dataclass_fields__))
+            writer.writeheader()
+            for s in sorted(all_samples, key=lambda s: s.sent_at):
+                writer.writerow(asdict(s))
+        print(f"[OK] Amostras gravadas em {args.csv}")
+
+
+if __name__ == "__main__":
+    main()